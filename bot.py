@@ -9,14 +9,13 @@ import utils.decorators as decorators
 from md2tgmd.src.md2tgmd import escape, split_code, replace_all
 from aient.src.aient.utils.prompt import translator_en2zh_prompt, translator_prompt
 from aient.src.aient.utils.scripts import Document_extract, claude_replace
-from aient.src.aient.core.utils import get_engine, get_image_message, get_text_message
+from aient.src.aient.core.utils import get_image_message, get_text_message
 import config
 from resume_handler_improved import handle_document_resumebek_improved as handle_document_resumebek
 from config import (
     WEB_HOOK,
     PORT,
     BOT_TOKEN,
-    GET_MODELS,
     GOOGLE_AI_API_KEY,
     VERTEX_PROJECT_ID,
     VERTEX_PRIVATE_KEY,
@@ -31,13 +30,10 @@ from config import (
     get_current_lang,
     update_info_message,
     update_menu_buttons,
-    remove_no_text_model,
-    update_initial_model,
     update_models_buttons,
     update_language_status,
     update_first_buttons_message,
-    get_all_available_models,
-    get_model_groups,
+    get_model_registry,
     CUSTOM_MODELS_LIST,
     MODEL_GROUPS,
     RESUME_ANALYSIS_MODE,
@@ -45,17 +41,25 @@ from config import (
 
 from utils.i18n import strings
 from utils.scripts import GetMesageInfo, safe_get, is_emoji
+from utils.usage import estimate_tokens, QuotaExceeded
+from utils.debounce import collapse_callbacks
+from utils.hedging import HedgedStream
+from utils.response_cache import replay
+from utils.chunked import split_paragraphs, ordered_stream
+from utils import deadline
 
 from telegram.constants import ChatAction
 from telegram import BotCommand, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto, InlineKeyboardButton
 from telegram.ext import CommandHandler, MessageHandler, ApplicationBuilder, filters, CallbackQueryHandler, Application, AIORateLimiter, InlineQueryHandler, ContextTypes
-from datetime import timedelta
 
+import copy
+import time
 import asyncio
 lock = asyncio.Lock()
 event = asyncio.Event()
 stop_event = asyncio.Event()
-time_out = 600
+# 长轮询 getUpdates 的等待时间，读超时需在此基础上留出余量
+poll_timeout = 50
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger()
@@ -85,6 +89,7 @@ from collections import defaultdict
 message_cache = defaultdict(lambda: [])
 time_stamps = defaultdict(lambda: [])
 
+@decorators.Deadline
 @decorators.PrintMessage
 @decorators.GroupAuthorization
 @decorators.Authorization
@@ -96,7 +101,9 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
     if has_command == False or len(context.args) > 0:
         if has_command:
             message = ' '.join(context.args)
-        pass_history = Users.get_config(convo_id, "PASS_HISTORY")
+        settings = Users.snapshot(convo_id)
+        pass_history = settings["PASS_HISTORY"]
+        translation = None
         if prompt and has_command:
             if translator_prompt == prompt:
                 if language == "english":
@@ -104,6 +111,7 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
                 else:
                     prompt = translator_en2zh_prompt
                 pass_history = 0
+                translation = prompt
             message = prompt + message
         if message == None:
             message = voice_text
@@ -120,20 +128,36 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
             message = update_message.reply_to_message.caption
 
         if message:
-            if pass_history >= 3:
-                # 移除已存在的任务（如果有）
-                remove_job_if_exists(convo_id, context)
-                # 添加新的定时任务
-                context.job_queue.run_once(
-                    scheduled_function,
-                    when=timedelta(seconds=RESET_TIME),
+            usage_id = str(update.effective_user.id) if update.effective_user else convo_id
+            try:
+                config.enforce_quota(usage_id)
+            except QuotaExceeded:
+                await context.bot.send_message(
+                    chat_id=chatid,
+                    message_thread_id=message_thread_id,
+                    text=escape(strings['message_quota_exceeded'][get_current_lang(convo_id)]),
+                    parse_mode='MarkdownV2',
+                    reply_to_message_id=messageid,
+                )
+                return
+            if not config.quota_exempt(usage_id) and config.usage_ledger.should_warn(usage_id):
+                await context.bot.send_message(
                     chat_id=chatid,
-                    name=convo_id
+                    message_thread_id=message_thread_id,
+                    text=escape(strings['message_quota_warning'][get_current_lang(convo_id)]),
+                    parse_mode='MarkdownV2',
                 )
 
+            # 与后续的 Telegram 请求并行建立到上游的连接
+            config.warm_user(convo_id)
+
+            if pass_history >= 3:
+                # 刷新会话的过期时间，由 expire_conversations 统一重置
+                config.conversation_expiry.touch(convo_id, chatid)
+
             bot_info_username = None
             try:
-                bot_info = await context.bot.get_me(read_timeout=time_out, write_timeout=time_out, connect_timeout=time_out, pool_timeout=time_out)
+                bot_info = await context.bot.get_me(**deadline.telegram(config.TELEGRAM_TIMEOUT))
                 bot_info_username = bot_info.username
             except Exception as e:
                 bot_info_username = update_message.reply_to_message.from_user.username
@@ -142,7 +166,7 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
             if update_message.reply_to_message \
             and update_message.from_user.is_bot == False \
             and (update_message.reply_to_message.from_user.username == bot_info_username or message_has_nick):
-                if update_message.reply_to_message.from_user.is_bot and Users.get_config(convo_id, "TITLE") == True:
+                if update_message.reply_to_message.from_user.is_bot and settings["TITLE"] == True:
                     message = message + "\n" + '\n'.join(reply_to_message_text.split('\n')[1:])
                 else:
                     if reply_to_message_text:
@@ -153,13 +177,9 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
             and update_message.reply_to_message.from_user.username != bot_info_username:
                 return
 
-            robot, role, api_key, api_url = get_robot(convo_id)
-            engine = Users.get_config(convo_id, "engine")
-
-            if Users.get_config(convo_id, "LONG_TEXT"):
+            if settings["LONG_TEXT"]:
                 async with lock:
                     message_cache[convo_id].append(message)
-                    import time
                     time_stamps[convo_id].append(time.time())
                     if len(message_cache[convo_id]) == 1:
                         print("first message len:", len(message_cache[convo_id][0]))
@@ -184,16 +204,18 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
                 message = "\n".join(message_cache[convo_id])
                 message_cache[convo_id] = []
                 time_stamps[convo_id] = []
+            # engine 为 auto 时按消息内容选择快速或强模型
+            auto_route, engine = config.choose_engine(convo_id, message, attachments=bool(image_url or file_url))
+            robot, role, api_key, api_url = get_robot(convo_id, engine)
+
             # if Users.get_config(convo_id, "TYPING"):
             #     await context.bot.send_chat_action(chat_id=chatid, message_thread_id=message_thread_id, action=ChatAction.TYPING)
-            if Users.get_config(convo_id, "TITLE"):
-                title = f"`🤖️ {engine}`\n\n"
-            if Users.get_config(convo_id, "REPLY") == False:
+            if settings["TITLE"]:
+                title = f"`🤖️ {config.AUTO_MODEL} → {engine}`\n\n" if auto_route else f"`🤖️ {engine}`\n\n"
+            if settings["REPLY"] == False:
                 messageid = None
 
-            engine_type, _ = get_engine({"base_url": api_url}, endpoint=None, original_model=engine)
-            if robot.__class__.__name__ == "chatgpt":
-                engine_type = "gpt"
+            engine_type = config.routing_table.route(engine).engine_type
             if image_url:
                 message_list = []
                 image_message = await get_image_message(image_url, engine_type)
@@ -203,9 +225,12 @@ async def command_bot(update, context, language=None, prompt=translator_prompt,
                 message = message_list
             elif file_url:
                 image_url = file_url
-                message = await Document_extract(file_url, image_url, engine_type) + message
+                message = await deadline.run("extract", Document_extract(file_url, image_url, engine_type)) + message
 
-            await getChatGPT(update_message, context, title, robot, message, chatid, messageid, convo_id, message_thread_id, pass_history, api_key, api_url, engine)
+            if pass_history >= 3:
+                config.history_slimmer.prepare(robot, convo_id, message)
+
+            await getChatGPT(update_message, context, title, robot, message, chatid, messageid, convo_id, message_thread_id, pass_history, api_key, api_url, engine, usage_id=usage_id, auto_route=auto_route, translation_prompt=translation)
     else:
         message = await context.bot.send_message(
             chat_id=chatid,
@@ -240,20 +265,118 @@ async def is_bot_blocked(bot, user_id: int) -> bool:
         # 处理其他可能的错误
         return False  # 如果是其他错误，我们假设机器人未被封禁
 
-async def getChatGPT(update_message, context, title, robot, message, chatid, messageid, convo_id, message_thread_id, pass_history=0, api_key=None, api_url=None, engine = None):
+async def ask_stream(robot, text, convo_id, model_name, api_url, api_key, usage_id=None, **kwargs):
+    """robot.ask_stream_async through the shared retry budget and circuit breaker of its provider.
+
+    With a usage_id the request is refused over the user's hard quota and its
+    tokens are recorded in the usage ledger afterwards.
+    """
+    config.enforce_quota(usage_id)
+    # 失败的请求已把消息加入会话，重试或放弃前先恢复，避免历史里出现重复的提问
+    snapshot = None
+    if kwargs.get("pass_history", 0) > 2 and convo_id in robot.conversation:
+        snapshot = copy.deepcopy(robot.conversation[convo_id])
+
+    def restore():
+        if snapshot is not None:
+            robot.conversation[convo_id] = copy.deepcopy(snapshot)
+
+    # 配置了多个 key 时，重试换用同一 key 池中的下一个 key
+    attempt = {"robot": robot, "api_key": api_key}
+    def retry():
+        restore()
+        attempt["robot"], attempt["api_key"] = config.rotate_key(attempt["robot"], api_url, attempt["api_key"])
+
+    def resilient():
+        return config.resilience.stream(
+            config.upstream_name(model_name, api_url),
+            lambda: hedged_stream(attempt["robot"], text, convo_id, model_name, api_url, attempt["api_key"], **kwargs),
+            on_retry=retry,
+        )
+
+    if kwargs.get("pass_history", 0) < 3:
+        # 不带历史的回答只取决于模型、提示词和消息，相同的并发请求共用一个上游流
+        key = config.flight_key(model_name, kwargs.get("system_prompt"), text, api_url, api_key, kwargs.get("language"), kwargs.get("plugins"))
+        source = config.single_flight.stream(key, resilient)
+    else:
+        source = resilient()
+
+    started = False
+    start_time = time.time()
+    answer_parts = []
+    try:
+        async for data in source:
+            started = True
+            if "message_search_stage_" not in data:
+                answer_parts.append(data)
+            yield data
+    except asyncio.CancelledError:
+        # 超出时间预算被取消时同样恢复会话
+        if not started:
+            restore()
+        raise
+    except Exception as e:
+        if not started and config.resilience.transient(e):
+            restore()
+        raise
+    finally:
+        if usage_id:
+            history = robot.conversation.get(convo_id) or []
+            if kwargs.get("pass_history", 0) >= 3 and history:
+                prompt_tokens = estimate_tokens(history[:-1])
+            else:
+                prompt_tokens = estimate_tokens(text) + estimate_tokens(kwargs.get("system_prompt"))
+            config.usage_ledger.record(usage_id, model_name, prompt_tokens, estimate_tokens("".join(answer_parts)), time.time() - start_time)
+
+async def hedged_stream(robot, text, convo_id, model_name, api_url, api_key, **kwargs):
+    """robot.ask_stream_async, hedged with a backup model when the first token is late."""
+    def ask(robot, convo_id, model_name, api_url, api_key):
+        return robot.ask_stream_async(text, convo_id=convo_id, model=model_name, api_url=api_url, api_key=api_key, **kwargs)
+
+    # 没有可复用的热连接时，这次的首字延迟单独统计为冷启动
+    cold = {"primary": config.client_pool.is_cold(api_url, api_key)}
+    backup = config.get_hedge_backup(model_name, robot, convo_id)
+    if backup:
+        backup_robot, backup_model, backup_key, backup_url = backup
+        cold["backup"] = config.client_pool.is_cold(backup_url, backup_key)
+        # 备用请求使用会话的副本，胜出后再替换原会话
+        scratch_id = f"{convo_id}:hedge"
+        if convo_id in robot.conversation:
+            backup_robot.conversation[scratch_id] = copy.deepcopy(robot.conversation[convo_id])
+        stream = HedgedStream(
+            lambda: ask(robot, convo_id, model_name, api_url, api_key),
+            lambda: ask(backup_robot, scratch_id, backup_model, backup_url, backup_key),
+            delay=config.ttft_tracker.threshold(model_name),
+        )
+    else:
+        stream = HedgedStream(lambda: ask(robot, convo_id, model_name, api_url, api_key))
+    try:
+        async for data in stream:
+            yield data
+    finally:
+        if backup:
+            scratch = backup_robot.conversation.pop(scratch_id, None)
+            if stream.winner == "backup" and scratch is not None:
+                robot.conversation[convo_id] = scratch
+                print(f"hedge: {backup_model} answered before {model_name}")
+        if stream.ttft is not None:
+            config.ttft_tracker.record(backup_model if stream.winner == "backup" else model_name, stream.ttft, cold=cold[stream.winner])
+
+async def getChatGPT(update_message, context, title, robot, message, chatid, messageid, convo_id, message_thread_id, pass_history=0, api_key=None, api_url=None, engine = None, usage_id = None, auto_route = None, translation_prompt = None):
     lastresult = title
     text = message
     result = ""
     tmpresult = ""
     modifytime = 0
-    time_out = 600
     image_has_send = 0
     model_name = engine
-    language = Users.get_config(convo_id, "language")
+    settings = Users.snapshot(convo_id)
+    language = settings["language"]
     if "claude" in model_name:
-        system_prompt = Users.get_config(convo_id, "claude_systemprompt")
+        system_prompt = settings["claude_systemprompt"]
     else:
-        system_prompt = Users.get_config(convo_id, "systemprompt")
+        system_prompt = settings["systemprompt"]
+    system_prompt = config.request_layout.system_prompt(system_prompt)
     plugins = Users.extract_plugins_config(convo_id)
 
     Frequency_Modification = 20
@@ -276,14 +399,41 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
     else:
         return
 
+    start_time = time.time()
+    answer_parts = []
+    failed = False
+    # 翻译命令的结果按原文缓存，命中时直接回放，不请求上游
+    cache_key = cached = None
+    translating = translation_prompt is not None and isinstance(text, str) and text.startswith(translation_prompt)
+    if translating and config.translation_cache:
+        cache_key = config.translation_key(model_name, system_prompt, text, api_url, api_key)
+        cached = await config.translation_cache.get(cache_key)
+    parts = split_paragraphs(text[len(translation_prompt):], config.TRANSLATION_CHUNK_CHARS) if translating else []
+    if cached:
+        source = replay(cached)
+    elif len(parts) > 1:
+        # 长文按段落切块并发翻译，按原顺序输出
+        def translate_part(index, part):
+            part_id = f"{convo_id}:part{index}"
+            async def stream():
+                try:
+                    async for data in ask_stream(robot, translation_prompt + part, part_id, model_name, api_url, api_key, usage_id=usage_id or convo_id, pass_history=0, language=language, system_prompt=system_prompt, plugins=plugins):
+                        yield data
+                finally:
+                    robot.conversation.pop(part_id, None)
+            return stream
+        source = ordered_stream([translate_part(index, part) for index, part in enumerate(parts)], config.translation_slots)
+    else:
+        source = ask_stream(robot, text, convo_id, model_name, api_url, api_key, usage_id=usage_id or convo_id, pass_history=pass_history, language=language, system_prompt=system_prompt, plugins=plugins)
     try:
         # print("text", text)
-        async for data in robot.ask_stream_async(text, convo_id=convo_id, pass_history=pass_history, model=model_name, language=language, api_url=api_url, api_key=api_key, system_prompt=system_prompt, plugins=plugins):
+        async for data in deadline.stream("upstream", source):
         # for data in robot.ask_stream(text, convo_id=convo_id, pass_history=pass_history, model=model_name):
             if stop_event.is_set() and convo_id == target_convo_id and answer_messageid < reset_mess_id:
                 return
             if "message_search_stage_" not in data:
                 result = result + data
+                answer_parts.append(data)
             tmpresult = result
             if re.sub(r"```", '', result.split("\n")[-1]).count("`") % 2 != 0:
                 tmpresult = result + "`"
@@ -294,7 +444,8 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
                 tmpresult = claude_replace(tmpresult)
             if "message_search_stage_" in data:
                 tmpresult = strings[data][get_current_lang(convo_id)]
-            history = robot.conversation[convo_id]
+            # 合并的请求只有发起者的会话里有这次问答
+            history = robot.conversation.get(convo_id) or []
             if safe_get(history, -2, "tool_calls", 0, 'function', 'name') == "generate_image" and not image_has_send and safe_get(history, -1, 'content'):
                 image_result = history[-1]['content'].split('\n\n')[1]
                 await context.bot.send_photo(chat_id=chatid, photo=image_result, reply_to_message_id=messageid)
@@ -302,7 +453,7 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
             modifytime = modifytime + 1
 
             split_len = 3500
-            if len(tmpresult) > split_len and Users.get_config(convo_id, "LONG_TEXT_SPLIT"):
+            if len(tmpresult) > split_len and settings["LONG_TEXT_SPLIT"]:
                 Frequency_Modification = 40
 
                 # print("tmpresult", tmpresult)
@@ -373,10 +524,7 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
                             text=escape(send_split_message, italic=False),
                             parse_mode='MarkdownV2',
                             disable_web_page_preview=True,
-                            read_timeout=time_out,
-                            write_timeout=time_out,
-                            pool_timeout=time_out,
-                            connect_timeout=time_out
+                            **deadline.telegram(config.TELEGRAM_TIMEOUT),
                         )
                         lastresult = escape(send_split_message, italic=False)
                     except Exception as e:
@@ -386,10 +534,7 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
                                 message_id=answer_messageid,
                                 text=send_split_message,
                                 disable_web_page_preview=True,
-                                read_timeout=time_out,
-                                write_timeout=time_out,
-                                pool_timeout=time_out,
-                                connect_timeout=time_out
+                                **deadline.telegram(config.TELEGRAM_TIMEOUT),
                             )
                             print("error:", send_split_message)
                         else:
@@ -405,7 +550,7 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
             now_result = escape(tmpresult, italic=False)
             if now_result and (modifytime % Frequency_Modification == 0 and lastresult != now_result) or "message_search_stage_" in data:
                 try:
-                    await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=now_result, parse_mode='MarkdownV2', disable_web_page_preview=True, read_timeout=time_out, write_timeout=time_out, pool_timeout=time_out, connect_timeout=time_out)
+                    await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=now_result, parse_mode='MarkdownV2', disable_web_page_preview=True, **deadline.telegram(config.TELEGRAM_TIMEOUT))
                     lastresult = now_result
                 except Exception as e:
                     # print('\033[31m')
@@ -413,20 +558,29 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
                     # print('\033[0m')
                     continue
     except Exception as e:
+        failed = True
         print('\033[31m')
         traceback.print_exc()
         print(tmpresult)
         print('\033[0m')
-        api_key = Users.get_config(convo_id, "api_key")
-        systemprompt = Users.get_config(convo_id, "systemprompt")
-        if api_key:
+        api_key = settings["api_key"]
+        systemprompt = settings["systemprompt"]
+        # 超时、限流等临时故障时会话已恢复，只有请求本身出错才清空会话
+        if api_key and not config.resilience.transient(e) and not isinstance(e, QuotaExceeded):
             robot.reset(convo_id=convo_id, system_prompt=systemprompt)
         if "parse entities" in str(e):
-            await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=tmpresult, disable_web_page_preview=True, read_timeout=time_out, write_timeout=time_out, pool_timeout=time_out, connect_timeout=time_out)
+            await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=tmpresult, disable_web_page_preview=True, **deadline.telegram(config.TELEGRAM_TIMEOUT))
         else:
             tmpresult = f"{tmpresult}\n\n`{e}`"
     print(tmpresult)
 
+    answer = "".join(answer_parts)
+    if cache_key and not cached and not failed and answer.strip():
+        await config.translation_cache.put(cache_key, answer)
+    # 用量由 ask_stream 记录；缓存命中不计入自动路由的延迟统计
+    if auto_route and not cached:
+        config.auto_router.record(auto_route, time.time() - start_time, failed=failed, empty=not answer.strip())
+
     # 添加图片URL检测和发送
     if image_has_send == 0:
         image_extensions = r'(https?://[^\s<>\"()]+(?:\.(?:webp|jpg|jpeg|png|gif)|/image)[^\s<>\"()]*)'
@@ -458,12 +612,12 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
             print(now_result)
         elif now_result:
             try:
-                await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=now_result, parse_mode='MarkdownV2', disable_web_page_preview=True, read_timeout=time_out, write_timeout=time_out, pool_timeout=time_out, connect_timeout=time_out)
+                await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=now_result, parse_mode='MarkdownV2', disable_web_page_preview=True, **deadline.telegram(config.TELEGRAM_TIMEOUT))
             except Exception as e:
                 if "parse entities" in str(e):
-                    await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=tmpresult, disable_web_page_preview=True, read_timeout=time_out, write_timeout=time_out, pool_timeout=time_out, connect_timeout=time_out)
+                    await context.bot.edit_message_text(chat_id=chatid, message_id=answer_messageid, text=tmpresult, disable_web_page_preview=True, **deadline.telegram(config.TELEGRAM_TIMEOUT))
 
-    if Users.get_config(convo_id, "FOLLOW_UP") and tmpresult.strip():
+    if settings["FOLLOW_UP"] and tmpresult.strip():
         if title != "":
             info = "\n\n".join(tmpresult.split("\n\n")[1:])
         else:
@@ -475,7 +629,17 @@ async def getChatGPT(update_message, context, title, robot, message, chatid, mes
             "{}"
             "</infomation>"
         ).format(info)
-        result = (await config.SummaryBot.ask_async(prompt, convo_id=convo_id, model=model_name, pass_history=0, api_url=api_url, api_key=api_key)).split('\n')
+        try:
+            result = (await deadline.run("follow_up", config.metered_call(usage_id or convo_id, model_name, prompt, lambda: config.single_flight.call(
+                config.flight_key(model_name, None, prompt, api_url, api_key, "follow_up"),
+                lambda: config.resilience.call(
+                    config.upstream_name(model_name, api_url),
+                    lambda: config.SummaryBot.ask_async(prompt, convo_id=convo_id, model=model_name, pass_history=0, api_url=api_url, api_key=api_key),
+                ),
+            )))).split('\n')
+        except (deadline.DeadlineExceeded, QuotaExceeded):
+            # 回答已完整显示，没时间或没额度生成追问时直接跳过
+            return
         keyboard = []
         result = [i for i in result if i.strip() and len(i) > 5]
         print(result)
@@ -492,126 +656,83 @@ async def button_press(update, context):
     """Function to handle the button press"""
     _, _, _, _, _, _, _, _, convo_id, _, _, _ = await GetMesageInfo(update, context)
     callback_query = update.callback_query
-    info_message = update_info_message(convo_id)
+    usage_id = str(update.effective_user.id) if update.effective_user else None
     await callback_query.answer()
-    data = callback_query.data
-    banner = strings['message_banner'][get_current_lang(convo_id)]
-    import telegram
-    try:
-        if data.endswith("_MODELS"):
-            data = data[:-7]
-            Users.set_config(convo_id, "engine", data)
-            try:
-                info_message = update_info_message(convo_id)
-                message = await callback_query.edit_message_text(
-                    text=escape(info_message + banner),
-                    reply_markup=InlineKeyboardMarkup(update_models_buttons(convo_id)),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.info(e)
-                pass
-        elif data.endswith("_GROUP"):
-            # Processing a click on a group of models
-            group_name = data[:-6]
-            try:
-                message = await callback_query.edit_message_text(
-                    text=escape(info_message + f"\n\n**{strings['group_title'][get_current_lang(convo_id)]}:** `{group_name}`"),
-                    reply_markup=InlineKeyboardMarkup(update_models_buttons(convo_id, group=group_name)),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.info(e)
-                pass
-        elif data.startswith("MODELS"):
-            message = await callback_query.edit_message_text(
-                text=escape(info_message + banner),
-                reply_markup=InlineKeyboardMarkup(update_models_buttons(convo_id)),
-                parse_mode='MarkdownV2'
-            )
-
-        elif data.endswith("_LANGUAGES"):
-            data = data[:-10]
-            update_language_status(data, chat_id=convo_id)
-            try:
-                info_message = update_info_message(convo_id)
-                message = await callback_query.edit_message_text(
-                    text=escape(info_message, italic=False),
-                    reply_markup=InlineKeyboardMarkup(update_menu_buttons(LANGUAGES, "_LANGUAGES", convo_id)),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.info(e)
-                pass
-        elif data.startswith("LANGUAGE"):
-            message = await callback_query.edit_message_text(
-                text=escape(info_message, italic=False),
-                reply_markup=InlineKeyboardMarkup(update_menu_buttons(LANGUAGES, "_LANGUAGES", convo_id)),
-                parse_mode='MarkdownV2'
-            )
-
-        if data.endswith("_PREFERENCES"):
-            data = data[:-12]
-            try:
+    message_id = callback_query.message.message_id if callback_query.message else callback_query.inline_message_id
+
+    async def handle_taps(batch):
+        changes, data = collapse_callbacks(batch, toggle_suffixes=("_PREFERENCES", "_PLUGINS"), select_suffixes=("_MODELS", "_LANGUAGES"))
+        apply_button_changes(convo_id, changes)
+        await render_button_menu(callback_query, convo_id, usage_id, data)
+
+    await config.callback_coalescer.run((convo_id, message_id), callback_query.data, handle_taps)
+
+def apply_button_changes(convo_id, changes):
+    """Apply the net effect of a batch of taps with a single config write."""
+    values = {}
+    for data in changes:
+        try:
+            if data.endswith("_MODELS"):
+                values["engine"] = data[:-7]
+            elif data.endswith("_LANGUAGES"):
+                update_language_status(data[:-10], chat_id=convo_id)
+            elif data.endswith("_PREFERENCES"):
+                data = data[:-12]
                 current_data = Users.get_config(convo_id, data)
                 if data == "PASS_HISTORY":
-                    if current_data == 0:
-                        current_data = config.PASS_HISTORY or 9999
-                    else:
-                        current_data = 0
-                    Users.set_config(convo_id, data, current_data)
+                    values[data] = (config.PASS_HISTORY or 9999) if current_data == 0 else 0
                 else:
-                    Users.set_config(convo_id, data, not current_data)
-            except Exception as e:
-                logger.info(e)
-            try:
-                info_message = update_info_message(convo_id)
-                message = await callback_query.edit_message_text(
-                    text=escape(info_message, italic=False),
-                    reply_markup=InlineKeyboardMarkup(update_menu_buttons(PREFERENCES, "_PREFERENCES", convo_id)),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.info(e)
-                pass
-        elif data.startswith("PREFERENCES"):
-            message = await callback_query.edit_message_text(
-                text=escape(info_message, italic=False),
-                reply_markup=InlineKeyboardMarkup(update_menu_buttons(PREFERENCES, "_PREFERENCES", convo_id)),
-                parse_mode='MarkdownV2'
-            )
-
-        if data.endswith("_PLUGINS"):
-            data = data[:-8]
-            try:
-                current_data = Users.get_config(convo_id, data)
-                Users.set_config(convo_id, data, not current_data)
-            except Exception as e:
-                logger.info(e)
-            try:
-                info_message = update_info_message(convo_id)
-                message = await callback_query.edit_message_text(
-                    text=escape(info_message, italic=False),
-                    reply_markup=InlineKeyboardMarkup(update_menu_buttons(PLUGINS, "_PLUGINS", convo_id)),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.info(e)
-                pass
-        elif data.startswith("PLUGINS"):
-            message = await callback_query.edit_message_text(
-                text=escape(info_message, italic=False),
-                reply_markup=InlineKeyboardMarkup(update_menu_buttons(PLUGINS, "_PLUGINS", convo_id)),
-                parse_mode='MarkdownV2'
-            )
-
-        elif data.startswith("BACK"):
-            message = await callback_query.edit_message_text(
-                text=escape(info_message, italic=False),
-                reply_markup=InlineKeyboardMarkup(update_first_buttons_message(convo_id)),
-                parse_mode='MarkdownV2'
-            )
+                    values[data] = not current_data
+            elif data.endswith("_PLUGINS"):
+                data = data[:-8]
+                values[data] = not Users.get_config(convo_id, data)
+        except Exception as e:
+            logger.info(e)
+    if values:
+        Users.set_many(convo_id, values)
+
+async def render_button_menu(callback_query, convo_id, usage_id, data):
+    """Edit the settings message once to show the menu the last tap leads to."""
+    info_message = update_info_message(convo_id, usage_id)
+    lang = get_current_lang(convo_id)
+    banner = strings['message_banner'][lang]
+    page_match = re.match(r"^(.*)_PAGE_(\d+)$", data)
+    page = int(page_match.group(2)) if page_match else 0
+    if page_match:
+        data = page_match.group(1)
+    if data.endswith("_MODELS") or data.startswith("MODELS"):
+        text = escape(info_message + banner)
+        buttons = update_models_buttons(convo_id, page=page)
+    elif data.endswith("_GROUP"):
+        # Processing a click on a group of models
+        group_name = data[:-6]
+        text = escape(info_message + f"\n\n**{strings['group_title'][lang]}:** `{group_name}`")
+        buttons = update_models_buttons(convo_id, group=group_name, page=page)
+    elif data.endswith("_LANGUAGES") or data.startswith("LANGUAGE"):
+        text = escape(info_message, italic=False)
+        buttons = update_menu_buttons(LANGUAGES, "_LANGUAGES", convo_id)
+    elif data.endswith("_PREFERENCES") or data.startswith("PREFERENCES"):
+        text = escape(info_message, italic=False)
+        buttons = update_menu_buttons(PREFERENCES, "_PREFERENCES", convo_id)
+    elif data.endswith("_PLUGINS") or data.startswith("PLUGINS"):
+        text = escape(info_message, italic=False)
+        buttons = update_menu_buttons(PLUGINS, "_PLUGINS", convo_id)
+    elif data.startswith("BACK"):
+        text = escape(info_message, italic=False)
+        buttons = update_first_buttons_message(convo_id)
+    else:
+        return
+    import telegram
+    try:
+        await callback_query.edit_message_text(
+            text=text,
+            reply_markup=InlineKeyboardMarkup(buttons),
+            parse_mode='MarkdownV2'
+        )
     except telegram.error.BadRequest as e:
+        # 连续点击后状态没有变化时 Telegram 会拒绝相同内容的编辑
+        if "Message is not modified" in str(e):
+            return
         print('\033[31m')
         traceback.print_exc()
         if "Message to edit not found" in str(e):
@@ -619,14 +740,25 @@ async def button_press(update, context):
         else:
             print(f"error: {str(e)}")
         print('\033[0m')
+    except Exception as e:
+        logger.info(e)
 
+@decorators.Deadline
 @decorators.GroupAuthorization
 @decorators.Authorization
 @decorators.APICheck
 async def handle_file(update, context):
     _, _, image_url, chatid, _, _, _, message_thread_id, convo_id, file_url, _, voice_text = await GetMesageInfo(update, context)
+    usage_id = str(update.effective_user.id) if update.effective_user else convo_id
+    try:
+        config.enforce_quota(usage_id)
+    except QuotaExceeded:
+        await context.bot.send_message(chat_id=chatid, message_thread_id=message_thread_id, text=escape(strings['message_quota_exceeded'][get_current_lang(convo_id)]), parse_mode='MarkdownV2')
+        return
+    # 上传文件后通常紧接着提问，先建立到上游的连接
+    config.warm_user(convo_id)
     robot, role, api_key, api_url = get_robot(convo_id)
-    engine = Users.get_config(convo_id, "engine")
+    engine = config.current_engine(convo_id)
 
     if file_url == None and image_url:
         file_url = image_url
@@ -634,10 +766,8 @@ async def handle_file(update, context):
             return
     if image_url == None and file_url:
         image_url = file_url
-    engine_type, _ = get_engine({"base_url": api_url}, endpoint=None, original_model=engine)
-    if robot.__class__.__name__ == "chatgpt":
-        engine_type = "gpt"
-    message = await Document_extract(file_url, image_url, engine_type)
+    engine_type = config.routing_table.route(engine).engine_type
+    message = await deadline.run("extract", Document_extract(file_url, image_url, engine_type))
 
     robot.add_to_conversation(message, role, convo_id)
 
@@ -652,13 +782,22 @@ async def inlinequery(update: Update, context) -> None:
     """Handle the inline query."""
 
     chatid = update.effective_user.id
-    engine = Users.get_config(chatid, "engine")
+    engine = config.current_engine(chatid)
     query = update.inline_query.query
     if (query.endswith('.') or query.endswith('。')) and query.strip():
         prompt = "Answer the following questions as concisely as possible:\n\n"
         _, _, _, chatid, _, _, _, _, convo_id, _, _, _ = await GetMesageInfo(update, context)
         robot, role, api_key, api_url = get_robot(convo_id)
-        result = config.ChatGPTbot.ask(prompt + query, convo_id=convo_id, model=engine, api_url=api_url, api_key=api_key, pass_history=0)
+        try:
+            result = await config.metered_call(str(update.effective_user.id), engine, prompt + query, lambda: config.single_flight.call(
+                config.flight_key(engine, None, prompt + query, api_url, api_key, "inline"),
+                lambda: config.resilience.call(
+                    config.upstream_name(engine, api_url),
+                    lambda: config.ChatGPTbot.ask_async(prompt + query, convo_id=convo_id, model=engine, api_url=api_url, api_key=api_key, pass_history=0),
+                ),
+            ))
+        except QuotaExceeded:
+            result = strings['message_quota_exceeded'][get_current_lang(convo_id)]
 
         results = [
             InlineQueryResultArticle(
@@ -688,6 +827,18 @@ async def change_model(update, context):
         )
         return
 
+    # /model auto fast|strong|auto 切换到 auto 并固定或恢复自动选择
+    if config.auto_router.enabled and context.args[0] == config.AUTO_MODEL and len(context.args) == 2 and context.args[1] in ("auto", "fast", "strong"):
+        Users.set_many(convo_id, {"engine": config.AUTO_MODEL, "auto_route": context.args[1]})
+        await context.bot.send_message(
+            chat_id=chatid,
+            message_thread_id=message_thread_id,
+            text=escape(strings['model_changed'][lang].format(model_name=f"{config.AUTO_MODEL} ({context.args[1]})"), italic=False),
+            parse_mode='MarkdownV2',
+            reply_to_message_id=user_message_id,
+        )
+        return
+
     # Combine all arguments into one model name
     model_name = ' '.join(context.args)
 
@@ -702,25 +853,23 @@ async def change_model(update, context):
         )
         return
 
-    # Get all available models from initial_model and MODEL_GROUPS
-    available_models = get_all_available_models()
-    for group_name, models in get_model_groups().items():
-        available_models.extend(models)
-
-    # Add debug output
-    print(f"Requested model: '{model_name}'")
-    print(f"Available models: {available_models}")
-
-    # Check if the requested model is in the available models list
-    if model_name not in available_models:
+    # 只按名称或别名切换模型，前缀和相近名称仅作为建议，不修改全局模型列表
+    registry = get_model_registry()
+    resolved = registry.resolve(model_name)
+    if resolved is None:
+        text = strings['model_not_available'][lang].format(model_name=model_name)
+        suggestions = registry.suggest(model_name)
+        if suggestions:
+            text += "\n\n" + strings['model_suggestions'][lang].format(models=", ".join(f"`{model}`" for model in suggestions))
         message = await context.bot.send_message(
             chat_id=chatid,
             message_thread_id=message_thread_id,
-            text=escape(strings['model_not_available'][lang].format(model_name=model_name)),
+            text=escape(text),
             parse_mode='MarkdownV2',
             reply_to_message_id=user_message_id,
         )
         return
+    model_name = resolved
 
     # Saving the new model in the user's configuration
     Users.set_config(convo_id, "engine", model_name)
@@ -734,27 +883,14 @@ async def change_model(update, context):
         reply_to_message_id=user_message_id,
     )
 
-async def scheduled_function(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """这个函数将在RESET_TIME秒后执行一次，重置特定用户的对话"""
-    job = context.job
-    chat_id = job.chat_id
-
-    if config.ADMIN_LIST and chat_id in config.ADMIN_LIST:
-        return
-
-    reset_ENGINE(chat_id)
-
-    # 任务执行完毕后自动移除
-    remove_job_if_exists(str(chat_id), context)
+async def expire_conversations(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """定期执行，批量重置超过 RESET_TIME 未活跃的会话"""
+    def reset_conversation(convo_id, chat_id):
+        if config.ADMIN_LIST and chat_id in config.ADMIN_LIST:
+            return
+        reset_ENGINE(convo_id)
 
-def remove_job_if_exists(name: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """如果存在，则移除指定名称的任务"""
-    current_jobs = context.job_queue.get_jobs_by_name(name)
-    if not current_jobs:
-        return False
-    for job in current_jobs:
-        job.schedule_removal()
-    return True
+    await config.conversation_expiry.sweep(reset_conversation)
 
 # 定义一个全局变量来存储 chatid
 target_convo_id = None
@@ -781,18 +917,6 @@ async def reset_chat(update, context):
         reply_markup=remove_keyboard,
         parse_mode='MarkdownV2',
     )
-    if GET_MODELS:
-        robot, role, api_key, api_url = get_robot()
-        engine = Users.get_config(convo_id, "engine")
-        provider = {
-            "provider": "openai",
-            "base_url": api_url,
-            "api": api_key,
-            "model": [engine],
-            "tools": True,
-            "image": True
-        }
-        config.initial_model = remove_no_text_model(update_initial_model(provider))
     await delete_message(update, context, [message.message_id, user_message_id])
 
 @decorators.AdminAuthorization
@@ -800,7 +924,8 @@ async def reset_chat(update, context):
 @decorators.Authorization
 async def info(update, context):
     _, _, _, chatid, user_message_id, _, _, message_thread_id, convo_id, _, _, voice_text = await GetMesageInfo(update, context)
-    info_message = update_info_message(convo_id)
+    usage_id = str(update.effective_user.id) if update.effective_user else None
+    info_message = update_info_message(convo_id, usage_id)
     message = await context.bot.send_message(
         chat_id=chatid,
         message_thread_id=message_thread_id,
@@ -808,7 +933,7 @@ async def info(update, context):
         reply_markup=InlineKeyboardMarkup(update_first_buttons_message(convo_id)),
         parse_mode='MarkdownV2',
         disable_web_page_preview=True,
-        read_timeout=600,
+        read_timeout=config.TELEGRAM_TIMEOUT,
     )
     await delete_message(update, context, [message.message_id, user_message_id])
 
@@ -877,15 +1002,13 @@ async def start(update, context): # 当用户输入/start时，返回文本
     if len(context.args) == 2 and context.args[1].startswith("sk-"):
         api_url = context.args[0]
         api_key = context.args[1]
-        Users.set_config(convo_id, "api_key", api_key)
-        Users.set_config(convo_id, "api_url", api_url)
+        Users.set_many(convo_id, {"api_key": api_key, "api_url": api_url})
         # if GET_MODELS:
         #     update_initial_model()
 
     if len(context.args) == 1 and context.args[0].startswith("sk-"):
         api_key = context.args[0]
-        Users.set_config(convo_id, "api_key", api_key)
-        Users.set_config(convo_id, "api_url", "https://api.openai.com/v1/chat/completions")
+        Users.set_many(convo_id, {"api_key": api_key, "api_url": "https://api.openai.com/v1/chat/completions"})
         # if GET_MODELS:
         #     update_initial_model()
 
@@ -952,6 +1075,54 @@ async def post_init(application: Application) -> None:
     
     await application.bot.set_my_description(description)
 
+    if config.WARM_INTERVAL:
+        warmed = await config.connection_warmer.warm_all(config.warm_targets(), pin=True)
+        print(f"warm-up: {warmed} upstream endpoints connected")
+
+    if application.job_queue:
+        application.job_queue.run_repeating(expire_conversations, interval=config.EXPIRY_SWEEP_INTERVAL, first=config.EXPIRY_SWEEP_INTERVAL)
+        application.job_queue.run_repeating(flush_usage, interval=config.USAGE_FLUSH_INTERVAL, first=config.USAGE_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(flush_user_configs, interval=config.CONFIG_FLUSH_INTERVAL, first=config.CONFIG_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(evict_idle_clients, interval=60, first=60)
+        if config.WARM_INTERVAL:
+            application.job_queue.run_repeating(keep_connections_warm, interval=config.WARM_INTERVAL, first=config.WARM_INTERVAL)
+        application.job_queue.run_repeating(refresh_models, interval=min(60, config.MODEL_REFRESH_INTERVAL), first=0)
+        application.job_queue.run_repeating(refresh_version, interval=config.VERSION_CHECK_INTERVAL, first=0)
+        application.job_queue.run_repeating(sync_user_configs, interval=config.CONFIG_SYNC_INTERVAL, first=config.CONFIG_SYNC_INTERVAL)
+
+async def flush_usage(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await asyncio.to_thread(config.usage_ledger.flush)
+
+async def flush_user_configs(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await asyncio.to_thread(config.config_writer.flush)
+
+async def evict_idle_clients(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if await config.client_pool.evict_idle():
+        print("client pool:", config.client_pool.stats())
+
+async def keep_connections_warm(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await config.connection_warmer.keep_warm()
+
+async def refresh_models(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await config.model_catalog.refresh_if_stale()
+
+async def refresh_version(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await config.version_checker.refresh()
+
+async def sync_user_configs(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # 其他 worker 修改过的用户从缓存中移除，下次访问时重新读取
+    changed = await asyncio.to_thread(config.config_store.poll_changes)
+    if changed is None:
+        Users.invalidate_all()
+        return
+    for user_id in changed:
+        Users.invalidate(user_id)
+
+async def post_shutdown(application: Application) -> None:
+    await config.client_pool.aclose()
+    config.usage_ledger.flush()
+    config.config_writer.flush()
+
 if __name__ == '__main__':
     application = (
         ApplicationBuilder()
@@ -959,16 +1130,17 @@ if __name__ == '__main__':
         .concurrent_updates(True)
         .connection_pool_size(65536)
         .get_updates_connection_pool_size(65536)
-        .read_timeout(time_out)
-        .write_timeout(time_out)
-        .connect_timeout(time_out)
-        .pool_timeout(time_out)
-        .get_updates_read_timeout(time_out)
-        .get_updates_write_timeout(time_out)
-        .get_updates_connect_timeout(time_out)
-        .get_updates_pool_timeout(time_out)
+        .read_timeout(config.TELEGRAM_TIMEOUT)
+        .write_timeout(config.TELEGRAM_TIMEOUT)
+        .connect_timeout(config.TELEGRAM_TIMEOUT)
+        .pool_timeout(config.TELEGRAM_TIMEOUT)
+        .get_updates_read_timeout(poll_timeout + config.TELEGRAM_TIMEOUT)
+        .get_updates_write_timeout(config.TELEGRAM_TIMEOUT)
+        .get_updates_connect_timeout(config.TELEGRAM_TIMEOUT)
+        .get_updates_pool_timeout(config.TELEGRAM_TIMEOUT)
         .rate_limiter(AIORateLimiter(max_retries=5))
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -1024,4 +1196,4 @@ if __name__ == '__main__':
         print("WEB_HOOK:", WEB_HOOK)
         application.run_webhook("0.0.0.0", PORT, webhook_url=WEB_HOOK)
     else:
-        application.run_polling(timeout=time_out)
+        application.run_polling(timeout=poll_timeout)
@@ -1,16 +1,33 @@
 import os
-import subprocess
 from dotenv import load_dotenv
 load_dotenv()
 
 import re
 from utils.i18n import strings
+from utils.history import HistorySlimmer
+from utils.expiry import ConversationExpiry
+from utils.request_layout import RequestLayout
+from utils.usage import UsageLedger, QuotaExceeded, estimate_tokens
+from utils.version import VersionChecker
+from utils.render_cache import RenderCache, freeze_keyboard, thaw_keyboard
+from utils.debounce import CallbackCoalescer
+from utils.model_catalog import ModelCatalog
+from utils.model_registry import ModelRegistry
+from utils.routing import Route, RoutingTable, parse_overrides
+from utils.client_pool import ClientPool
+from utils.warmer import ConnectionWarmer
+from utils.key_pool import KeyPools, split_keys
+from utils.auto_route import AutoRouter
+from utils.hedging import TTFTTracker
+from utils.resilience import Resilience, RetryBudget
+from utils.single_flight import SingleFlight
+from utils.response_cache import ResponseCache
 from datetime import datetime
 
 # We expose variables for access from other modules
 
 from aient.src.aient.utils import prompt
-from aient.src.aient.core.utils import update_initial_model, BaseAPI
+from aient.src.aient.core.utils import update_initial_model, get_engine, BaseAPI
 from aient.src.aient.models import chatgpt, groq, claude3, gemini, vertex, PLUGINS, whisper, DuckChat
 
 from telegram import InlineKeyboardButton
@@ -21,6 +38,14 @@ BOT_TOKEN = os.environ.get('BOT_TOKEN', None)
 RESET_TIME = int(os.environ.get('RESET_TIME', '3600'))
 if RESET_TIME < 60:
     RESET_TIME = 60
+# 所有会话共用一个过期堆，由一个定时任务统一清理
+conversation_expiry = ConversationExpiry(RESET_TIME)
+EXPIRY_SWEEP_INTERVAL = min(30, RESET_TIME // 2)
+
+# 已回答过的图片和大文档在历史记录中折叠的轮数
+HISTORY_IMAGE_TURNS = int(os.environ.get('HISTORY_IMAGE_TURNS', '1'))
+HISTORY_DOC_TURNS = int(os.environ.get('HISTORY_DOC_TURNS', '1'))
+HISTORY_DOC_CHARS = int(os.environ.get('HISTORY_DOC_CHARS', '2000'))
 
 # Resume-specific configurations - Environment Variable Support
 RESUME_ANALYSIS_MODE_ENV = os.environ.get('RESUME_ANALYSIS_MODE', 'false').lower().strip()
@@ -154,75 +179,48 @@ current_date = datetime.now()
 Current_Date = current_date.strftime("%Y-%m-%d")
 systemprompt = os.environ.get('SYSTEMPROMPT', prompt.system_prompt.format(LANGUAGE, Current_Date))
 claude_systemprompt = os.environ.get('SYSTEMPROMPT', prompt.claude_system_prompt.format(LANGUAGE))
+request_layout = RequestLayout(date_stamp=Current_Date)
 
 
 import json
-from contextlib import contextmanager
+import atexit
+import itertools
+import httpx
+import asyncio
+import time
+from types import MappingProxyType
+from functools import lru_cache
+from collections import OrderedDict, Counter
+from utils.config_store import JSONConfigStore, SQLiteConfigStore, SharedDirConfigStore, WriteBehindBuffer, DELETE
 
 CONFIG_DIR = os.environ.get('CONFIG_DIR', 'user_configs')
-
-import os
-from contextlib import contextmanager
-
-@contextmanager
-def file_lock(filename):
-    if os.name == 'nt':  # Windows系统
-        import msvcrt
-        with open(filename, 'a+') as f:
-            try:
-                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
-                yield f
-            finally:
-                try:
-                    f.seek(0)
-                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
-                except:
-                    pass  # 如果解锁失败，我们也不能做太多
-    else:  # Unix-like系统
-        import fcntl
-        with open(filename, 'a+') as f:
-            try:
-                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                yield f
-            finally:
-                fcntl.flock(f, fcntl.LOCK_UN)
-
-# # 使用示例
-# try:
-#     with file_lock("myfile.txt") as f:
-#         # 在这里进行文件操作
-#         f.write("Some data\n")
-# except IOError:
-#     print("无法获取文件锁，文件可能正被其他进程使用")
+# json: 每个用户一个文件；sqlite: 所有用户存放在一个 WAL 模式的数据库中，按需读取；
+# shared: 多个 worker 共享同一目录，加锁合并写入，并通过变更日志通知其他 worker
+CONFIG_BACKEND = os.environ.get('CONFIG_BACKEND', 'json').lower()
+CONFIG_DB = os.environ.get('CONFIG_DB', os.path.join(CONFIG_DIR, 'user_configs.db'))
+
+# 配置写入先进入内存缓冲区，由后台线程批量原子写入
+CONFIG_FLUSH_INTERVAL = int(os.environ.get('CONFIG_FLUSH_INTERVAL', '5'))
+# 其他 worker 写入的变更多久同步一次到本进程的缓存
+CONFIG_SYNC_INTERVAL = float(os.environ.get('CONFIG_SYNC_INTERVAL', '2'))
+if CONFIG_BACKEND == "sqlite":
+    config_store = SQLiteConfigStore(CONFIG_DB)
+    config_store.import_json_dir(CONFIG_DIR)
+elif CONFIG_BACKEND == "shared":
+    config_store = SharedDirConfigStore(CONFIG_DIR)
+else:
+    config_store = JSONConfigStore(CONFIG_DIR)
+config_writer = WriteBehindBuffer(config_store)
+atexit.register(config_writer.flush)
 
 def save_user_config(user_id, config):
-    if not os.path.exists(CONFIG_DIR):
-        os.makedirs(CONFIG_DIR)
-
-    filename = os.path.join(CONFIG_DIR, f'{user_id}.json')
-
-    with file_lock(filename):
-        with open(filename, 'w') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+    config_store.save_many({str(user_id): config})
 
 def load_user_config(user_id):
-    filename = os.path.join(CONFIG_DIR, f'{user_id}.json')
-
-    if not os.path.exists(filename):
-        return {}
-
-    with file_lock(filename):
-        with open(filename, 'r') as f:
-            content = f.read()
-            if not content.strip():
-                return {}
-            else:
-                return json.loads(content)
+    return config_store.load(user_id)
 
 def update_user_config(user_id, key, value):
-    config = load_user_config(user_id)
-    config[key] = value
-    save_user_config(user_id, config)
+    config_writer.mark_many(user_id, {key: value})
 
 class NestedDict:
     def __init__(self):
@@ -242,6 +240,117 @@ class NestedDict:
     def keys(self):
         return self.data.keys()
 
+class UserCache(NestedDict):
+    """NestedDict with an LRU bound on how many user configs stay in memory."""
+    def __init__(self, maxsize=10000, pinned=("global",)):
+        self.data = OrderedDict()
+        self.maxsize = maxsize
+        self.pinned = pinned
+
+    def __getitem__(self, key):
+        if key in self.data:
+            self.data.move_to_end(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            oldest = next((k for k in self.data if k not in self.pinned), None)
+            if oldest is None:
+                break
+            del self.data[oldest]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
+
+    def discard(self, key):
+        self.data.pop(key, None)
+
+# 版本号全局递增，重新加载的用户不会与缓存中旧对象的版本号相同
+settings_versions = itertools.count(1)
+
+class UserSettings:
+    """One user's settings: only the values that differ from the shared, read-only defaults."""
+    __slots__ = ("defaults", "overrides", "version")
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+        self.overrides = {}
+        self.version = next(settings_versions)
+
+    def __getitem__(self, key):
+        overrides = self.overrides
+        return overrides[key] if key in overrides else self.defaults[key]
+
+    def __setitem__(self, key, value):
+        if key in self.defaults and self.defaults[key] == value:
+            self.overrides.pop(key, None)
+        else:
+            self.overrides[key] = value
+        self.version = next(settings_versions)
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.defaults
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self.as_dict().keys()
+
+    def as_dict(self):
+        return {**self.defaults, **self.overrides}
+
+    def __repr__(self):
+        return repr(self.overrides)
+
+# 配置结构版本号，每个用户的配置只迁移一次
+SCHEMA_VERSION = 2
+SCHEMA_KEY = "_schema_version"
+
+def migrate_v1(user_id, user_config):
+    # 定义旧键名到新键名的映射关系 old_key -> new_key
+    key_mapping = {
+        "SEARCH": "get_search_results",
+        "URL": "get_url_content",
+        "ARXIV": "download_read_arxiv_pdf",
+        "CODE": "run_python_script",
+        "IMAGE": "generate_image",
+        "get_date_time_weekday": "get_time"
+    }
+    changes = {}
+    for old_key, new_key in key_mapping.items():
+        if old_key in user_config:
+            user_config[new_key] = user_config.pop(old_key)
+            changes[old_key] = DELETE
+            changes[new_key] = user_config[new_key]
+    return changes
+
+def migrate_v2(user_id, user_config):
+    # 旧版本为每个用户保存了全部配置项，其中的 api_url、api_key（以及全局的 systemprompt）是当时环境变量的副本；
+    # 删除这些副本让它们跟随当前环境变量。只执行一次，之后用户自己设置的 key 会保留
+    stale = ("api_url", "api_key", "systemprompt") if user_id == "global" else ("api_url", "api_key")
+    changes = {}
+    for key in stale:
+        if key in user_config:
+            del user_config[key]
+            changes[key] = DELETE
+    return changes
+
+MIGRATIONS = {
+    1: migrate_v1,
+    2: migrate_v2,
+}
+
+CONFIG_CACHE_SIZE = int(os.environ.get('CONFIG_CACHE_SIZE', '10000'))
+
 class UserConfig:
     def __init__(self,
         user_id: str = None,
@@ -254,9 +363,11 @@ class UserConfig:
         plugins=None,
         languages=None,
         systemprompt=None,
-        claude_systemprompt=None
+        claude_systemprompt=None,
+        store=None
     ):
         self.user_id = user_id
+        self.store = store or JSONConfigStore(CONFIG_DIR)
         self.language = language
         self.languages = languages
         self.languages[self.language] = True
@@ -267,64 +378,74 @@ class UserConfig:
         self.plugins = plugins
         self.systemprompt = systemprompt
         self.claude_systemprompt = claude_systemprompt
-        self.users = NestedDict()
-        self.users["global"] = self.get_init_preferences()
-        # self.users = {
-        #     "global": self.get_init_preferences()
-        # }
-        self.users["global"].update(self.preferences)
-        self.users["global"].update(self.plugins)
-        self.users["global"].update(self.languages)
+        # 所有用户共享一份只读默认值，每个用户只保存与默认值不同的项
+        defaults = self.get_init_preferences()
+        defaults.update(self.preferences)
+        defaults.update(self.plugins)
+        defaults.update(self.languages)
+        self.defaults = MappingProxyType(defaults)
+        self.parameter_name_list = list(self.defaults.keys())
+        self.parameter_names = frozenset(self.parameter_name_list)
+        self.users = UserCache(CONFIG_CACHE_SIZE)
+        self.users["global"] = UserSettings(self.defaults)
+        # 被其他 worker 修改过、下次访问需要重新加载的用户
+        self.stale = set()
         self.mode = mode
         self.load_all_configs()
-        self.parameter_name_list = list(self.users["global"].keys())
-        for key in self.parameter_name_list:
-            update_user_config("global", key, self.users["global"][key])
 
 
     def load_all_configs(self):
-        if not os.path.exists(CONFIG_DIR):
-            return
-
-        # 定义旧键名到新键名的映射关系 old_key -> new_key
-        key_mapping = {
-            "SEARCH": "get_search_results",
-            "URL": "get_url_content",
-            "ARXIV": "download_read_arxiv_pdf",
-            "CODE": "run_python_script",
-            "IMAGE": "generate_image",
-            "get_date_time_weekday": "get_time"
-        }
-
-        for filename in os.listdir(CONFIG_DIR):
-            if filename.endswith('.json'):
-                user_id = filename[:-5]  # 移除 '.json' 后缀
-                user_config = load_user_config(user_id)
-                self.users[user_id] = NestedDict()
-
-                # 检查并进行键名映射转换
-                updated_config = False
-                for old_key, new_key in key_mapping.items():
-                    if old_key in user_config:
-                        user_config[new_key] = user_config.pop(old_key)
-                        updated_config = True
-
-                # 如果配置有更新，保存回文件
-                if updated_config:
-                    save_user_config(user_id, user_config)
-
-                # 正常处理配置项
-                for key, value in user_config.items():
-                    self.users[user_id][key] = value
-                    if key == "api_url" and value != self.api_url:
-                        self.users[user_id]["api_url"] = self.api_url
-                        update_user_config(user_id, "api_url", self.api_url)
-                    if key == "api_key" and value != self.api_key:
-                        self.users[user_id]["api_key"] = self.api_key
-                        update_user_config(user_id, "api_key", self.api_key)
-                    if user_id == "global" and key == "systemprompt" and value != self.systemprompt:
-                        self.users[user_id]["systemprompt"] = self.systemprompt
-                        update_user_config(user_id, "systemprompt", self.systemprompt)
+        # 其他用户在首次访问时才加载，启动时只读取全局配置
+        self.load_user("global")
+
+    def load_user(self, user_id, persist=True):
+        """Load a user's stored overrides into the cache.
+
+        Pending migrations are applied. With persist=False, used when reloading
+        after another worker's change, they are applied in memory only: a reload
+        never writes to the store.
+        """
+        user_config = self.store.load(user_id)
+        user_config.update(config_writer.pending_for(user_id))
+        user_config = {key: value for key, value in user_config.items() if value is not DELETE}
+        if not user_config:
+            return False
+
+        # 按版本号依次执行尚未执行的迁移，并记录新的版本号
+        version = user_config.pop(SCHEMA_KEY, 0)
+        if version < SCHEMA_VERSION:
+            changes = {}
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                changes.update(MIGRATIONS[target](user_id, user_config))
+            if persist:
+                changes[SCHEMA_KEY] = SCHEMA_VERSION
+                config_writer.mark_many(user_id, changes)
+
+        if user_id == "global":
+            user_data = self.users["global"]
+        else:
+            user_data = UserSettings(self.defaults)
+
+        for key, value in user_config.items():
+            user_data[key] = value
+        self.users[user_id] = user_data
+        return True
+
+    def invalidate(self, user_id):
+        """Drop a user's cached settings after another worker changed them; the next access reloads."""
+        user_id = self.user_key(user_id)
+        if user_id == "global":
+            self.users["global"] = UserSettings(self.defaults)
+            self.load_user("global", persist=False)
+        elif user_id in self.users:
+            self.users.discard(user_id)
+            self.stale.add(user_id)
+
+    def invalidate_all(self):
+        self.stale.update(user_id for user_id in self.users.keys() if user_id != "global")
+        self.users = UserCache(CONFIG_CACHE_SIZE)
+        self.users["global"] = UserSettings(self.defaults)
+        self.load_user("global", persist=False)
 
     def get_init_preferences(self):
         return {
@@ -334,51 +455,75 @@ class UserConfig:
             "claude_systemprompt": self.claude_systemprompt,
             "api_key": self.api_key,
             "api_url": self.api_url,
+            # engine 为 auto 时的个人选择：auto 自动判断，fast/strong 固定使用其中一个模型
+            "auto_route": "auto",
         }
 
-    def user_init(self, user_id = None):
+    def user_key(self, user_id = None):
         if user_id == None or self.mode == "global":
-            user_id = "global"
-        self.user_id = user_id
-        if self.user_id not in self.users.keys():
-            self.users[self.user_id] = self.get_init_preferences()
-            self.users[self.user_id].update(self.preferences)
-            self.users[self.user_id].update(self.plugins)
-            self.users[self.user_id].update(self.languages)
-            for key in self.users[self.user_id].keys():
-                update_user_config(user_id, key, self.users[self.user_id][key])
+            return "global"
+        return str(user_id)
+
+    def user_init(self, user_id = None):
+        user_id = self.user_key(user_id)
+        settings = self.users.get(user_id)
+        if settings is not None:
+            return settings
+        # 因其他 worker 的变更而重新加载时只读不写
+        reload = user_id in self.stale
+        self.stale.discard(user_id)
+        if self.load_user(user_id, persist=not reload):
+            return self.users[user_id]
+        # 新用户只在内存中创建，直到某个值与默认值不同才写入存储
+        settings = UserSettings(self.defaults)
+        self.users[user_id] = settings
+        return settings
 
     def get_config(self, user_id = None, parameter_name = None):
-        if parameter_name not in self.parameter_name_list:
+        if parameter_name not in self.parameter_names:
             raise ValueError("parameter_name is not in the parameter_name_list")
-        if self.mode == "global":
-            return self.users["global"][parameter_name]
-        if self.mode == "multiusers":
-            self.user_init(user_id)
-            return self.users[self.user_id][parameter_name]
+        return self.user_init(user_id)[parameter_name]
 
     def set_config(self, user_id = None, parameter_name = None, value = None):
-        if parameter_name not in self.parameter_name_list:
+        self.set_many(user_id, {parameter_name: value})
+
+    def set_many(self, user_id = None, values = None):
+        """Set several parameters at once; they are persisted together in one write."""
+        values = values or {}
+        if not self.parameter_names.issuperset(values):
             raise ValueError("parameter_name is not in the parameter_name_list")
-        if self.mode == "global":
-            self.users["global"][parameter_name] = value
-            update_user_config("global", parameter_name, value)
-        if self.mode == "multiusers":
-            self.user_init(user_id)
-            self.users[self.user_id][parameter_name] = value
-            update_user_config(self.user_id, parameter_name, value)
+        user_id = self.user_key(user_id)
+        settings = self.user_init(user_id)
+        changes = {}
+        for key, value in values.items():
+            overridden = key in settings.overrides
+            settings[key] = value
+            # 与默认值相同的项从存储中删除，存储里只保留差异
+            if key in settings.overrides:
+                changes[key] = value
+            elif overridden:
+                changes[key] = DELETE
+        if not changes:
+            return
+        if any(value is not DELETE for value in changes.values()):
+            changes[SCHEMA_KEY] = SCHEMA_VERSION
+        config_writer.mark_many(user_id, changes)
+
+    def settings_version(self, user_id = None):
+        return self.user_init(self.user_key(user_id)).version
+
+    def snapshot(self, user_id = None):
+        """Read-only copy of a user's settings, so a handler can read everything once per update."""
+        return MappingProxyType(self.user_init(user_id).as_dict())
 
     def extract_plugins_config(self, user_id = None):
-        self.user_init(user_id)
-        if isinstance(self.users[self.user_id], dict):
-            user_data = self.users[self.user_id]
-        else:
-            user_data = self.users[self.user_id].data
-        plugins_config = {key: value for key, value in user_data.items() if key in self.plugins}
-        return plugins_config
+        settings = self.user_init(user_id)
+        return {key: settings[key] for key in self.plugins}
 
     def to_json(self, user_id=None):
         def nested_dict_to_dict(nd):
+            if isinstance(nd, UserSettings):
+                return nd.as_dict()
             if isinstance(nd, NestedDict):
                 return {k: nested_dict_to_dict(v) for k, v in nd.data.items()}
             return nd
@@ -393,7 +538,38 @@ class UserConfig:
     def __str__(self):
         return str(self.users)
 
-Users = UserConfig(mode=CHAT_MODE, api_key=API, api_url=API_URL, engine=GPT_ENGINE, preferences=PREFERENCES, plugins=PLUGINS, language=LANGUAGE, languages=LANGUAGES, systemprompt=systemprompt, claude_systemprompt=claude_systemprompt)
+Users = UserConfig(mode=CHAT_MODE, api_key=API, api_url=API_URL, engine=GPT_ENGINE, preferences=PREFERENCES, plugins=PLUGINS, language=LANGUAGE, languages=LANGUAGES, systemprompt=systemprompt, claude_systemprompt=claude_systemprompt, store=config_store)
+
+# 用量账本：内存聚合，定期批量落盘；额度为每用户每天的 token 数，0 表示不限制
+USAGE_FILE = os.environ.get('USAGE_FILE', os.path.join(CONFIG_DIR, 'usage_ledger.json'))
+USAGE_SOFT_LIMIT = int(os.environ.get('USAGE_SOFT_LIMIT', '0'))
+USAGE_HARD_LIMIT = int(os.environ.get('USAGE_HARD_LIMIT', '0'))
+USAGE_FLUSH_INTERVAL = int(os.environ.get('USAGE_FLUSH_INTERVAL', '60'))
+usage_ledger = UsageLedger(USAGE_FILE, soft_limit=USAGE_SOFT_LIMIT, hard_limit=USAGE_HARD_LIMIT)
+
+def quota_exempt(usage_id):
+    # 管理员不受每日额度限制，也不会收到额度提醒
+    return not usage_id or bool(ADMIN_LIST and str(usage_id) in ADMIN_LIST)
+
+def enforce_quota(usage_id):
+    """Raise QuotaExceeded when usage_id is over the hard limit; admins are never limited."""
+    if quota_exempt(usage_id):
+        return
+    if usage_ledger.check_quota(usage_id) == "hard":
+        raise QuotaExceeded(usage_id)
+
+async def metered_call(usage_id, model, prompt, make_call):
+    """await make_call() for one non-streaming upstream request, charged to usage_id."""
+    enforce_quota(usage_id)
+    start_time = time.time()
+    result = None
+    try:
+        result = await make_call()
+        return result
+    finally:
+        usage_ledger.record(usage_id, model, estimate_tokens(prompt), estimate_tokens(result if isinstance(result, str) else None), time.time() - start_time)
+
+history_slimmer = HistorySlimmer(image_turns=HISTORY_IMAGE_TURNS, doc_turns=HISTORY_DOC_TURNS, doc_chars=HISTORY_DOC_CHARS)
 
 temperature = float(os.environ.get('temperature', '0.5'))
 CLAUDE_API = os.environ.get('claude_api_key', None)
@@ -403,6 +579,8 @@ def InitEngine(chat_id=None):
     global Users, ChatGPTbot, SummaryBot, groqBot, vertexBot, whisperBot, duckBot
     api_key = Users.get_config(chat_id, "api_key")
     api_url = Users.get_config(chat_id, "api_url")
+    # 多个 key 时客户端默认使用第一个，实际请求的 key 由 get_robot 从 key 池中挑选
+    api_key = next(iter(split_keys(api_key)), api_key)
     if api_key or GOOGLE_AI_API_KEY or CLAUDE_API:
         ChatGPTbot = chatgpt(temperature=temperature, print_log=True, api_url=api_url, api_key=api_key)
         SummaryBot = chatgpt(temperature=temperature, use_plugins=False, print_log=True, api_url=api_url, api_key=api_key)
@@ -419,39 +597,22 @@ def update_language_status(language, chat_id=None):
     systemprompt = Users.get_config(chat_id, "systemprompt")
     claude_systemprompt = Users.get_config(chat_id, "claude_systemprompt")
     LAST_LANGUAGE = Users.get_config(chat_id, "language")
-    Users.set_config(chat_id, "language", language)
-    for lang in LANGUAGES:
-        Users.set_config(chat_id, lang, False)
-
-    Users.set_config(chat_id, language, True)
-    systemprompt = systemprompt.replace(LAST_LANGUAGE, Users.get_config(chat_id, "language"))
-    claude_systemprompt = claude_systemprompt.replace(LAST_LANGUAGE, Users.get_config(chat_id, "language"))
-    Users.set_config(chat_id, "systemprompt", systemprompt)
-    Users.set_config(chat_id, "claude_systemprompt", claude_systemprompt)
+    values = {lang: False for lang in LANGUAGES}
+    values[language] = True
+    values["language"] = language
+    values["systemprompt"] = systemprompt.replace(LAST_LANGUAGE, language)
+    values["claude_systemprompt"] = claude_systemprompt.replace(LAST_LANGUAGE, language)
+    Users.set_many(chat_id, values)
 
 InitEngine(chat_id=None)
 update_language_status(LANGUAGE)
 
-def get_local_version_info():
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    result = subprocess.run(['git', '-C', current_directory, 'log', '-1'], stdout=subprocess.PIPE)
-    output = result.stdout.decode()
-    return output.split('\n')[0].split(' ')[1]  # 获取本地最新提交的哈希值
-
-def get_remote_version_info():
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    result = subprocess.run(['git', '-C', current_directory, 'ls-remote', 'origin', 'HEAD'], stdout=subprocess.PIPE)
-    output = result.stdout.decode()
-    return output.split('\t')[0]  # 获取远程最新提交的哈希值
+# 版本信息由后台任务定时刷新，/info 只读取缓存的结果
+VERSION_CHECK_INTERVAL = int(os.environ.get('VERSION_CHECK_INTERVAL', '3600'))
+version_checker = VersionChecker(os.path.dirname(os.path.abspath(__file__)))
 
 def check_for_updates():
-    local_version = get_local_version_info()
-    remote_version = get_remote_version_info()
-
-    if local_version == remote_version:
-        return "Up to date."
-    else:
-        return "A new version is available! Please redeploy."
+    return version_checker.status
 
 def replace_with_asterisk(string):
     if string:
@@ -462,17 +623,51 @@ def replace_with_asterisk(string):
     else:
         return None
 
-def update_info_message(user_id = None):
+def format_usage(usage_id):
+    models = usage_ledger.summary(usage_id)
+    total = usage_ledger.tokens_today(usage_id)
+    if not models:
+        return str(total)
+    details = ", ".join(f"{model}: {item['prompt_tokens'] + item['completion_tokens']}" for model, item in models.items())
+    return f"{total} ({details})"
+
+# 菜单和信息面板按 (语言, 菜单, 配置版本) 缓存，配置变化后版本号改变，旧条目自然失效
+render_cache = RenderCache()
+# 连续快速点击同一条消息的按钮时，合并为一次配置修改和一次编辑
+CALLBACK_COALESCE_WINDOW = float(os.environ.get('CALLBACK_COALESCE_WINDOW', '0.5'))
+callback_coalescer = CallbackCoalescer(CALLBACK_COALESCE_WINDOW)
+
+# 信息面板里的全局统计（自动路由、TTFT）每条消息都在变，按时间段取整后放进缓存键，最多滞后一个时间段
+INFO_STATS_INTERVAL = int(os.environ.get('INFO_STATS_INTERVAL', '60'))
+
+def update_info_message(user_id = None, usage_id = None):
+    stats_bucket = int(time.time() // INFO_STATS_INTERVAL) if INFO_STATS_INTERVAL > 0 else None
+    key = ("info", Users.user_key(user_id), Users.settings_version(user_id), routing_table.version, usage_id, usage_ledger.tokens_today(usage_id or user_id), check_for_updates(), stats_bucket)
+    return render_cache.get(key, lambda: build_info_message(user_id, usage_id))
+
+def describe_auto(user_id = None):
+    override = Users.get_config(user_id, "auto_route")
+    models = f"fast {AUTO_FAST_MODEL}, strong {AUTO_STRONG_MODEL}" + (f", fixed to {override}" if override != "auto" else "")
+    return "; ".join(filter(None, [models, auto_router.summary()]))
+
+def describe_ttft(model):
+    summary = ttft_tracker.summary(model)
+    return ", ".join(f"{name} p50 {summary[name]['p50']:.1f}s ({summary[name]['count']})" for name in ("warm", "cold") if name in summary)
+
+def build_info_message(user_id = None, usage_id = None):
     api_key = Users.get_config(user_id, "api_key")
     api_url = Users.get_config(user_id, "api_url")
     if GOOGLE_AI_API_KEY and os.environ.get('API_URL') == None:
         api_url = "https://generativelanguage.googleapis.com/v1beta"
     return "".join([
         f"**🤖 Model:** `{Users.get_config(user_id, 'engine')}`\n\n",
+        f"**⚡ Auto:** `{describe_auto(user_id)}`\n\n" if Users.get_config(user_id, 'engine') == AUTO_MODEL else "",
+        f"**🧭 Route:** `{routing_table.describe(current_engine(user_id))}`\n\n",
+        f"**⏱ TTFT:** `{describe_ttft(current_engine(user_id))}`\n\n" if ttft_tracker.summary(current_engine(user_id)) else "",
         f"**🔑 API:** `{replace_with_asterisk(api_key)}`\n\n" if api_key else "",
         f"**🔗 API URL:** `{api_url}`\n\n" if api_url else "",
         f"**🛜 WEB HOOK:** `{WEB_HOOK}`\n\n" if WEB_HOOK else "",
-        f"**🚰 Tokens usage:** `{get_robot(user_id)[0].tokens_usage[str(user_id)]}`\n\n" if get_robot(user_id)[0] else "",
+        f"**🚰 Tokens usage today:** `{format_usage(usage_id or user_id)}`\n\n",
         f"**🃏 NICK:** `{NICK}`\n\n" if NICK else "",
         f"**📖 Version:** `{check_for_updates()}`\n\n",
     ])
@@ -481,14 +676,14 @@ def reset_ENGINE(chat_id, message=None):
     global ChatGPTbot, groqBot, vertexBot
     api_key = Users.get_config(chat_id, "api_key")
     api_url = Users.get_config(chat_id, "api_url")
-    engine = Users.get_config(chat_id, "engine")
+    engine = current_engine(chat_id)
     if message:
         if "claude" in engine:
             Users.set_config(chat_id, "claude_systemprompt", message)
         else:
             Users.set_config(chat_id, "systemprompt", message)
-    systemprompt = Users.get_config(chat_id, "systemprompt")
-    claude_systemprompt = Users.get_config(chat_id, "claude_systemprompt")
+    systemprompt = request_layout.system_prompt(Users.get_config(chat_id, "systemprompt"))
+    claude_systemprompt = request_layout.system_prompt(Users.get_config(chat_id, "claude_systemprompt"))
     if api_key and ChatGPTbot:
         if "claude" in engine:
             ChatGPTbot.reset(convo_id=str(chat_id), system_prompt=claude_systemprompt)
@@ -498,39 +693,271 @@ def reset_ENGINE(chat_id, message=None):
         groqBot.reset(convo_id=str(chat_id), system_prompt=systemprompt)
     if VERTEX_PRIVATE_KEY and VERTEX_CLIENT_EMAIL and VERTEX_PROJECT_ID and vertexBot:
         vertexBot.reset(convo_id=str(chat_id), system_prompt=systemprompt)
+    history_slimmer.forget(chat_id)
+
+CLAUDE_URL = "https://api.anthropic.com/v1/messages"
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:{stream}?key={api_key}"
+VERTEX_URL = "https://us-central1-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/us-central1/publishers/google/models/{MODEL_ID}:{stream}"
+PROVIDER_CAPABILITIES = {
+    "claude": frozenset({"tools", "vision"}),
+    "groq": frozenset({"tools"}),
+    "gemini": frozenset({"tools", "vision"}),
+    "vertex": frozenset({"tools", "vision"}),
+    "openai": frozenset({"tools", "vision"}),
+    "duckduckgo": frozenset(),
+}
+
+def engine_type_for(robot_name, api_url, model):
+    # chatgpt 客户端总是使用 OpenAI 格式
+    if robot_name == "ChatGPTbot":
+        return "gpt"
+    try:
+        engine_type, _ = get_engine({"base_url": api_url}, endpoint=None, original_model=model)
+        return engine_type
+    except Exception as e:
+        print("error: get_engine failed:", model, e)
+        return "gpt"
+
+def make_route(provider, robot_name, api_key, api_url, model, per_user=False):
+    return Route(
+        provider=provider,
+        robot=robot_name,
+        api_key=api_key,
+        endpoint=api_url,
+        engine_type=engine_type_for(robot_name, api_url, model),
+        capabilities=PROVIDER_CAPABILITIES[provider],
+        per_user=per_user,
+    )
 
-def get_robot(chat_id = None):
-    global ChatGPTbot, groqBot, duckBot
+def resolve_route(engine, provider=None):
+    """Routing rules for one model; with provider set (MODEL_ROUTES), only that provider is considered."""
+    if engine == AUTO_MODEL:
+        # 不知道具体消息时 auto 按强模型处理
+        return resolve_route(AUTO_STRONG_MODEL or GPT_ENGINE, provider)
+    if provider is None:
+        if CLAUDE_API and "claude-3" in engine:
+            provider = "claude"
+        elif ("mixtral" in engine or "llama" in engine) and GROQ_API_KEY:
+            provider = "groq"
+        elif GOOGLE_AI_API_KEY and ("gemini" in engine or os.environ.get('API_URL') == None):
+            provider = "gemini"
+        elif VERTEX_PRIVATE_KEY and VERTEX_CLIENT_EMAIL and VERTEX_PROJECT_ID and "gemini" in engine:
+            provider = "vertex"
+        elif ChatGPTbot:
+            provider = "openai"
+        else:
+            provider = "duckduckgo"
+
+    if provider == "claude" and CLAUDE_API:
+        return make_route("claude", "ChatGPTbot", CLAUDE_API, CLAUDE_URL, engine)
+    if provider == "groq" and GROQ_API_KEY:
+        return make_route("groq", "groqBot", GROQ_API_KEY, GROQ_URL, engine)
+    if provider == "gemini" and GOOGLE_AI_API_KEY:
+        api_url = GEMINI_URL.format(model=engine, stream="streamGenerateContent", api_key=GOOGLE_AI_API_KEY)
+        return make_route("gemini", "ChatGPTbot", GOOGLE_AI_API_KEY, api_url, engine)
+    if provider == "vertex" and VERTEX_PRIVATE_KEY and VERTEX_CLIENT_EMAIL and VERTEX_PROJECT_ID:
+        return make_route("vertex", "vertexBot", VERTEX_PRIVATE_KEY, VERTEX_URL, engine)
+    if provider == "openai" and ChatGPTbot:
+        return make_route("openai", "ChatGPTbot", None, None, engine, per_user=True)
+    if provider == "duckduckgo":
+        return make_route("duckduckgo", "duckBot", "duckduckgo", None, engine)
+    return None
+
+# 可选的 auto 模型：简单消息交给快速模型，代码、数学、长文本和带附件的消息交给强模型
+AUTO_MODEL = "auto"
+AUTO_FAST_MODEL = os.environ.get('AUTO_FAST_MODEL', None)
+AUTO_STRONG_MODEL = os.environ.get('AUTO_STRONG_MODEL', None)
+AUTO_SHORT_WORDS = int(os.environ.get('AUTO_SHORT_WORDS', '60'))
+auto_router = AutoRouter(AUTO_FAST_MODEL, AUTO_STRONG_MODEL, short_limit=AUTO_SHORT_WORDS)
+
+def current_engine(chat_id = None):
+    """The user's model, with auto standing for the strong model where there is no message to classify."""
+    engine = Users.get_config(chat_id, "engine")
+    if engine == AUTO_MODEL:
+        return AUTO_STRONG_MODEL or GPT_ENGINE
+    return engine
+
+def choose_engine(chat_id, message, attachments=False):
+    """(auto route or None, model) for one message."""
     engine = Users.get_config(chat_id, "engine")
+    if engine != AUTO_MODEL or not auto_router.enabled:
+        return None, current_engine(chat_id)
+    return auto_router.choose(message, attachments, Users.get_config(chat_id, "auto_route"))
+
+# 模型到供应商的路由在模型列表变化时整体编译，之后每次调用只是一次字典查找
+MODEL_ROUTES = os.environ.get('MODEL_ROUTES', None)
+routing_table = RoutingTable(resolve_route, parse_overrides(MODEL_ROUTES))
+
+# API、claude_api_key、GROQ_API_KEY 可以用逗号分隔多个 key，按响应头中的剩余额度分配请求，429 的 key 暂停使用
+KEY_COOLDOWN = float(os.environ.get('KEY_COOLDOWN', '30'))
+key_pools = KeyPools(cooldown=KEY_COOLDOWN)
+
+def observe_rate_limits(api_key, response):
+    key_pools.observe(api_key, response.status_code, response.headers)
+
+# 每条消息从接收起的总时间预算，下载、解析、上游输出、编辑消息和追问都从剩余时间里扣除
+UPDATE_DEADLINE = int(os.environ.get('UPDATE_DEADLINE', '300'))
+# 单次 Telegram API 调用的超时上限
+TELEGRAM_TIMEOUT = int(os.environ.get('TELEGRAM_TIMEOUT', '30'))
+
+# 每个 (api_url, api_key) 一个长连接客户端，自带 key 的用户也能复用热连接
+POOL_MAX_CONNECTIONS = int(os.environ.get('POOL_MAX_CONNECTIONS', '20'))
+POOL_MAX_KEEPALIVE = int(os.environ.get('POOL_MAX_KEEPALIVE', '10'))
+POOL_IDLE_TIMEOUT = int(os.environ.get('POOL_IDLE_TIMEOUT', '300'))
+client_pool = ClientPool(
+    max_connections=POOL_MAX_CONNECTIONS,
+    max_keepalive=POOL_MAX_KEEPALIVE,
+    idle_timeout=POOL_IDLE_TIMEOUT,
+    timeout=UPDATE_DEADLINE,
+    on_response=observe_rate_limits,
+    on_request=request_layout.rewrite,
+)
+
+@lru_cache(maxsize=256)
+def chat_url(api_url):
+    return BaseAPI(api_url=api_url).chat_url
+
+def get_route(chat_id = None):
+    return routing_table.route(current_engine(chat_id))
+
+def route_endpoint(route, chat_id = None):
+    """(api_url, api_key) a route sends to: the user's own endpoint for per-user routes."""
+    if route.per_user:
+        return chat_url(Users.get_config(chat_id, "api_url")), Users.get_config(chat_id, "api_key")
+    return route.endpoint, route.api_key
+
+def get_robot(chat_id = None, engine = None):
+    route = routing_table.route(engine) if engine else get_route(chat_id)
     role = "user"
-    if CLAUDE_API and "claude-3" in engine:
-        robot = ChatGPTbot
-        api_key = CLAUDE_API
-        api_url = "https://api.anthropic.com/v1/messages"
-    elif ("mixtral" in engine or "llama" in engine) and GROQ_API_KEY:
-        robot = groqBot
-        api_key = GROQ_API_KEY
-        api_url = "https://api.groq.com/openai/v1/chat/completions"
-    elif GOOGLE_AI_API_KEY and ("gemini" in engine or os.environ.get('API_URL') == None):
-        robot = ChatGPTbot
-        api_key = GOOGLE_AI_API_KEY
-        api_url = "https://generativelanguage.googleapis.com/v1beta/models/{model}:{stream}?key={api_key}"
-        api_url = api_url.format(model=engine, stream="streamGenerateContent", api_key=api_key)
-    elif VERTEX_PRIVATE_KEY and VERTEX_CLIENT_EMAIL and VERTEX_PROJECT_ID and "gemini" in engine:
-        robot = vertexBot
-        api_key = VERTEX_PRIVATE_KEY
-        api_url = "https://us-central1-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/us-central1/publishers/google/models/{MODEL_ID}:{stream}"
-    elif ChatGPTbot:
-        robot = ChatGPTbot
+    robot = globals()[route.robot]
+    api_url, api_key = route_endpoint(route, chat_id)
+    api_key = key_pools.pick(api_key)
+    robot = client_pool.robot(robot, api_url, api_key)
+    return robot, role, api_key, api_url
+
+def rotate_key(robot, api_url, api_key):
+    """After a failed attempt, the next key from the same pool and the robot bound to it."""
+    next_key = key_pools.rotate(api_key)
+    if next_key == api_key:
+        return robot, api_key
+    return client_pool.robot(getattr(robot, "base", robot), api_url, next_key), next_key
+
+# 启动时预热所有已配置的端点，空闲时定期 ping 保持连接；间隔需小于连接池的 keepalive 时间（60 秒），0 表示关闭
+WARM_INTERVAL = int(os.environ.get('WARM_INTERVAL', '45'))
+connection_warmer = ConnectionWarmer(client_pool, interval=WARM_INTERVAL)
+
+def endpoint_targets(api_url, api_key):
+    # 多 key 配置的每个 key 各有一个客户端
+    return [(api_url, key) for key in split_keys(api_key) or [api_key]]
+
+def warm_targets():
+    """(api_url, api_key) of every configured endpoint that requests go through the client pool."""
+    targets = set()
+    if ChatGPTbot:
+        targets.update(endpoint_targets(chat_url(Users.get_config(None, "api_url")), Users.get_config(None, "api_key")))
+    for route in set(routing_table.routes.values()):
+        if route is None or route.per_user or not route.endpoint or "{" in route.endpoint:
+            continue
+        if hasattr(type(globals()[route.robot]), "ask_stream_async"):
+            targets.update(endpoint_targets(route.endpoint, route.api_key))
+    return targets
+
+def warm_user(chat_id):
+    """Start warming the user's endpoint in the background, e.g. a custom api_url seen for the first time."""
+    if not WARM_INTERVAL:
+        return
+    route = get_route(chat_id)
+    if route.per_user:
+        targets = endpoint_targets(chat_url(Users.get_config(chat_id, "api_url")), Users.get_config(chat_id, "api_key"))
+    elif route.endpoint and "{" not in route.endpoint and hasattr(type(globals()[route.robot]), "ask_stream_async"):
+        targets = endpoint_targets(route.endpoint, route.api_key)
+    else:
+        return
+    connection_warmer.warm_soon(targets)
+
+# 首字延迟超过该模型最近 TTFT 的分位数时，向等价模型发起备用请求，先返回的一方胜出
+# 格式 "gpt-4o=claude-3-7-sonnet-20250219,*=gpt-4o-mini"，* 表示所有模型；模型名里可能有 ":"，所以用 "=" 分隔
+HEDGE_MODELS = {}
+for item in os.environ.get('HEDGE_MODELS', '').split(","):
+    if not item.strip():
+        continue
+    model, separator, backup = item.partition("=")
+    if not separator or not model.strip() or not backup.strip():
+        print(f"error: HEDGE_MODELS entry {item.strip()!r} is not model=backup, ignored")
+        continue
+    HEDGE_MODELS[model.strip()] = backup.strip()
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '0.9'))
+ttft_tracker = TTFTTracker(percentile=HEDGE_PERCENTILE)
+
+def get_hedge_backup(engine, robot, chat_id = None):
+    """Backup (robot, model, api_key, api_url) for a hedged request, or None when there is none."""
+    backup_model = HEDGE_MODELS.get(engine) or HEDGE_MODELS.get("*")
+    if not backup_model or backup_model == engine:
+        return None
+    route = routing_table.route(backup_model)
+    backup_robot = globals()[route.robot]
+    # 备用请求在会话的副本上运行，只有同一类客户端的会话格式才能互相替换
+    if backup_robot is None or type(getattr(robot, "base", robot)) is not type(backup_robot):
+        return None
+    if route.per_user:
         api_key = Users.get_config(chat_id, "api_key")
-        api_url = Users.get_config(chat_id, "api_url")
-        api_url = BaseAPI(api_url=api_url).chat_url
+        api_url = chat_url(Users.get_config(chat_id, "api_url"))
     else:
-        robot = duckBot
-        api_key = "duckduckgo"
-        api_url = None
-
-    return robot, role, api_key, api_url
+        api_key = route.api_key
+        api_url = route.endpoint
+    api_key = key_pools.pick(api_key)
+    return client_pool.robot(backup_robot, api_url, api_key), backup_model, api_key, api_url
+
+# 所有上游调用共用的重试预算和按供应商划分的熔断器，避免故障期间重试风暴放大故障
+RETRY_BUDGET_RATIO = float(os.environ.get('RETRY_BUDGET_RATIO', '0.1'))
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '3'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_TIME = float(os.environ.get('CIRCUIT_RECOVERY_TIME', '30'))
+resilience = Resilience(
+    RetryBudget(ratio=RETRY_BUDGET_RATIO),
+    max_attempts=RETRY_MAX_ATTEMPTS,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    recovery_time=CIRCUIT_RECOVERY_TIME,
+)
+
+@lru_cache(maxsize=256)
+def url_host(api_url):
+    return httpx.URL(api_url).host if api_url else ""
+
+# 不带历史的相同请求（翻译、内联、追问、简历分析）同时只向上游发送一次，结果分给所有请求者
+single_flight = SingleFlight()
+
+def flight_key(model, system_prompt, messages, api_url, api_key, *extra):
+    # 同一账户（同一个 key 池）的相同请求才合并，不同用户自己的 key 互不共享
+    return SingleFlight.key(model, system_prompt, messages, api_url, key_pools.setting(api_key), *extra)
+
+# /en2zh、/zh2en 的完整译文按（模型、提示词、原文、端点、账户）缓存，内存 LRU + 磁盘两级，TTL 为 0 时关闭
+TRANSLATION_CACHE_DIR = os.environ.get('TRANSLATION_CACHE_DIR', os.path.join(CONFIG_DIR, 'translations'))
+TRANSLATION_CACHE_TTL = int(os.environ.get('TRANSLATION_CACHE_TTL', str(7 * 86400)))
+TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', '512'))
+TRANSLATION_CACHE_BYTES = int(os.environ.get('TRANSLATION_CACHE_BYTES', str(64 * 1024 * 1024)))
+translation_cache = ResponseCache(
+    TRANSLATION_CACHE_DIR,
+    ttl=TRANSLATION_CACHE_TTL,
+    memory_entries=TRANSLATION_CACHE_SIZE,
+    max_bytes=TRANSLATION_CACHE_BYTES,
+) if TRANSLATION_CACHE_TTL > 0 else None
+
+def translation_key(model, system_prompt, text, api_url, api_key):
+    # 与 flight_key 相同，只在同一端点、同一账户（同一个 key 池）内共享译文
+    return translation_cache.key(model, system_prompt, text, api_url, key_pools.setting(api_key))
+
+# 长文翻译按段落切块并发翻译，再按原顺序输出；所有翻译共用同一组并发名额
+TRANSLATION_CHUNK_CHARS = int(os.environ.get('TRANSLATION_CHUNK_CHARS', '2000'))
+TRANSLATION_CONCURRENCY = max(1, int(os.environ.get('TRANSLATION_CONCURRENCY', '4')))
+translation_slots = asyncio.Semaphore(TRANSLATION_CONCURRENCY)
+
+def upstream_name(engine, api_url = None):
+    """Circuit breaker name for a call: the model's provider, plus the host for user-supplied URLs."""
+    route = routing_table.route(engine)
+    host = url_host(api_url) if route.per_user else ""
+    return f"{route.provider}@{host}" if host else route.provider
 
 whitelist = os.environ.get('whitelist', None)
 if whitelist == "":
@@ -570,23 +997,26 @@ def get_status(chatid = None, item = None):
         return "✅ " if int(Users.get_config(chatid, item)) > 2 else "☑️ "
     return "✅ " if Users.get_config(chatid, item) else "☑️ "
 
+@lru_cache(maxsize=64)
+def model_abbreviations(models):
+    # 去掉模型名末尾的日期等数字，缩写重复时保留全名
+    abbreviation_strings = [delete_model_digit_tail(s.split("-")) for s in models]
+    counter = Counter(abbreviation_strings)
+    filtered_counter = {key: count for key, count in counter.items() if count > 1}
+
+    strings_array = {}
+    for s, abbreviation in zip(models, abbreviation_strings):
+        if abbreviation in filtered_counter:
+            strings_array[s] = s
+        else:
+            strings_array[abbreviation] = s
+    return MappingProxyType(strings_array)
+
 def create_buttons(strings, plugins_status=False, lang="English", button_text=None, Suffix="", chatid=None):
     if plugins_status:
         strings_array = {kv:kv for kv in strings}
     else:
-        # 过滤出长度小于15的字符串
-        abbreviation_strings = [delete_model_digit_tail(s.split("-")) for s in strings]
-        from collections import Counter
-        counter = Counter(abbreviation_strings)
-        filtered_counter = {key: count for key, count in counter.items() if count > 1}
-        # print(filtered_counter)
-
-        strings_array = {}
-        for s in strings:
-            if delete_model_digit_tail(s.split("-")) in filtered_counter:
-                strings_array[s] = s
-            else:
-                strings_array[delete_model_digit_tail(s.split('-'))] = s
+        strings_array = model_abbreviations(tuple(strings))
 
     if not button_text:
         button_text = {k:{lang:k} for k in strings_array.keys()}
@@ -663,10 +1093,8 @@ def remove_no_text_model(model_list):
         set_models.add(model_item)
     return list(set_models)
 
-if GET_MODELS:
-    robot, role, api_key, api_url = get_robot()
-    engine = Users.get_config(None, "engine")
-    provider = {
+def models_provider(api_url, api_key, engine):
+    return {
         "provider": "openai",
         "base_url": api_url,
         "api": api_key,
@@ -674,27 +1102,36 @@ if GET_MODELS:
         "tools": True,
         "image": True
     }
-    initial_model = remove_no_text_model(update_initial_model(provider))
+
+def model_sources():
+    """(api_url, api_key, engine) of each endpoint to ask for models.
+
+    Resolved on the event loop, since it reads the user cache and picks from
+    the key pools; fetch_models only gets the plain values.
+    """
+    engine = current_engine(None)
+    api_url, api_key = route_endpoint(get_route(None))
+    api_key = key_pools.pick(api_key)
+    sources = [(api_url, api_key, engine)]
     if ChatGPTbot:
-        robot = ChatGPTbot
-        api_key = Users.get_config(None, "api_key")
-        api_url = Users.get_config(None, "api_url")
-        api_url = BaseAPI(api_url=api_url).chat_url
-        provider = {
-            "provider": "openai",
-            "base_url": api_url,
-            "api": api_key,
-            "model": [engine],
-            "tools": True,
-            "image": True
-        }
-        gpt_initial_model = remove_no_text_model(update_initial_model(provider))
-        # print("gpt_initial_model", gpt_initial_model)
-        initial_model = list(set(gpt_initial_model + initial_model))
+        gpt_api_keys = split_keys(Users.get_config(None, "api_key"))
+        gpt_api_url = BaseAPI(api_url=Users.get_config(None, "api_url")).chat_url
+        # 与上面是同一个接口时不再重复请求
+        if gpt_api_url != api_url or api_key not in (gpt_api_keys or [None]):
+            sources.append((gpt_api_url, key_pools.pick(Users.get_config(None, "api_key")), engine))
+    return sources
+
+def fetch_models(sources):
+    """Blocking fetch of the model lists of sources; ModelCatalog runs it in a worker thread."""
+    models = set()
+    for api_url, api_key, engine in sources:
+        models.update(remove_no_text_model(update_initial_model(models_provider(api_url, api_key, engine))))
+    return list(models)
 
 # Structure for storing model groups
 MODEL_GROUPS = {}
 CUSTOM_MODELS_LIST = []
+UNGROUPED_MODELS = []
 
 CUSTOM_MODELS = os.environ.get('CUSTOM_MODELS', None)
 if CUSTOM_MODELS:
@@ -760,11 +1197,9 @@ if CUSTOM_MODELS:
         MODEL_GROUPS["OTHERS"] = ungrouped_models
         print(f"Created OTHERS group with models: {ungrouped_models}")
     else:
-        # Add models without group directly to initial_model
-        for model in ungrouped_models:
-            if model not in initial_model:
-                initial_model.append(model)
-                print(f"Added ungrouped model to initial_model: {model}")
+        # Models without group are added directly to the model list
+        UNGROUPED_MODELS = ungrouped_models
+        print(f"Added ungrouped models to the model list: {ungrouped_models}")
 
 # Remove OTHERS group if it's empty
 if "OTHERS" in MODEL_GROUPS and not MODEL_GROUPS["OTHERS"]:
@@ -777,22 +1212,26 @@ if "OTHERS" in MODEL_GROUPS and not MODEL_GROUPS["OTHERS"]:
 CUSTOM_MODELS_LIST = list(dict.fromkeys(CUSTOM_MODELS_LIST))
 # print("After removing duplicates, CUSTOM_MODELS_LIST:", CUSTOM_MODELS_LIST)
 
-# We remove models if there are deletion flags
-if CUSTOM_MODELS_LIST:
+def apply_custom_models(models):
+    """CUSTOM_MODELS deletion flags and additions, applied to every fetched model list."""
+    models = list(models)
+    for model in UNGROUPED_MODELS:
+        if model not in models:
+            models.append(model)
+
+    # We remove models if there are deletion flags
     delete_models = [model[1:] for model in CUSTOM_MODELS_LIST if model.startswith('-')]
     for target in delete_models:
         if target == "all":
-            initial_model = []
+            models = []
             break
-        for model in list(initial_model):  # We create a copy of the list for safe deletion
-            if target in model:
-                initial_model.remove(model)
+        models = [model for model in models if target not in model]
 
     # We add only models, not groups and not deletion flags
     for model in CUSTOM_MODELS_LIST:
-        if not model.startswith('-') and model not in MODEL_GROUPS.keys() and model not in initial_model:
-            initial_model.append(model)
-            print(f"Added to initial_model: {model}")
+        if not model.startswith('-') and model not in MODEL_GROUPS and model not in models:
+            models.append(model)
+    return models
 
 # We output information about groups for debugging
 # print("MODEL_GROUPS:", MODEL_GROUPS)
@@ -800,34 +1239,90 @@ for group, models in MODEL_GROUPS.items():
     print(f"Group {group}: {len(models)} models - {models}")
 # print("Final initial_model:", initial_model)
 
+# 模型列表从磁盘快照立即加载，由后台任务按 MODEL_REFRESH_INTERVAL 刷新，启动和 /reset 都不等待供应商
+MODEL_CACHE_FILE = os.environ.get('MODEL_CACHE_FILE', os.path.join(CONFIG_DIR, 'models.json'))
+MODEL_REFRESH_INTERVAL = int(os.environ.get('MODEL_REFRESH_INTERVAL', '3600'))
+model_catalog = ModelCatalog(
+    fetch=fetch_models if GET_MODELS else None,
+    sources=model_sources,
+    transform=apply_custom_models,
+    snapshot_file=MODEL_CACHE_FILE,
+    ttl=MODEL_REFRESH_INTERVAL,
+    fallback=initial_model,
+)
+
+# 额外的模型别名，例如 "4o=gpt-4o,sonnet=claude-3-7-sonnet-20250219"
+MODEL_ALIASES = dict(
+    item.split("=", 1) for item in os.environ.get('MODEL_ALIASES', '').split(",") if "=" in item
+)
+MODEL_ALIASES = {alias.strip(): model.strip() for alias, model in MODEL_ALIASES.items()}
+MODELS_PAGE_SIZE = int(os.environ.get('MODELS_PAGE_SIZE', '20'))
+model_registry = None
+model_registry_version = None
+
+def get_model_registry():
+    """Registry for the current model list, rebuilt only when the catalog changes."""
+    global model_registry, model_registry_version
+    if model_registry_version != model_catalog.version:
+        models = model_catalog.models
+        # 按钮上显示的缩写也可以作为 /model 的参数
+        aliases = {abbreviation: model for abbreviation, model in model_abbreviations(models).items() if abbreviation != model}
+        aliases.update(MODEL_ALIASES)
+        if auto_router.enabled:
+            models = (AUTO_MODEL,) + tuple(models)
+        model_registry = ModelRegistry(models, MODEL_GROUPS, aliases)
+        model_registry_version = model_catalog.version
+        routing_table.compile(model_registry.all_models)
+    return model_registry
+
+get_model_registry()
+
 # Function to get all available models (with groups)
 def get_all_available_models():
-    return initial_model
+    return get_model_registry().all_models
 
 # Function to get all model groups
 def get_model_groups():
-    return MODEL_GROUPS
+    return get_model_registry().groups
 
 # Function to get models in a specific group
 def get_models_in_group(group_name):
-    return MODEL_GROUPS.get(group_name, [])
+    return get_model_registry().groups.get(group_name, ())
 
 def get_current_lang(chatid=None):
     current_lang = Users.get_config(chatid, "language")
     return LANGUAGES_TO_CODE[current_lang]
 
-def update_models_buttons(chatid=None, group=None):
+def update_models_buttons(chatid=None, group=None, page=0):
     lang = get_current_lang(chatid)
+    registry = get_model_registry()
+    # 模型列表不依赖用户的其他设置，按语言、页码和模型列表版本缓存即可
+    key = ("models", lang, group, page, model_registry_version)
+    return thaw_keyboard(render_cache.get(key, lambda: freeze_keyboard(build_models_buttons(registry, lang, group, page))))
+
+def page_buttons(page, pages, callback_prefix):
+    # 模型太多时分页，避免键盘超出 Telegram 的限制
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=f"{callback_prefix}_PAGE_{page - 1}"))
+    row.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{callback_prefix}_PAGE_{page}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton("▶️", callback_data=f"{callback_prefix}_PAGE_{page + 1}"))
+    return row
+
+def build_models_buttons(registry, lang, group=None, page=0):
     back_button_data = "BACK"  # Default value
 
-    if group and group in MODEL_GROUPS:
+    if group and group in registry.groups:
         # Showing models in the selected group
-        models_in_group = MODEL_GROUPS[group]
+        models_in_group, page, pages = registry.page(registry.groups[group], page, MODELS_PAGE_SIZE)
         buttons = create_buttons(models_in_group, Suffix="_MODELS")
+        if pages > 1:
+            buttons.append(page_buttons(page, pages, f"{group}_GROUP"))
         back_button_data = "MODELS"  # To return to model groups
-    elif MODEL_GROUPS and not group:
+    elif registry.groups and not group:
         # Showing groups
-        groups_list = list(MODEL_GROUPS.keys())
+        groups_list = list(registry.groups.keys())
 
         # Creating buttons manually
         buttons = []
@@ -855,7 +1350,10 @@ def update_models_buttons(chatid=None, group=None):
         back_button_data = "BACK"  # To return to the main menu
     else:
         # Showing all models (if there are no groups)
-        buttons = create_buttons(initial_model, Suffix="_MODELS")
+        models, page, pages = registry.page(registry.models, page, MODELS_PAGE_SIZE)
+        buttons = create_buttons(models, Suffix="_MODELS")
+        if pages > 1:
+            buttons.append(page_buttons(page, pages, "MODELS"))
         back_button_data = "BACK"  # To return to the main menu
 
     # Adding a "Back" button with appropriate callback_data
@@ -869,6 +1367,9 @@ def update_models_buttons(chatid=None, group=None):
 
 def update_first_buttons_message(chatid=None):
     lang = get_current_lang(chatid)
+    return thaw_keyboard(render_cache.get(("first", lang), lambda: freeze_keyboard(build_first_buttons(lang))))
+
+def build_first_buttons(lang):
     first_buttons = [
         [
             InlineKeyboardButton(strings["button_change_model"][lang], callback_data="MODELS"),
@@ -883,6 +1384,10 @@ def update_first_buttons_message(chatid=None):
 
 def update_menu_buttons(setting, _strings, chatid):
     lang = get_current_lang(chatid)
+    key = ("menu", _strings, lang, Users.user_key(chatid), Users.settings_version(chatid))
+    return thaw_keyboard(render_cache.get(key, lambda: freeze_keyboard(build_menu_buttons(setting, _strings, chatid, lang))))
+
+def build_menu_buttons(setting, _strings, chatid, lang):
     setting_list = list(setting.keys())
     buttons = create_buttons(setting_list, plugins_status=True, lang=lang, button_text=strings, chatid=chatid, Suffix=_strings)
     buttons.append(
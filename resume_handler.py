@@ -3,7 +3,7 @@ from resume_detector import ResumeDetector
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from md2tgmd.src.md2tgmd import escape
 from utils.scripts import GetMesageInfo, Document_extract
-from config import Users, get_robot, RESUME_PROMPTS, AI_PHOTOS_URL
+from config import Users, get_robot, RESUME_PROMPTS, AI_PHOTOS_URL, current_engine
 import utils.decorators as decorators
 
 resume_detector = ResumeDetector()
@@ -53,7 +53,7 @@ async def get_resume_analysis(text: str, language: str, convo_id: str) -> str:
     
     # Use existing GPT function but with custom prompt
     robot, role, api_key, api_url = get_robot(convo_id)
-    engine = Users.get_config(convo_id, "engine")
+    engine = current_engine(convo_id)
     
     response = await robot.ask_async(
         prompt.format(resume_text=text[:3000]),  # Limit text length
@@ -83,7 +83,7 @@ async def handle_document_resumebek(update, context):
     # Extract text from document (use existing extraction logic)
     if file_url:
         robot, role, api_key, api_url = get_robot(convo_id)
-        engine = Users.get_config(convo_id, "engine")
+        engine = current_engine(convo_id)
         from aient.src.aient.core.utils import get_engine
         engine_type, _ = get_engine({"base_url": api_url}, endpoint=None, original_model=engine)
         if robot.__class__.__name__ == "chatgpt":
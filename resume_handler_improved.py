@@ -4,8 +4,9 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import TelegramError, TimedOut, NetworkError
 from md2tgmd.src.md2tgmd import escape
 from utils.scripts import GetMesageInfo, Document_extract
-from config import Users, get_robot, RESUME_PROMPTS, AI_PHOTOS_URL
+from config import Users, get_robot, RESUME_PROMPTS, AI_PHOTOS_URL, request_layout, routing_table, resilience, upstream_name, current_engine, single_flight, flight_key, metered_call
 import utils.decorators as decorators
+from utils import deadline
 import logging
 import asyncio
 from typing import Optional
@@ -82,57 +83,56 @@ def create_ai_photos_button(user_id: int, language: str) -> InlineKeyboardMarkup
     return InlineKeyboardMarkup(keyboard)
 
 async def get_resume_analysis_with_retry(text: str, language: str, convo_id: str, 
-                                        max_retries: int = 3) -> Optional[str]:
+                                        max_retries: int = 3, usage_id: Optional[str] = None) -> Optional[str]:
     """Get GPT analysis with retry logic"""
-    prompt = RESUME_PROMPTS.get(language, RESUME_PROMPTS['ru'])
+    # Instructions go into the system prompt so the prefix stays cacheable; only the resume text varies
+    system_prompt, prompt = request_layout.split_template(RESUME_PROMPTS.get(language, RESUME_PROMPTS['ru']))
     
     robot, role, api_key, api_url = get_robot(convo_id)
-    engine = Users.get_config(convo_id, "engine")
+    engine = current_engine(convo_id)
     
-    for attempt in range(max_retries):
-        try:
-            response = await asyncio.wait_for(
-                robot.ask_async(
-                    prompt.format(resume_text=text[:3000]),  # Limit text length
-                    convo_id=convo_id,
-                    model=engine,
-                    api_url=api_url,
-                    api_key=api_key,
-                    pass_history=0
-                ),
-                timeout=60.0  # 60 second timeout
-            )
-            
-            # Add photo CTA to response
-            cta_texts = {
-                'kk': "\n\n📸 **Резюмеңізге кәсіби сурет қосыңыз!**\nСтудент пакеті: 990₸ (80% жеңілдік)\n👆 Тапсырыс беру үшін төмендегі батырманы басыңыз",
-                'ru': "\n\n📸 **Добавьте профессиональное фото к резюме!**\nСтуденческий пакет: 990₸ (скидка 80%)\n👆 Нажмите кнопку ниже для заказа",
-                'en': "\n\n📸 **Add a professional photo to your resume!**\nStudent Package: 990₸ (80% discount)\n👆 Click the button below to order"
-            }
-            
-            cta = cta_texts.get(language, cta_texts['ru'])
-            return response + cta
-            
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout on attempt {attempt + 1} for resume analysis")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-            else:
-                raise
-                
-        except Exception as e:
-            logger.error(f"Error on attempt {attempt + 1} for resume analysis: {e}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-            else:
-                raise
+    async def analyse():
+        return await asyncio.wait_for(
+            robot.ask_async(
+                prompt.format(resume_text=text[:3000]),  # Limit text length
+                convo_id=convo_id,
+                model=engine,
+                api_url=api_url,
+                api_key=api_key,
+                system_prompt=system_prompt,
+                pass_history=0
+            ),
+            timeout=60.0  # 60 second timeout per attempt
+        )
+
+    # Retries use the shared budget, jittered backoff and the provider's circuit breaker
+    try:
+        # Identical resumes sent at the same time share one upstream request
+        # Counted against the user's daily quota like any other request
+        # The update's deadline bounds all attempts together, so running out of it is not retried
+        response = await deadline.run("upstream", metered_call(usage_id or convo_id, engine, system_prompt + prompt.format(resume_text=text[:3000]), lambda: single_flight.call(
+            flight_key(engine, system_prompt, prompt.format(resume_text=text[:3000]), api_url, api_key),
+            lambda: resilience.call(upstream_name(engine, api_url), analyse, max_attempts=max_retries),
+        )))
+    except Exception as e:
+        logger.error(f"Resume analysis failed: {type(e).__name__}: {e}")
+        raise
+
+    # Add photo CTA to response
+    cta_texts = {
+        'kk': "\n\n📸 **Резюмеңізге кәсіби сурет қосыңыз!**\nСтудент пакеті: 990₸ (80% жеңілдік)\n👆 Тапсырыс беру үшін төмендегі батырманы басыңыз",
+        'ru': "\n\n📸 **Добавьте профессиональное фото к резюме!**\nСтуденческий пакет: 990₸ (скидка 80%)\n👆 Нажмите кнопку ниже для заказа",
+        'en': "\n\n📸 **Add a professional photo to your resume!**\nStudent Package: 990₸ (80% discount)\n👆 Click the button below to order"
+    }
     
-    return None
+    cta = cta_texts.get(language, cta_texts['ru'])
+    return response + cta
 
 def get_error_message(error_type: str, language: str) -> str:
     """Get localized error message"""
     return ERROR_MESSAGES.get(error_type, {}).get(language, ERROR_MESSAGES[error_type]['ru'])
 
+@decorators.Deadline
 @decorators.GroupAuthorization
 @decorators.Authorization
 async def handle_document_resumebek_improved(update, context):
@@ -154,15 +154,13 @@ async def handle_document_resumebek_improved(update, context):
         if file_url:
             try:
                 robot, role, api_key, api_url = get_robot(convo_id)
-                engine = Users.get_config(convo_id, "engine")
-                from aient.src.aient.core.utils import get_engine
-                engine_type, _ = get_engine({"base_url": api_url}, endpoint=None, original_model=engine)
-                if robot.__class__.__name__ == "chatgpt":
-                    engine_type = "gpt"
+                engine = current_engine(convo_id)
+                engine_type = routing_table.route(engine).engine_type
                 
-                text = await asyncio.wait_for(
+                text = await deadline.run(
+                    "extract",
                     Document_extract(file_url, image_url, engine_type),
-                    timeout=30.0  # 30 second timeout for file extraction
+                    cap=30.0  # 30 second timeout for file extraction
                 )
                 
             except asyncio.TimeoutError:
@@ -226,7 +224,7 @@ async def handle_document_resumebek_improved(update, context):
         
         try:
             # Get resume analysis with retry logic
-            analysis = await get_resume_analysis_with_retry(text, detected_lang, convo_id)
+            analysis = await get_resume_analysis_with_retry(text, detected_lang, convo_id, usage_id=str(update.effective_user.id))
             
             if not analysis:
                 raise Exception("Failed to get analysis after retries")
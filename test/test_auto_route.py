@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.auto_route import FAST, STRONG, AutoRouter, classify
+
+def test_casual_messages_go_fast():
+    for message in ("thanks!", "What's the capital of Peru?", "你好，今天天气怎么样", "Привет, как дела?"):
+        assert classify(message)[0] == FAST, message
+
+def test_hard_messages_go_strong():
+    cases = {
+        "Why does my loop never end?": "reasoning",
+        "```python\nprint(1)\n```": "code",
+        "def f(x):\n    return x": "code",
+        "solve 3x^2 = 12": "math",
+        "word " * 80: "length",
+    }
+    for message, reason in cases.items():
+        assert classify(message) == (STRONG, reason), message
+
+def test_attachments_go_strong():
+    assert classify("what is this?", attachments=True) == (STRONG, "attachment")
+    assert classify([{"type": "text", "text": "hi"}]) == (STRONG, "attachment")
+
+def test_other_scripts_get_a_shorter_budget():
+    message = "сообщение " * 40
+    assert classify(message, short_limit=60)[0] == STRONG
+    assert classify("message " * 40, short_limit=60)[0] == FAST
+
+def test_override_and_counters():
+    router = AutoRouter("mini", "big")
+    assert router.choose("thanks") == (FAST, "mini")
+    assert router.choose("thanks", override=STRONG) == (STRONG, "big")
+    router.record(FAST, 0.4)
+    router.record(FAST, 0.6, failed=True)
+    assert router.total() == 2
+    assert "fast mini: 2 req, p50 0.4s, 1 bad" in router.summary()
+    assert not AutoRouter("mini", None).enabled
+
+if __name__ == "__main__":
+    test_casual_messages_go_fast()
+    test_hard_messages_go_strong()
+    test_attachments_go_strong()
+    test_other_scripts_get_a_shorter_budget()
+    test_override_and_counters()
+    print("ok")
@@ -0,0 +1,86 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chunked import split_paragraphs, ordered_stream
+
+def test_short_text_is_one_chunk():
+    assert split_paragraphs("  one\n\ntwo  ", 100) == ["one\n\ntwo"]
+    assert split_paragraphs("one\n\ntwo", 0) == ["one\n\ntwo"]
+    assert split_paragraphs("", 10) == []
+
+def test_splits_at_paragraphs():
+    text = "\n\n".join(["a" * 40, "b" * 40, "c" * 40])
+    assert split_paragraphs(text, 90) == ["a" * 40 + "\n\n" + "b" * 40, "c" * 40]
+
+def test_long_paragraph_split_between_lines_but_not_code():
+    text = "\n".join(["x" * 30] * 4) + "\n\n```\n" + "\n".join(["y" * 30] * 4) + "\n```"
+    chunks = split_paragraphs(text, 70)
+    assert chunks[:2] == ["x" * 30 + "\n" + "x" * 30] * 2
+    assert chunks[2].startswith("```") and chunks[2].endswith("```")
+
+def test_blank_lines_inside_code_are_kept():
+    text = "intro " * 20 + "\n\n```\nfirst\n\nsecond\n```"
+    assert split_paragraphs(text, 50)[-1] == "```\nfirst\n\nsecond\n```"
+
+def test_streams_in_order_and_concurrently():
+    running = []
+    peak = []
+
+    def maker(name, delay):
+        async def stream():
+            running.append(name)
+            peak.append(len(running))
+            await asyncio.sleep(delay)
+            yield name + "1"
+            yield name + "2"
+            running.remove(name)
+        return stream
+
+    async def run():
+        makers = [maker("a", 0.05), maker("b", 0.01), maker("c", 0.01)]
+        return [data async for data in ordered_stream(makers, asyncio.Semaphore(2))]
+
+    assert asyncio.run(run()) == ["a1", "a2", "\n\n", "b1", "b2", "\n\n", "c1", "c2"]
+    assert max(peak) == 2
+
+def test_error_surfaces_in_turn_and_cancels_rest():
+    cancelled = []
+
+    async def ok():
+        yield "fine"
+
+    async def broken():
+        raise ValueError("boom")
+        yield
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+            yield "late"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        seen = []
+        try:
+            async for data in ordered_stream([lambda: ok(), lambda: broken(), lambda: slow()], asyncio.Semaphore(3)):
+                seen.append(data)
+        except ValueError:
+            seen.append("error")
+        await asyncio.sleep(0)
+        return seen
+
+    assert asyncio.run(run()) == ["fine", "\n\n", "error"]
+    assert cancelled == [True]
+
+if __name__ == "__main__":
+    test_short_text_is_one_chunk()
+    test_splits_at_paragraphs()
+    test_long_paragraph_split_between_lines_but_not_code()
+    test_blank_lines_inside_code_are_kept()
+    test_streams_in_order_and_concurrently()
+    test_error_surfaces_in_turn_and_cancels_rest()
+    print("ok")
@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.config_store import SharedDirConfigStore, SQLiteConfigStore, JSONConfigStore, KVConfigStore, MemoryKV, DELETE
+
+def test_shared_dir_merges_concurrent_writes():
+    with tempfile.TemporaryDirectory() as directory:
+        workers = [SharedDirConfigStore(directory) for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda store=store, i=i: [store.save_many({"1": {"key%d_%d" % (i, n): n}}) for n in range(20)])
+            for i, store in enumerate(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        config = workers[0].load("1")
+        assert len(config) == 4 * 20, "a concurrent write was lost"
+
+def test_shared_dir_notifies_other_workers():
+    with tempfile.TemporaryDirectory() as directory:
+        a = SharedDirConfigStore(directory)
+        b = SharedDirConfigStore(directory)
+        a.save_many({"1": {"engine": "gpt-4o"}, "2": {"language": "Russian"}})
+        assert b.poll_changes() == {"1", "2"}
+        assert b.poll_changes() == set()
+        assert a.poll_changes() == set(), "a worker should ignore its own writes"
+        a.save_many({"1": {"engine": DELETE}})
+        assert b.load("1") == {}
+        assert sorted(b.user_ids()) == ["1", "2"]
+
+def test_shared_dir_journal_rotation():
+    with tempfile.TemporaryDirectory() as directory:
+        a = SharedDirConfigStore(directory, journal_limit=200)
+        b = SharedDirConfigStore(directory, journal_limit=200)
+        seen = set()
+        for n in range(30):
+            a.save_many({str(n): {"engine": "gpt-4o"}})
+            seen |= b.poll_changes()
+        assert seen == {str(n) for n in range(30)}
+        # 两次轮询之间日志轮换了不止一次，读取方无法知道丢了哪些用户
+        for n in range(30):
+            a.save_many({str(n): {"engine": "gpt-4"}})
+        assert b.poll_changes() is None
+        assert b.poll_changes() == set()
+
+def test_kv_store_notifies_other_workers():
+    server = MemoryKV()
+    a = KVConfigStore(server)
+    b = KVConfigStore(server)
+    a.save_many({"1": {"engine": "gpt-4o", "PASS_HISTORY": 3}})
+    b.save_many({"1": {"PASS_HISTORY": 5}})
+    assert a.load("1") == {"engine": "gpt-4o", "PASS_HISTORY": 5}
+    assert a.poll_changes() == {"1"}
+    assert b.poll_changes() == {"1"}
+    b.save_many({"1": {"engine": DELETE}})
+    assert a.load("1") == {"PASS_HISTORY": 5}
+    assert a.user_ids() == ["1"]
+
+def test_sqlite_round_trip_and_delete():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "configs.db")
+        store = SQLiteConfigStore(filename)
+        store.save_many({"1": {"engine": "gpt-4o", "PASS_HISTORY": 3, "PLUGINS": {"search": True}}})
+        store.save_many({"1": {"PASS_HISTORY": 5, "engine": DELETE}, "2": {"language": "Russian"}})
+        reopened = SQLiteConfigStore(filename)
+        assert reopened.load("1") == {"PASS_HISTORY": 5, "PLUGINS": {"search": True}}
+        assert sorted(reopened.user_ids()) == ["1", "2"]
+        assert reopened.load("3") == {}
+        assert reopened.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_sqlite_concurrent_writers():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "configs.db")
+        workers = [SQLiteConfigStore(filename) for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda store=store, i=i: [store.save_many({"1": {"key%d_%d" % (i, n): n}}) for n in range(20)])
+            for i, store in enumerate(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(workers[0].load("1")) == 4 * 20, "a concurrent write was lost"
+
+def test_sqlite_imports_json_dir_once():
+    with tempfile.TemporaryDirectory() as directory:
+        JSONConfigStore(directory).save_many({"1": {"engine": "gpt-4o"}})
+        store = SQLiteConfigStore(os.path.join(directory, "configs.db"))
+        assert store.import_json_dir(directory) == 1
+        assert store.load("1") == {"engine": "gpt-4o"}
+        assert store.import_json_dir(directory) == 0
+
+if __name__ == "__main__":
+    test_shared_dir_merges_concurrent_writes()
+    test_shared_dir_notifies_other_workers()
+    test_shared_dir_journal_rotation()
+    test_kv_store_notifies_other_workers()
+    test_sqlite_round_trip_and_delete()
+    test_sqlite_concurrent_writers()
+    test_sqlite_imports_json_dir_once()
+    print("ok")
@@ -0,0 +1,96 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import deadline
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_budget_shrinks_and_caps():
+    clock = Clock()
+    with deadline.scope(100, clock) as current:
+        assert deadline.timeout(30) == 30
+        clock.now += 80
+        assert deadline.timeout(30) == 20
+        clock.now += 30
+        assert current.expired
+        assert deadline.telegram(30)["read_timeout"] == 5
+    assert deadline.current.get() is None
+    assert deadline.timeout(30) == 30
+    assert deadline.timeout() is None
+
+def test_run_counts_stage_timeouts():
+    async def stuck():
+        await asyncio.sleep(10)
+
+    async def run():
+        with deadline.scope(0.05):
+            try:
+                await deadline.run("extract", stuck())
+            except deadline.DeadlineExceeded as e:
+                return e.stage
+
+    before = deadline.timeouts["extract"]
+    assert asyncio.run(run()) == "extract"
+    assert deadline.timeouts["extract"] == before + 1
+
+def test_stage_cap_is_not_a_deadline_timeout():
+    async def stuck():
+        await asyncio.sleep(10)
+
+    async def run():
+        with deadline.scope(60):
+            try:
+                await deadline.run("upstream", stuck(), cap=0.01)
+            except deadline.DeadlineExceeded:
+                return "deadline"
+            except asyncio.TimeoutError:
+                return "cap"
+
+    before = deadline.timeouts["upstream"]
+    assert asyncio.run(run()) == "cap"
+    assert deadline.timeouts["upstream"] == before
+
+def test_telegram_cap_comes_from_the_scope():
+    assert deadline.telegram() == {}
+    with deadline.scope(100, telegram=30):
+        assert deadline.telegram()["pool_timeout"] == 30
+        assert deadline.telegram(10)["pool_timeout"] == 10
+
+def test_stream_closes_source_on_timeout():
+    closed = []
+
+    async def source():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    async def run():
+        seen = []
+        with deadline.scope(0.05):
+            try:
+                async for data in deadline.stream("upstream", source()):
+                    seen.append(data)
+            except asyncio.TimeoutError:
+                seen.append("timeout")
+        return seen
+
+    assert asyncio.run(run()) == ["first", "timeout"]
+    assert closed == [True]
+
+if __name__ == "__main__":
+    test_budget_shrinks_and_caps()
+    test_run_counts_stage_timeouts()
+    test_stage_cap_is_not_a_deadline_timeout()
+    test_telegram_cap_comes_from_the_scope()
+    test_stream_closes_source_on_timeout()
+    print("ok")
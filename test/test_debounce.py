@@ -0,0 +1,58 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.debounce import CallbackCoalescer, collapse_callbacks
+
+def test_even_toggles_cancel_and_last_selection_wins():
+    batch = ["PLUGINS_toggle", "en_lang", "PASS_HISTORY_toggle", "PLUGINS_toggle", "zh_lang"]
+    changes, last = collapse_callbacks(batch, toggle_suffixes=("_toggle",), select_suffixes=("_lang",))
+    assert changes == ["PASS_HISTORY_toggle", "zh_lang"]
+    assert last == "zh_lang"
+
+def test_unknown_data_only_decides_the_menu():
+    changes, last = collapse_callbacks(["A_toggle", "BACK"], toggle_suffixes=("_toggle",))
+    assert changes == ["A_toggle"]
+    assert last == "BACK"
+
+def test_burst_is_handled_as_first_tap_plus_one_batch():
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+        await asyncio.sleep(0.01)
+
+    async def run():
+        coalescer = CallbackCoalescer(window=0.05)
+        first = asyncio.ensure_future(coalescer.run("message", 1, handler))
+        await asyncio.sleep(0)
+        merged = [await coalescer.run("message", data, handler) for data in (2, 3, 4)]
+        other = await coalescer.run("other", 5, handler)
+        return await first, merged, other, coalescer.pending
+
+    handled, merged, other, pending = asyncio.run(run())
+    assert handled and other and merged == [False] * 3
+    assert batches == [[1], [5], [2, 3, 4]]
+    assert pending == {}
+
+def test_handler_error_releases_the_key():
+    async def broken(batch):
+        raise ValueError("boom")
+
+    async def run():
+        coalescer = CallbackCoalescer(window=0.01)
+        try:
+            await coalescer.run("message", 1, broken)
+        except ValueError:
+            pass
+        return coalescer.pending
+
+    assert asyncio.run(run()) == {}
+
+if __name__ == "__main__":
+    test_even_toggles_cancel_and_last_selection_wins()
+    test_unknown_data_only_decides_the_menu()
+    test_burst_is_handled_as_first_tap_plus_one_batch()
+    test_handler_error_releases_the_key()
+    print("ok")
@@ -0,0 +1,106 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hedging import HedgedStream, TTFTTracker
+
+class StubProvider:
+    """Local stand-in for an upstream model: streams chunks after an injected first-token latency."""
+    def __init__(self, name, ttft, chunks=3, fail=False):
+        self.name = name
+        self.ttft = ttft
+        self.chunks = chunks
+        self.fail = fail
+        self.started = 0
+        self.cancelled = 0
+        self.finished = 0
+
+    async def stream(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.ttft)
+            if self.fail:
+                raise ConnectionError(f"{self.name} is down")
+            for index in range(self.chunks):
+                yield f"{self.name}-{index} "
+                await asyncio.sleep(0.001)
+            self.finished += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+
+async def collect(stream):
+    return [item async for item in stream]
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_fast_primary_never_hedges():
+    primary, backup = StubProvider("primary", 0.01), StubProvider("backup", 0.01)
+    stream = HedgedStream(primary.stream, backup.stream, delay=0.2)
+    items = run(collect(stream))
+    assert items == ["primary-0 ", "primary-1 ", "primary-2 "]
+    assert stream.winner == "primary" and not stream.hedged
+    assert backup.started == 0
+
+def test_slow_primary_loses_to_backup():
+    primary, backup = StubProvider("primary", 1.0), StubProvider("backup", 0.01)
+    stream = HedgedStream(primary.stream, backup.stream, delay=0.05)
+    items = run(collect(stream))
+    assert items[0] == "backup-0 "
+    assert stream.winner == "backup" and stream.hedged
+    assert primary.cancelled == 1 and backup.finished == 1
+    assert stream.ttft < 0.5
+
+def test_primary_still_wins_after_hedging():
+    primary, backup = StubProvider("primary", 0.1), StubProvider("backup", 1.0)
+    stream = HedgedStream(primary.stream, backup.stream, delay=0.05)
+    items = run(collect(stream))
+    assert items[0] == "primary-0 "
+    assert stream.winner == "primary" and stream.hedged
+    assert backup.cancelled == 1
+
+def test_failed_primary_fails_over_immediately():
+    primary, backup = StubProvider("primary", 0.01, fail=True), StubProvider("backup", 0.01)
+    stream = HedgedStream(primary.stream, backup.stream, delay=5)
+    items = run(collect(stream))
+    assert items[0] == "backup-0 " and stream.winner == "backup"
+
+def test_both_failing_raises_primary_error():
+    primary, backup = StubProvider("primary", 0.01, fail=True), StubProvider("backup", 0.02, fail=True)
+    try:
+        run(collect(HedgedStream(primary.stream, backup.stream, delay=0.01)))
+    except ConnectionError as e:
+        assert "primary" in str(e)
+    else:
+        raise AssertionError("expected ConnectionError")
+
+def test_threshold_follows_recent_ttft():
+    tracker = TTFTTracker(window=10, percentile=0.9, min_samples=5, default=8.0, floor=0.5, ceiling=30.0)
+    assert tracker.threshold("gpt-4o") == 8.0
+    for ttft in (1.0, 1.2, 0.9, 1.1, 3.0):
+        tracker.record("gpt-4o", ttft)
+    assert tracker.threshold("gpt-4o") == 3.0
+    for _ in range(10):
+        tracker.record("gpt-4o", 0.1)
+    assert tracker.threshold("gpt-4o") == 0.5
+
+def test_cold_samples_are_reported_apart():
+    tracker = TTFTTracker(window=10, min_samples=2, default=8.0, floor=0.5)
+    for ttft in (1.0, 1.0):
+        tracker.record("gpt-4o", ttft)
+    tracker.record("gpt-4o", 6.0, cold=True)
+    assert tracker.threshold("gpt-4o") == 1.0
+    summary = tracker.summary("gpt-4o")
+    assert summary["warm"]["count"] == 2 and summary["cold"]["p50"] == 6.0
+
+if __name__ == "__main__":
+    test_fast_primary_never_hedges()
+    test_slow_primary_loses_to_backup()
+    test_primary_still_wins_after_hedging()
+    test_failed_primary_fails_over_immediately()
+    test_both_failing_raises_primary_error()
+    test_threshold_follows_recent_ttft()
+    test_cold_samples_are_reported_apart()
+    print("ok")
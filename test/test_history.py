@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.history import HistorySlimmer
+
+class Robot:
+    def __init__(self, history):
+        self.conversation = {"c": history}
+
+def folded(slimmer, count):
+    history = []
+    for index in range(count):
+        history.append({"role": "user", "content": f"<document>{'x' * 50}{index}</document>"})
+        history.append({"role": "assistant", "content": "ok"})
+    robot = Robot(history)
+    slimmer.prepare(robot, "c")
+    return robot
+
+def restored(robot):
+    return [item["content"] for item in robot.conversation["c"] if item["role"] == "user" and "omitted=" not in item["content"]]
+
+def test_doc_ids_match_exactly():
+    slimmer = HistorySlimmer(doc_chars=10)
+    robot = folded(slimmer, 10)
+    slimmer.prepare(robot, "c", "look at doc10 again")
+    # slim() numbers documents from the newest turn back, so doc10 is the first one
+    assert restored(robot) == ["<document>" + "x" * 50 + "0</document>"]
+
+def test_ordinary_words_do_not_reinclude():
+    slimmer = HistorySlimmer(doc_chars=10)
+    robot = folded(slimmer, 1)
+    slimmer.prepare(robot, "c", "save the profile to a file")
+    assert restored(robot) == []
+    slimmer.prepare(robot, "c", "what does the document say?")
+    assert len(restored(robot)) == 1
+
+if __name__ == "__main__":
+    test_doc_ids_match_exactly()
+    test_ordinary_words_do_not_reinclude()
+    print("ok")
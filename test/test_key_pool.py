@@ -0,0 +1,85 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from utils.client_pool import ClientPool
+from utils.key_pool import KeyPool, KeyPools, parse_reset
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_parse_reset_formats():
+    assert parse_reset("6m0s", 0) == 360
+    assert parse_reset("20ms", 0) == 0.02
+    assert parse_reset("7", 0) == 7
+    assert parse_reset("2030-01-01T00:00:10Z", 0, wall_clock=lambda: 1893456000) == 10
+    assert parse_reset("soon", 0) is None
+
+def test_unknown_limits_round_robin():
+    pool = KeyPool(["a", "b", "c"])
+    assert [pool.pick() for _ in range(6)] == ["a", "b", "c", "a", "b", "c"]
+
+def test_prefers_key_with_most_remaining():
+    clock = Clock()
+    pool = KeyPool(["a", "b"], clock=clock)
+    pool.observe("a", 200, {"x-ratelimit-remaining-requests": "2", "x-ratelimit-reset-requests": "10s"})
+    pool.observe("b", 200, {"x-ratelimit-remaining-requests": "50", "x-ratelimit-reset-requests": "10s"})
+    assert pool.pick() == "b"
+    pool.observe("b", 200, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "10s"})
+    assert [pool.pick() for _ in range(2)] == ["a", "a"]
+    clock.now += 11
+    assert pool.pick() == "b"
+
+def test_429_cools_key_down():
+    clock = Clock()
+    pool = KeyPool(["a", "b"], cooldown=30, clock=clock)
+    pool.observe("a", 429, {"retry-after": "20"})
+    assert [pool.pick() for _ in range(3)] == ["b", "b", "b"]
+    clock.now += 21
+    assert "a" in [pool.pick() for _ in range(2)]
+
+def test_all_keys_cooling_picks_earliest():
+    clock = Clock()
+    pool = KeyPool(["a", "b"], clock=clock)
+    pool.observe("a", 429, {"retry-after": "50"})
+    pool.observe("b", 401, {})
+    assert pool.pick() == "a"
+
+def test_pools_by_setting_and_rotation():
+    pools = KeyPools()
+    assert pools.pick("single") == "single"
+    assert pools.pick("a, b") == "a"
+    assert pools.rotate("a") == "b"
+    pools.observe("b", 429, {"retry-after": "60"})
+    assert pools.pick("a, b") == "a"
+
+def test_client_pool_reports_responses():
+    seen = []
+    transport = httpx.MockTransport(lambda request: httpx.Response(429, headers={"retry-after": "5"}))
+
+    async def request():
+        pool = ClientPool(on_response=lambda key, response: seen.append((key, response.status_code)))
+        client = pool.client("https://api.example.com/v1/chat/completions", "sk-a")
+        client._transport = transport
+        await client.get("https://api.example.com/v1/chat/completions")
+        await pool.aclose()
+
+    asyncio.run(request())
+    assert seen == [("sk-a", 429)]
+
+if __name__ == "__main__":
+    test_parse_reset_formats()
+    test_unknown_limits_round_robin()
+    test_prefers_key_with_most_remaining()
+    test_429_cools_key_down()
+    test_all_keys_cooling_picks_earliest()
+    test_pools_by_setting_and_rotation()
+    test_client_pool_reports_responses()
+    print("ok")
@@ -0,0 +1,50 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.model_registry import ModelRegistry
+
+MODELS = ("gpt-4o", "gpt-4o-mini", "claude-3-7-sonnet-20250219", "gemini-2.0-flash")
+
+def registry():
+    return ModelRegistry(MODELS, {"Local": ["llama-3.1-8b"]}, {"sonnet": "claude-3-7-sonnet-20250219", "gone": "not-a-model"})
+
+def test_exact_case_insensitive_and_alias():
+    models = registry()
+    assert models.resolve("gpt-4o") == "gpt-4o"
+    assert models.resolve(" GPT-4o-Mini ") == "gpt-4o-mini"
+    assert models.resolve("Sonnet") == "claude-3-7-sonnet-20250219"
+    assert models.resolve("llama-3.1-8b") == "llama-3.1-8b"
+    assert "llama-3.1-8b" in models and len(models) == 5
+
+def test_close_names_are_only_suggested():
+    models = registry()
+    # 单个前缀或相近的名称不会直接切换模型
+    for name in ("gemini", "gpt-4o-mni", "claude-3-7-sonet-20250219", "gone"):
+        assert models.resolve(name) is None
+    assert models.suggest("gemini") == ["gemini-2.0-flash"]
+    assert models.suggest("gpt-4o-mni")[0] == "gpt-4o-mini"
+    assert models.suggest("gpt") == ["gpt-4o", "gpt-4o-mini"]
+    assert models.suggest("zzz") == []
+
+def test_prefix_search_is_sorted_and_limited():
+    models = registry()
+    assert models.with_prefix("GPT") == ["gpt-4o", "gpt-4o-mini"]
+    assert models.with_prefix("gpt", limit=1) == ["gpt-4o"]
+    assert models.with_prefix("o1") == []
+
+def test_pages_are_clamped():
+    models = [f"model-{i}" for i in range(45)]
+    assert ModelRegistry.page(models, 0, 20) == (models[:20], 0, 3)
+    assert ModelRegistry.page(models, 2, 20) == (models[40:], 2, 3)
+    assert ModelRegistry.page(models, 7, 20) == (models[40:], 2, 3)
+    assert ModelRegistry.page(models, -1, 20) == (models[:20], 0, 3)
+    assert ModelRegistry.page([], 3, 20) == ([], 0, 1)
+    assert ModelRegistry.page(models[:20], 1, 20) == (models[:20], 0, 1)
+
+if __name__ == "__main__":
+    test_exact_case_insensitive_and_alias()
+    test_close_names_are_only_suggested()
+    test_prefix_search_is_sorted_and_limited()
+    test_pages_are_clamped()
+    print("ok")
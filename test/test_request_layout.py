@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import asyncio
+from datetime import date
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from utils.client_pool import RewriteTransport
+from utils.request_layout import RequestLayout
+
+class StubProvider:
+    """Local stand-in for a provider: remembers the previous request and checks that it is a prefix of the next one."""
+    def __init__(self, provider):
+        self.provider = provider
+        self.last = None
+
+    def strip(self, value):
+        if isinstance(value, dict):
+            return {k: self.strip(v) for k, v in value.items() if k != "cache_control"}
+        if isinstance(value, list):
+            return [self.strip(v) for v in value]
+        return value
+
+    def flatten(self, body):
+        items = []
+        for key in ("system", "systemInstruction", "tools"):
+            if key in body:
+                items.append(json.dumps(self.strip(body[key]), sort_keys=True))
+        for item in body.get("messages", body.get("contents", [])):
+            content = self.strip(item)
+            # Claude 的断点会把字符串内容包成文本块，比较时还原
+            if isinstance(content.get("content"), list) and len(content["content"]) == 1 and content["content"][0].get("type") == "text":
+                content["content"] = content["content"][0]["text"]
+            items.append(json.dumps(content, sort_keys=True))
+        return items
+
+    def send(self, body):
+        current = self.flatten(body)
+        if self.last is not None:
+            assert current[:len(self.last)] == self.last, "cached prefix changed between turns"
+        self.last = current
+        return "answer %d" % len(current)
+
+def wire_body(provider, system_prompt, tools, history):
+    """A payload as the client library builds it: tools in registration order, no cache breakpoints."""
+    if provider == "claude":
+        return {"system": system_prompt, "tools": tools, "messages": history}
+    if provider == "gemini":
+        return {
+            "systemInstruction": {"parts": [{"text": system_prompt}]},
+            "tools": [{"functionDeclarations": tools}],
+            "contents": [{"role": "model" if item["role"] == "assistant" else "user", "parts": [{"text": item["content"]}]} for item in history],
+        }
+    return {"messages": [{"role": "system", "content": system_prompt}] + history, "tools": [{"type": "function", "function": tool} for tool in tools]}
+
+def run_conversation(provider, days):
+    layout = RequestLayout(date_stamp="2024-01-01")
+    system_prompt = "You are a helpful assistant. Today is 2024-01-01. Reply in English."
+    stub = StubProvider(provider)
+    history = []
+    for turn, today in enumerate(days):
+        message = "question %d" % turn
+        # 插件开关的顺序每轮可能不同
+        tools = [{"name": "get_time", "parameters": {}}, {"name": "get_search_results", "parameters": {}}][::1 if turn % 2 else -1]
+        body = layout.apply(provider, wire_body(provider, system_prompt, tools, history + [{"role": "user", "content": message}]), today=today)
+        answer = stub.send(body)
+        history += [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+    return body
+
+def test_prefix_is_stable_within_a_day():
+    for provider in ("openai", "claude", "gemini"):
+        run_conversation(provider, [date(2024, 1, 2)] * 5)
+
+def test_date_changes_only_at_day_boundary():
+    layout = RequestLayout(date_stamp="2024-01-01")
+    prompt = "Today is 2024-01-01."
+    first = layout.system_prompt(prompt, date(2024, 1, 2))
+    assert first is layout.system_prompt(prompt, date(2024, 1, 2))
+    assert layout.system_prompt(prompt, date(2024, 1, 3)) == "Today is 2024-01-03."
+
+def test_claude_breakpoints():
+    body = run_conversation("claude", [date(2024, 1, 2)] * 3)
+    assert body["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert body["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" in body["messages"][-2]["content"][-1]
+    assert isinstance(body["messages"][-1]["content"], str)
+
+def test_pool_rewrites_chat_requests():
+    seen = []
+    def handler(request):
+        seen.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={})
+
+    async def send():
+        layout = RequestLayout()
+        transport = RewriteTransport(httpx.MockTransport(handler), layout.rewrite)
+        async with httpx.AsyncClient(transport=transport) as client:
+            history = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}, {"role": "user", "content": "c"}]
+            await client.post("https://api.anthropic.com/v1/messages", json={"system": "sys", "messages": history})
+            await client.post("https://example.com/v1/embeddings", json={"input": "a"})
+
+    asyncio.run(send())
+    assert seen[0][1]["system"] == [{"type": "text", "text": "sys", "cache_control": {"type": "ephemeral"}}]
+    assert "cache_control" in seen[0][1]["messages"][1]["content"][0]
+    assert seen[1] == ("/v1/embeddings", {"input": "a"})
+
+def test_resume_template_split():
+    instructions, user = RequestLayout.split_template("Analyze the resume.\n\nFormat: X/10\n\nResume text: {resume_text}")
+    assert instructions == "Analyze the resume.\n\nFormat: X/10"
+    assert user.format(resume_text="abc") == "Resume text: abc"
+
+if __name__ == "__main__":
+    test_prefix_is_stable_within_a_day()
+    test_date_changes_only_at_day_boundary()
+    test_claude_breakpoints()
+    test_pool_rewrites_chat_requests()
+    test_resume_template_split()
+    print("ok")
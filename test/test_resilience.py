@@ -0,0 +1,168 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import deadline
+from utils.resilience import CircuitBreaker, CircuitOpenError, Resilience, RetryBudget, is_retryable
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimitError(Exception):
+    pass
+
+class BadRequestError(Exception):
+    pass
+
+class FlakyProvider:
+    """Fails the first `failures` calls with `error`, then answers."""
+    def __init__(self, failures, error=RateLimitError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def ask(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("upstream")
+        return "answer"
+
+    async def stream(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("upstream")
+        for item in ("a", "b"):
+            yield item
+
+def resilience(**kwargs):
+    return Resilience(base_delay=0, max_delay=0, **kwargs)
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_classification():
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(RateLimitError("429"))
+    assert not is_retryable(BadRequestError("400"))
+    assert not is_retryable(CircuitOpenError("openai", 5))
+
+def test_transient_failures_are_retried():
+    provider = FlakyProvider(2)
+    assert run(resilience().call("openai", provider.ask)) == "answer"
+    assert provider.calls == 3
+
+def test_bad_requests_are_not_retried():
+    provider = FlakyProvider(1, BadRequestError)
+    layer = resilience()
+    try:
+        run(layer.call("openai", provider.ask))
+    except BadRequestError:
+        pass
+    assert provider.calls == 1 and layer.breaker("openai").state == CircuitBreaker.CLOSED
+
+def test_stream_retries_before_first_item():
+    provider = FlakyProvider(1)
+    rolled_back = []
+
+    async def collect():
+        return [item async for item in resilience().stream("openai", provider.stream, on_retry=lambda: rolled_back.append(1))]
+
+    assert run(collect()) == ["a", "b"] and rolled_back == [1]
+
+def test_budget_caps_retries_to_fraction_of_traffic():
+    clock = Clock()
+    budget = RetryBudget(ratio=0.1, min_retries=2, window=10, clock=clock)
+    for _ in range(20):
+        budget.record_request()
+    assert sum(budget.try_spend() for _ in range(10)) == 4
+    clock.now = 11
+    budget.record_request()
+    assert budget.try_spend()
+
+def test_breaker_opens_then_half_opens():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    clock.now = 31
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 62
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_open_circuit_fails_fast():
+    provider = FlakyProvider(100)
+    layer = resilience(max_attempts=1, failure_threshold=2)
+    for _ in range(2):
+        try:
+            run(layer.call("groq", provider.ask))
+        except RateLimitError:
+            pass
+    try:
+        run(layer.call("groq", provider.ask))
+    except CircuitOpenError as e:
+        assert e.name == "groq"
+    else:
+        raise AssertionError("expected CircuitOpenError")
+    assert provider.calls == 2 and layer.stats()["open"] == ["groq"]
+
+def test_deadline_miss_is_not_retried_or_blamed_on_the_provider():
+    calls = []
+
+    async def slow():
+        calls.append(True)
+        return await asyncio.wait_for(asyncio.sleep(10), 5)
+
+    async def scenario(layer):
+        # 时限包在重试外面，与 resume 分析和追问的用法相同
+        with deadline.scope(0.05):
+            try:
+                await deadline.run("upstream", layer.call("openai", slow))
+            except deadline.DeadlineExceeded as e:
+                return e.stage
+
+    layer = resilience()
+    before = deadline.timeouts["upstream"]
+    assert run(scenario(layer)) == "upstream"
+    assert deadline.timeouts["upstream"] == before + 1
+    assert len(calls) == 1
+    assert layer.breaker("openai").failures == 0
+
+def test_deadline_exceeded_inside_a_call_is_final():
+    calls = []
+
+    async def expired():
+        calls.append(True)
+        raise deadline.DeadlineExceeded("upstream")
+
+    layer = resilience()
+    try:
+        run(layer.call("openai", expired))
+    except deadline.DeadlineExceeded:
+        pass
+    assert len(calls) == 1
+    assert layer.breaker("openai").failures == 0
+    assert not is_retryable(deadline.DeadlineExceeded("upstream"))
+    assert layer.transient(deadline.DeadlineExceeded("upstream"))
+
+if __name__ == "__main__":
+    test_classification()
+    test_transient_failures_are_retried()
+    test_bad_requests_are_not_retried()
+    test_stream_retries_before_first_item()
+    test_budget_caps_retries_to_fraction_of_traffic()
+    test_breaker_opens_then_half_opens()
+    test_open_circuit_fails_fast()
+    test_deadline_miss_is_not_retried_or_blamed_on_the_provider()
+    test_deadline_exceeded_inside_a_call_is_final()
+    print("ok")
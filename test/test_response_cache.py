@@ -0,0 +1,82 @@
+import os
+import sys
+import asyncio
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.response_cache import ResponseCache, replay
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_key_ignores_whitespace_but_not_prompt():
+    key = ResponseCache.key
+    assert key("m", "sys", "Hello  world \r\nsecond ") == key("m", "sys", " Hello world\nsecond")
+    assert key("m", "sys", "hello") != key("m", "other", "hello")
+    assert key("m", "sys", "hello") != key("n", "sys", "hello")
+    # 不同端点或账户的译文互不共享
+    assert key("m", "sys", "hello", "https://a/v1", "sk-a") != key("m", "sys", "hello", "https://b/v1", "sk-a")
+    assert key("m", "sys", "hello", "https://a/v1", "sk-a") != key("m", "sys", "hello", "https://a/v1", "sk-b")
+
+def test_memory_and_disk_tiers():
+    with tempfile.TemporaryDirectory() as directory:
+        async def run():
+            cache = ResponseCache(directory, memory_entries=1)
+            await cache.put("a" * 64, "first")
+            await cache.put("b" * 64, "second")
+            assert list(cache.memory) == ["b" * 64]
+            assert await cache.get("a" * 64) == "first"
+            assert cache.hits == {"memory": 0, "disk": 1}
+            # 重启后从磁盘读取
+            assert await ResponseCache(directory).get("b" * 64) == "second"
+            assert await cache.get("c" * 64) is None
+        asyncio.run(run())
+
+def test_entries_expire():
+    clock = Clock()
+    with tempfile.TemporaryDirectory() as directory:
+        async def run():
+            cache = ResponseCache(directory, ttl=60, clock=clock)
+            await cache.put("a" * 64, "value")
+            clock.now += 61
+            assert await cache.get("a" * 64) is None
+            assert not os.path.exists(cache.path("a" * 64))
+        asyncio.run(run())
+
+def test_disk_tier_is_trimmed():
+    with tempfile.TemporaryDirectory() as directory:
+        async def run():
+            cache = ResponseCache(directory, max_bytes=1000)
+            for index in range(10):
+                await cache.put(f"{index:064d}", "x" * 200)
+            assert sum(cache.sizes.values()) <= 1000
+            assert os.path.exists(cache.path(f"{9:064d}"))
+        asyncio.run(run())
+
+def test_concurrent_puts_keep_the_index_consistent():
+    with tempfile.TemporaryDirectory() as directory:
+        async def run():
+            cache = ResponseCache(directory, max_bytes=5000)
+            await asyncio.gather(*(cache.put(f"{index:064d}", "x" * 200) for index in range(300)))
+            files = {os.path.join(root, name) for root, _, names in os.walk(directory) for name in names if name.endswith(".json")}
+            assert set(cache.sizes) == files
+            assert sum(cache.sizes.values()) <= 5000
+        asyncio.run(run())
+
+def test_replay_reassembles():
+    async def run():
+        return [chunk async for chunk in replay("abcdefg", size=3)]
+    assert asyncio.run(run()) == ["abc", "def", "g"]
+
+if __name__ == "__main__":
+    test_key_ignores_whitespace_but_not_prompt()
+    test_memory_and_disk_tiers()
+    test_entries_expire()
+    test_disk_tier_is_trimmed()
+    test_concurrent_puts_keep_the_index_consistent()
+    test_replay_reassembles()
+    print("ok")
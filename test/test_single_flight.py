@@ -0,0 +1,111 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.single_flight import SingleFlight
+
+class Upstream:
+    def __init__(self, chunks=("a", "b", "c"), fail=False):
+        self.chunks = chunks
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    async def ask(self):
+        self.calls += 1
+        await asyncio.sleep(0.02)
+        if self.fail:
+            raise ConnectionError("down")
+        return "answer"
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(0.01)
+                yield chunk
+            if self.fail:
+                raise ConnectionError("down")
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+async def collect(stream, delay=0):
+    await asyncio.sleep(delay)
+    return [chunk async for chunk in stream]
+
+def test_key_depends_on_every_input():
+    key = SingleFlight.key("gpt-4o", "system", [{"role": "user", "content": "hi"}])
+    assert key == SingleFlight.key("gpt-4o", "system", [{"role": "user", "content": "hi"}])
+    assert key != SingleFlight.key("gpt-4o", "other", [{"role": "user", "content": "hi"}])
+    assert key != SingleFlight.key("gpt-4o-mini", "system", [{"role": "user", "content": "hi"}])
+    assert key != SingleFlight.key("gpt-4o", "system", [{"role": "user", "content": "hi"}], "inline")
+
+def test_concurrent_calls_share_one_request():
+    upstream, flights = Upstream(), SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(*(flights.call("k", upstream.ask) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["answer"] * 5
+    assert upstream.calls == 1 and flights.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+
+def test_sequential_calls_are_not_cached():
+    upstream, flights = Upstream(), SingleFlight()
+
+    async def scenario():
+        await flights.call("k", upstream.ask)
+        await flights.call("k", upstream.ask)
+
+    asyncio.run(scenario())
+    assert upstream.calls == 2
+
+def test_failures_reach_every_caller():
+    upstream, flights = Upstream(fail=True), SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(*(flights.call("k", upstream.ask) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(scenario()))
+    assert upstream.calls == 1
+
+def test_late_subscriber_gets_every_chunk():
+    upstream, flights = Upstream(), SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(collect(flights.stream("k", upstream.stream)), collect(flights.stream("k", upstream.stream), delay=0.015))
+
+    assert asyncio.run(scenario()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert upstream.calls == 1
+
+def test_stream_error_reaches_subscribers():
+    upstream, flights = Upstream(fail=True), SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(collect(flights.stream("k", upstream.stream)), collect(flights.stream("k", upstream.stream)), return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(scenario()))
+
+def test_abandoned_stream_is_cancelled():
+    upstream, flights = Upstream(chunks=("a",) * 50), SingleFlight()
+
+    async def scenario():
+        stream = flights.stream("k", upstream.stream)
+        async for chunk in stream:
+            break
+        await stream.aclose()
+        await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert upstream.cancelled == 1 and not flights.flights
+
+if __name__ == "__main__":
+    test_key_depends_on_every_input()
+    test_concurrent_calls_share_one_request()
+    test_sequential_calls_are_not_cached()
+    test_failures_reach_every_caller()
+    test_late_subscriber_gets_every_chunk()
+    test_stream_error_reaches_subscribers()
+    test_abandoned_stream_is_cancelled()
+    print("ok")
@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.usage import UsageLedger
+
+def test_soft_limit_warns_once_and_hard_limit_blocks():
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = UsageLedger(os.path.join(directory, "usage.json"), soft_limit=10, hard_limit=20)
+        ledger.record(1, "gpt-4o", 6, 6, 0.5)
+        assert ledger.check_quota("1") == "soft"
+        assert ledger.should_warn(1)
+        assert not ledger.should_warn("1")
+        ledger.record("1", "gpt-4o", 5, 5, 0.5)
+        assert ledger.check_quota(1) == "hard"
+
+def test_flush_drops_old_warnings_and_days():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "usage.json")
+        ledger = UsageLedger(filename, soft_limit=1, retention_days=30)
+        ledger.days["2000-01-01"] = {"1": {"gpt-4o": dict.fromkeys(UsageLedger.FIELDS, 1)}}
+        ledger.warned.add(("2000-01-01", "1"))
+        ledger.record("1", "gpt-4o", 1, 1, 0.1)
+        assert ledger.should_warn("1")
+        assert ledger.flush()
+        assert len(ledger.warned) == 1
+        with open(filename) as f:
+            assert "2000-01-01" not in json.load(f)
+        assert not ledger.should_warn("1")
+
+if __name__ == "__main__":
+    test_soft_limit_warns_once_and_hard_limit_blocks()
+    test_flush_drops_old_warnings_and_days()
+    print("ok")
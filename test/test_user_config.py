@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import tempfile
+import importlib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+def load_config(monkeypatch, directory, **env):
+    """A fresh import of config with its stores in directory; environment and sys.modules are restored after the test."""
+    for name, value in {"CONFIG_DIR": directory, "CHAT_MODE": "multiusers", "API": "sk-env", "CONFIG_CACHE_SIZE": "2", **env}.items():
+        monkeypatch.setenv(name, value)
+    # setitem 记下原来的 config（或没有），测试结束后移除这次导入的模块并恢复原状
+    monkeypatch.setitem(sys.modules, "config", None)
+    monkeypatch.delitem(sys.modules, "config")
+    try:
+        return importlib.import_module("config")
+    except ImportError as e:
+        pytest.skip(f"config needs the bot's dependencies: {e}")
+
+def stored(directory, user_id):
+    with open(os.path.join(directory, f"{user_id}.json")) as f:
+        return json.load(f)
+
+def test_custom_key_survives_eviction(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        config = load_config(monkeypatch, directory)
+        Users = config.Users
+        Users.set_many("u1", {"api_key": "sk-own", "api_url": "https://example.com/v1/chat/completions"})
+        config.config_writer.flush()
+        for user_id in ("u2", "u3"):
+            Users.get_config(user_id, "engine")
+        assert "u1" not in Users.users
+        assert Users.get_config("u1", "api_key") == "sk-own"
+        assert Users.get_config("u1", "api_url") == "https://example.com/v1/chat/completions"
+        config.config_writer.flush()
+        assert stored(directory, "u1")["api_key"] == "sk-own"
+
+def test_legacy_copies_of_env_values_are_migrated_once(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "u1.json"), "w") as f:
+            json.dump({"api_key": "sk-old-env", "engine": "gpt-4o-mini"}, f)
+        config = load_config(monkeypatch, directory)
+        Users = config.Users
+        assert Users.get_config("u1", "api_key") == "sk-env"
+        assert Users.get_config("u1", "engine") == "gpt-4o-mini"
+        Users.set_config("u1", "api_key", "sk-own")
+        config.config_writer.flush()
+        Users.users.discard("u1")
+        assert Users.get_config("u1", "api_key") == "sk-own"
+
+def test_reload_after_sync_keeps_custom_key(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        config = load_config(monkeypatch, directory, CONFIG_BACKEND="shared")
+        other = config.SharedDirConfigStore(directory)
+        config.Users.set_config("u1", "api_key", "sk-own")
+        config.config_writer.flush()
+        # 另一个 worker 修改了同一用户的其他配置项
+        other.save_many({"u1": {"engine": "gpt-4o-mini"}})
+        for user_id in config.config_store.poll_changes():
+            config.Users.invalidate(user_id)
+        assert config.Users.get_config("u1", "api_key") == "sk-own"
+        assert config.Users.get_config("u1", "engine") == "gpt-4o-mini"
+        assert config.config_writer.flush() == 0, "a reload wrote to the shared store"
+        assert other.load("u1")["api_key"] == "sk-own"
+
+if __name__ == "__main__":
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_custom_key_survives_eviction(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_legacy_copies_of_env_values_are_migrated_once(monkeypatch)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_reload_after_sync_keeps_custom_key(monkeypatch)
+    print("ok")
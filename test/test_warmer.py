@@ -0,0 +1,119 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from utils import client_pool
+from utils.client_pool import ClientPool
+from utils.warmer import ConnectionWarmer
+
+URL = "https://api.example.com/v1/chat/completions"
+
+def mock_pool(requests, observed):
+    pool = ClientPool(on_response=lambda key, response: observed.append(response.request.method))
+    transport = httpx.MockTransport(lambda request: requests.append((request.method, str(request.url))) or httpx.Response(404))
+    original = pool.entry
+
+    def entry(api_url, api_key):
+        entry = original(api_url, api_key)
+        entry.client._transport = transport
+        return entry
+
+    pool.entry = entry
+    return pool
+
+def test_warm_all_pings_origin_and_pins():
+    requests, observed = [], []
+
+    async def scenario():
+        pool = mock_pool(requests, observed)
+        warmer = ConnectionWarmer(pool, interval=45)
+        assert pool.is_cold(URL, "sk-a")
+        assert await warmer.warm_all([(URL, "sk-a")], pin=True) == 1
+        pool.client(URL, "sk-a")
+        assert not pool.is_cold(URL, "sk-a")
+        assert (URL, "sk-a") in pool.pinned
+        # 刚 ping 过的端点不会再 ping
+        assert await warmer.keep_warm() == 0
+        await pool.aclose()
+
+    asyncio.run(scenario())
+    assert requests == [("HEAD", "https://api.example.com/")]
+    assert observed == []
+
+def test_keep_warm_pings_idle_endpoints_only():
+    requests, observed = [], []
+
+    async def scenario():
+        pool = mock_pool(requests, observed)
+        warmer = ConnectionWarmer(pool, interval=45)
+        await warmer.warm_all([(URL, "sk-a"), (URL, "sk-b")])
+        pool.clients[(URL, "sk-a")].last_active -= 50
+        assert await warmer.keep_warm() == 1
+        await pool.aclose()
+
+    asyncio.run(scenario())
+    assert len(requests) == 3
+
+def test_warm_soon_runs_in_background_once():
+    requests, observed = [], []
+
+    async def scenario():
+        pool = mock_pool(requests, observed)
+        warmer = ConnectionWarmer(pool, interval=45)
+        warmer.warm_soon([(URL, "sk-a")])
+        warmer.warm_soon([(URL, "sk-a")])
+        await asyncio.gather(*warmer.tasks)
+        warmer.warm_soon([(URL, "sk-a")])
+        assert not warmer.tasks
+        await pool.aclose()
+
+    asyncio.run(scenario())
+    assert len(requests) == 1
+
+def socks_pool(proxy, available):
+    saved = os.environ.pop("all_proxy", None), os.environ.get("ALL_PROXY"), client_pool.SOCKS
+    os.environ["ALL_PROXY"] = proxy
+    client_pool.SOCKS = available
+    try:
+        return ClientPool()
+    finally:
+        if saved[0] is not None:
+            os.environ["all_proxy"] = saved[0]
+        if saved[1] is None:
+            del os.environ["ALL_PROXY"]
+        else:
+            os.environ["ALL_PROXY"] = saved[1]
+        client_pool.SOCKS = saved[2]
+
+def test_socks_proxy_goes_through_socks_transport():
+    pool = socks_pool("socks5h://127.0.0.1:1080", available=True)
+    assert pool.enabled
+    try:
+        from httpx_socks import AsyncProxyTransport
+    except ImportError:
+        return
+    transport = pool.transport()
+    assert isinstance(transport, AsyncProxyTransport)
+
+def test_socks_proxy_without_httpx_socks_disables_pooling():
+    class Robot:
+        async def ask_stream_async(self):
+            pass
+
+    pool = socks_pool("socks5h://127.0.0.1:1080", available=False)
+    robot = Robot()
+    assert not pool.enabled
+    assert pool.robot(robot, URL, "sk-a") is robot
+    asyncio.run(pool.ping(URL, "sk-a"))
+    assert pool.clients == {}
+
+if __name__ == "__main__":
+    test_warm_all_pings_origin_and_pins()
+    test_keep_warm_pings_idle_endpoints_only()
+    test_warm_soon_runs_in_background_once()
+    test_socks_proxy_goes_through_socks_transport()
+    test_socks_proxy_without_httpx_socks_disables_pooling()
+    print("ok")
@@ -0,0 +1,99 @@
+import re
+from collections import defaultdict, deque
+
+FAST, STRONG = "fast", "strong"
+
+CODE = re.compile(r"```|^\s*(def|class|import|from|function|const|let|var|public|#include|SELECT|CREATE)\b|=>|\w+\([^)]*\)\s*[{:;]|Traceback|Exception|\berror\b.*\bline \d+", re.I | re.M)
+MATH = re.compile(r"\$[^$]+\$|\\(frac|int|sum|sqrt|lim)|[∑∫√≤≥≠∞]|\d\s*[\^*/=<>]\s*\d|\b(prove|derive|integral|equation|theorem|matrix|probability)\b|证明|方程|积分|概率|уравнени|интеграл|доказ", re.I)
+REASONING = re.compile(
+    r"\b(why|how does|explain|analy[sz]e|compare|step by step|design|plan|refactor|debug|optimi[sz]e|summari[sz]e|essay|article|report|review)\b"
+    r"|为什么|解释|分析|比较|设计|总结|优化|审查"
+    r"|почему|объясни|проанализ|сравни|спроектируй|оптимиз|напиши",
+    re.I,
+)
+CJK = re.compile(r"[぀-ヿ㐀-鿿가-힯]")
+LATIN = re.compile(r"[A-Za-z]")
+
+def classify(message, attachments=False, short_limit=60):
+    """(FAST or STRONG, reason) for one prompt, from cheap surface features only.
+
+    Anything with attachments, code, maths or analysis verbs goes to the
+    strong model, as does anything longer than short_limit words (a CJK
+    character counts as a word). Prompts mostly in scripts other than Latin
+    and CJK get half the length budget, since small models are weakest there.
+    """
+    if attachments or not isinstance(message, str):
+        return STRONG, "attachment"
+    text = message.strip()
+    if CODE.search(text):
+        return STRONG, "code"
+    if MATH.search(text):
+        return STRONG, "math"
+    if REASONING.search(text):
+        return STRONG, "reasoning"
+    cjk = len(CJK.findall(text))
+    words = len(CJK.sub(" ", text).split()) + cjk
+    letters = sum(1 for char in text if char.isalpha())
+    if letters and (len(LATIN.findall(text)) + cjk) / letters < 0.5:
+        short_limit //= 2
+    if words > short_limit:
+        return STRONG, "length"
+    return FAST, "short"
+
+class RouteStats:
+    __slots__ = ("requests", "failures", "empty", "latencies", "reasons")
+
+    def __init__(self, window):
+        self.requests = 0
+        self.failures = 0
+        self.empty = 0
+        self.latencies = deque(maxlen=window)
+        self.reasons = defaultdict(int)
+
+class AutoRouter:
+    """The "auto" engine: sends each prompt to the fast or the strong model.
+
+    A user override of FAST or STRONG skips the classifier. record() keeps
+    per-route counters (requests, failures, empty answers, latency) so the
+    split can be checked against real traffic in /info.
+    """
+    def __init__(self, fast_model, strong_model, short_limit=60, window=200):
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.short_limit = short_limit
+        self.stats = {FAST: RouteStats(window), STRONG: RouteStats(window)}
+
+    @property
+    def enabled(self):
+        return bool(self.models[FAST] and self.models[STRONG])
+
+    def choose(self, message, attachments=False, override=None):
+        """(route, model) for one prompt."""
+        if override in self.models:
+            route, reason = override, "override"
+        else:
+            route, reason = classify(message, attachments, self.short_limit)
+        self.stats[route].reasons[reason] += 1
+        return route, self.models[route]
+
+    def record(self, route, latency, failed=False, empty=False):
+        stats = self.stats.get(route)
+        if stats is None:
+            return
+        stats.requests += 1
+        stats.failures += failed
+        stats.empty += empty
+        if not failed:
+            stats.latencies.append(latency)
+
+    def total(self):
+        return sum(stats.requests for stats in self.stats.values())
+
+    def summary(self):
+        parts = []
+        for route, stats in self.stats.items():
+            if not stats.requests:
+                continue
+            ordered = sorted(stats.latencies)
+            p50 = f"{ordered[len(ordered) // 2]:.1f}s" if ordered else "-"
+            parts.append(f"{route} {self.models[route]}: {stats.requests} req, p50 {p50}, {stats.failures + stats.empty} bad")
+        return "; ".join(parts)
@@ -0,0 +1,79 @@
+import asyncio
+
+from utils.single_flight import Flight
+
+def blocks(text):
+    """Paragraphs of text, split at blank lines outside ``` fences, each as a list of lines."""
+    result, current, fenced = [], [], False
+    for line in text.split("\n"):
+        if line.strip().startswith("```"):
+            fenced = not fenced
+        if not line.strip() and not fenced:
+            if current:
+                result.append(current)
+                current = []
+            continue
+        current.append(line)
+    if current:
+        result.append(current)
+    return result
+
+def pack(pieces, limit, separator):
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > limit:
+            chunks.append(current)
+            current = ""
+        current = current + separator + piece if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def split_paragraphs(text, limit):
+    """text cut at paragraph boundaries into chunks of at most limit characters where possible.
+
+    Consecutive paragraphs are packed together; a paragraph longer than limit
+    is cut between lines, except inside a code block. A single line longer
+    than limit is kept whole. Text within limit comes back as one chunk.
+    """
+    text = text.strip()
+    if not limit or len(text) <= limit:
+        return [text] if text else []
+    pieces = []
+    for lines in blocks(text):
+        paragraph = "\n".join(lines)
+        if len(paragraph) <= limit or lines[0].strip().startswith("```"):
+            pieces.append(paragraph)
+        else:
+            pieces.extend(pack(lines, limit, "\n"))
+    return pack(pieces, limit, "\n\n")
+
+async def limited(semaphore, make_stream):
+    async with semaphore:
+        async for data in make_stream():
+            yield data
+
+async def ordered_stream(makers, semaphore, separator="\n\n"):
+    """Run the streams of makers (zero-argument async iterable factories) concurrently, yield them in order.
+
+    At most as many streams as the semaphore allows run at once. The first
+    stream is passed through as it arrives; each later one is buffered until
+    its predecessors finish, then flushed and followed live. An error in any
+    stream is raised when its turn comes, and closing the generator cancels
+    every stream still running.
+    """
+    flights = []
+    for make_stream in makers:
+        flight = Flight()
+        flight.task = asyncio.ensure_future(flight.pump(limited(semaphore, make_stream)))
+        flights.append(flight)
+    try:
+        for index, flight in enumerate(flights):
+            if index:
+                yield separator
+            async for data in flight.subscribe():
+                yield data
+    finally:
+        for flight in flights:
+            if not flight.task.done():
+                flight.task.cancel()
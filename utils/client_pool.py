@@ -0,0 +1,212 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import importlib.util
+
+import httpx
+
+# h2 随 httpx[http2] 安装，缺失时退回 HTTP/1.1
+HTTP2 = importlib.util.find_spec("h2") is not None
+# httpx 本身不支持 socks5h，socks 代理通过 httpx-socks 连接
+SOCKS = importlib.util.find_spec("httpx_socks") is not None
+
+class PooledClient:
+    __slots__ = ("client", "created", "last_used", "last_active", "requests", "cold")
+
+    def __init__(self, client):
+        self.client = client
+        self.created = time.monotonic()
+        # last_used 记录取用客户端的时间，last_active 记录最近一次收到响应（包括保活 ping）的时间
+        self.last_used = self.created
+        self.last_active = 0.0
+        self.requests = 0
+        self.cold = True
+
+class RewriteTransport(httpx.AsyncBaseTransport):
+    """Passes JSON POST bodies through rewrite(url, body) before sending; a None result sends the body unchanged."""
+    def __init__(self, transport, rewrite):
+        self.transport = transport
+        self.rewrite = rewrite
+
+    async def handle_async_request(self, request):
+        if request.method == "POST" and "json" in request.headers.get("content-type", ""):
+            try:
+                body = self.rewrite(str(request.url), json.loads(await request.aread()))
+            except Exception as e:
+                print("error: request rewrite failed:", e)
+                body = None
+            if body is not None:
+                content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                headers = request.headers.copy()
+                headers["Content-Length"] = str(len(content))
+                request = httpx.Request(request.method, request.url, headers=headers, content=content, extensions=request.extensions)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class ClientPool:
+    """One keep-alive httpx.AsyncClient per (api_url, api_key), shared by every user of that endpoint.
+
+    robot() returns a shallow copy of a global robot bound to the pooled client:
+    the copy shares the robot's conversation dicts, so conversation state stays
+    in one place and only the transport differs per endpoint and key.
+    """
+    def __init__(self, max_connections=20, max_keepalive=10, keepalive_expiry=60, idle_timeout=300, timeout=600, on_response=None, on_request=None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.keepalive_expiry = keepalive_expiry
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # on_response(api_key, response) 在每个响应头到达时调用，用于读取限流信息
+        self.on_response = on_response
+        # on_request(url, body) 在发送前改写 JSON 请求体，返回 None 表示不改
+        self.on_request = on_request
+        self.proxy = os.environ.get("all_proxy") or os.environ.get("ALL_PROXY") or None
+        # 没有 httpx-socks 时不能经 socks 代理连接，关闭连接池，机器人使用自己的客户端
+        self.enabled = SOCKS or not self.is_socks(self.proxy)
+        if not self.enabled:
+            print(f"error: {self.proxy.split('://')[0]} proxy needs httpx-socks, connection pooling is disabled")
+        self.clients = {}
+        self.robots = {}
+        self.classes = {}
+        # 固定保温的端点不会因空闲被关闭
+        self.pinned = set()
+        self.created = 0
+        self.evicted = 0
+
+    @staticmethod
+    def label(api_url, api_key):
+        # 指标和日志中不出现明文 key
+        digest = hashlib.sha256((api_key or "").encode()).hexdigest()[:8]
+        return f"{httpx.URL(api_url).host if api_url else '-'}#{digest}"
+
+    def entry(self, api_url, api_key):
+        key = (api_url, api_key)
+        entry = self.clients.get(key)
+        if entry is None or entry.client.is_closed:
+            entry = PooledClient(httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.timeout,
+                transport=self.transport(),
+                event_hooks={"response": [self.response_hook(api_url, api_key)]},
+            ))
+            self.clients[key] = entry
+            self.created += 1
+        return entry
+
+    @staticmethod
+    def is_socks(proxy):
+        return bool(proxy) and proxy.lower().startswith("socks")
+
+    def transport(self):
+        if self.is_socks(self.proxy):
+            from httpx_socks import AsyncProxyTransport
+            # socks5h 表示由代理解析域名，python-socks 用 rdns 表示
+            transport = AsyncProxyTransport.from_url(
+                self.proxy.replace("socks5h://", "socks5://", 1),
+                rdns=True if self.proxy.lower().startswith("socks5h") else None,
+                http2=HTTP2,
+                limits=self.limits,
+            )
+        else:
+            transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=self.limits, proxy=self.proxy)
+        return RewriteTransport(transport, self.on_request) if self.on_request else transport
+
+    def client(self, api_url, api_key):
+        entry = self.entry(api_url, api_key)
+        now = time.monotonic()
+        # 超过 keepalive_expiry 没有收到任何响应时，连接已被关闭，这次请求要重新握手
+        entry.cold = now - entry.last_active > self.keepalive_expiry
+        entry.last_used = now
+        entry.requests += 1
+        return entry.client
+
+    def is_cold(self, api_url, api_key):
+        entry = self.clients.get((api_url, api_key))
+        return entry is None or entry.cold
+
+    def idle_for(self, api_url, api_key):
+        entry = self.clients.get((api_url, api_key))
+        return time.monotonic() - entry.last_active if entry else float("inf")
+
+    async def ping(self, api_url, api_key, timeout=10):
+        """Open (or keep open) a connection to the endpoint's host with a HEAD request to its origin."""
+        if not self.enabled:
+            return
+        entry = self.entry(api_url, api_key)
+        url = httpx.URL(api_url)
+        await entry.client.head(f"{url.scheme}://{url.netloc.decode()}/", timeout=timeout, extensions={"warmup": True})
+
+    def response_hook(self, api_url, api_key):
+        async def hook(response):
+            # 收到响应说明连接可用，keepalive 计时从这里开始
+            entry = self.clients.get((api_url, api_key))
+            if entry is not None:
+                entry.last_active = time.monotonic()
+            # 保活 ping 的响应与 key 的额度无关
+            if not self.on_response or response.request.extensions.get("warmup"):
+                return
+            try:
+                self.on_response(api_key, response)
+            except Exception as e:
+                print("error: response hook failed:", e)
+        return hook
+
+    def pooled_class(self, cls):
+        # 子类只把 aclient 换成连接池里的客户端，类名保持不变
+        if cls not in self.classes:
+            self.classes[cls] = type(cls.__name__, (cls,), {"aclient": property(lambda robot: robot.pooled_client)})
+        return self.classes[cls]
+
+    def robot(self, base, api_url, api_key):
+        if base is None or not api_url or not self.enabled or not hasattr(type(base), "ask_stream_async"):
+            return base
+        client = self.client(api_url, api_key)
+        key = (id(base), api_url, api_key)
+        robot = self.robots.get(key)
+        if robot is None or robot.base is not base:
+            robot = copy.copy(base)
+            robot.__class__ = self.pooled_class(type(base))
+            robot.base = base
+            self.robots[key] = robot
+        robot.pooled_client = client
+        return robot
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        idle = [key for key, entry in self.clients.items() if now - entry.last_used > self.idle_timeout and key not in self.pinned]
+        for key in idle:
+            entry = self.clients.pop(key)
+            self.robots = {robot_key: robot for robot_key, robot in self.robots.items() if robot_key[1:] != key}
+            self.evicted += 1
+            try:
+                await entry.client.aclose()
+            except Exception as e:
+                print("error: failed to close client:", e)
+        return len(idle)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "clients": len(self.clients),
+            "created": self.created,
+            "evicted": self.evicted,
+            "http2": HTTP2,
+            "enabled": self.enabled,
+            "pools": {
+                self.label(*key): {"requests": entry.requests, "idle": round(now - entry.last_used, 1)}
+                for key, entry in self.clients.items()
+            },
+        }
+
+    async def aclose(self):
+        for entry in self.clients.values():
+            await entry.client.aclose()
+        self.clients.clear()
+        self.robots.clear()
@@ -0,0 +1,393 @@
+import os
+import json
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+
+# 标记需要删除的配置项，例如迁移时被重命名的旧键
+DELETE = object()
+
+def atomic_write_json(filename, data):
+    """Write to a temporary file and rename it over the target, so readers never see a partial file."""
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_filename, filename)
+
+@contextmanager
+def file_lock(filename, blocking=True):
+    """Exclusive lock on filename, shared by every process on the same volume.
+
+    Blocks until the lock is free; with blocking=False an OSError is raised instead.
+    """
+    if os.name == 'nt':  # Windows系统
+        import msvcrt
+        with open(filename, 'a+') as f:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            try:
+                yield f
+            finally:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                except OSError:
+                    pass  # 如果解锁失败，关闭文件时也会释放
+    else:  # Unix-like系统
+        import fcntl
+        with open(filename, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def worker_id():
+    # 每个存储实例一个编号，用来忽略自己写入产生的通知
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class JSONConfigStore:
+    """One JSON file per user or topic in a directory.
+
+    Every store has poll_changes(), which returns the user ids changed by other
+    workers since the last call, or None when the whole cache should be dropped.
+    Single-process stores never see such changes.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def poll_changes(self):
+        return set()
+
+    def user_ids(self):
+        if not os.path.exists(self.directory):
+            return []
+        return [filename[:-5] for filename in os.listdir(self.directory) if filename.endswith('.json')]
+
+    def filename(self, user_id):
+        return os.path.join(self.directory, f'{user_id}.json')
+
+    def load(self, user_id):
+        filename = self.filename(user_id)
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'r') as f:
+            content = f.read()
+        return json.loads(content) if content.strip() else {}
+
+    def save_many(self, changes):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        for user_id, values in changes.items():
+            config = self.load(user_id)
+            for key, value in values.items():
+                if value is DELETE:
+                    config.pop(key, None)
+                else:
+                    config[key] = value
+            atomic_write_json(self.filename(user_id), config)
+
+class SQLiteConfigStore:
+    """All user configs in one SQLite database in WAL mode, one row per (user_id, key).
+
+    Users are read on demand through the primary key index, so startup does not
+    depend on how many users exist.
+    """
+    def __init__(self, filename):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_config ("
+                "user_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (user_id, key)) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def user_ids(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT user_id FROM user_config")]
+
+    def poll_changes(self):
+        return set()
+
+    def load(self, user_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT key, value FROM user_config WHERE user_id = ?", (str(user_id),)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_many(self, changes):
+        upserts = []
+        deletes = []
+        for user_id, values in changes.items():
+            for key, value in values.items():
+                if value is DELETE:
+                    deletes.append((str(user_id), key))
+                else:
+                    upserts.append((str(user_id), key, json.dumps(value, ensure_ascii=False)))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO user_config (user_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value",
+                upserts,
+            )
+            self.conn.executemany("DELETE FROM user_config WHERE user_id = ? AND key = ?", deletes)
+
+    def import_json_dir(self, directory):
+        """One-shot import of an existing CONFIG_DIR; later calls are no-ops."""
+        with self.lock:
+            done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone()
+        if done:
+            return 0
+        source = JSONConfigStore(directory)
+        changes = {}
+        for user_id in source.user_ids():
+            try:
+                changes[user_id] = source.load(user_id)
+            except (OSError, ValueError) as e:
+                print("error: failed to import config", user_id, e)
+        self.save_many(changes)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)", (directory,))
+        return len(changes)
+
+class SharedDirConfigStore(JSONConfigStore):
+    """JSON files on a volume shared by several bot workers.
+
+    Writes take a blocking exclusive lock, re-read the file and merge only the
+    changed keys, so concurrent workers do not overwrite each other's settings.
+    Each write appends the user id to a change journal; poll_changes() reads
+    the journal entries written by other workers since the last poll. If the
+    journal was rotated more than once between two polls, poll_changes()
+    returns None and the whole cache has to be dropped.
+    """
+    JOURNAL = "_changes.log"
+    LOCK = "_changes.lock"
+
+    def __init__(self, directory, journal_limit=1024 * 1024):
+        super().__init__(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.journal_limit = journal_limit
+        self.worker = worker_id()
+        self.journal_path = os.path.join(directory, self.JOURNAL)
+        self.lock_path = os.path.join(directory, self.LOCK)
+        with file_lock(self.lock_path):
+            if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+                self.start_journal(0)
+            # 只关心启动之后的变化，之前的写入在首次访问时会从文件读取
+            self.journal = open(self.journal_path, 'r')
+            self.generation = json.loads(self.journal.readline())["generation"]
+            self.journal.seek(0, os.SEEK_END)
+        self.buffer = ""
+
+    def start_journal(self, generation):
+        # 每个日志文件以代号开头，读取方据此发现自己错过了整个文件
+        with open(self.journal_path + ".new", 'w') as f:
+            f.write(json.dumps({"generation": generation}) + "\n")
+        os.replace(self.journal_path + ".new", self.journal_path)
+
+    def user_ids(self):
+        return [user_id for user_id in super().user_ids() if not user_id.startswith("_")]
+
+    def save_many(self, changes):
+        lines = [json.dumps({"worker": self.worker, "user_id": str(user_id)}) + "\n" for user_id in changes]
+        with file_lock(self.lock_path):
+            super().save_many(changes)
+            # 日志过大时轮换，其他进程读完旧文件句柄后再切换到新文件
+            if os.path.getsize(self.journal_path) > self.journal_limit:
+                with open(self.journal_path, 'r') as f:
+                    generation = json.loads(f.readline())["generation"]
+                self.start_journal(generation + 1)
+            with open(self.journal_path, 'a') as f:
+                f.write("".join(lines))
+
+    def poll_changes(self):
+        changed = set()
+        missed = False
+        while True:
+            missed = self.read_journal(changed) or missed
+            try:
+                rotated = os.stat(self.journal_path).st_ino != os.fstat(self.journal.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = False
+            if not rotated:
+                return None if missed else changed
+            self.journal.close()
+            self.journal = open(self.journal_path, 'r')
+            self.buffer = ""
+
+    def read_journal(self, changed):
+        missed = False
+        self.buffer += self.journal.read()
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "generation" in entry:
+                missed = missed or entry["generation"] != self.generation + 1
+                self.generation = entry["generation"]
+            elif entry.get("worker") != self.worker:
+                changed.add(entry["user_id"])
+        return missed
+
+class MemoryKV:
+    """In-process stand-in for a network key-value store with pub/sub (hashes plus channels).
+
+    One MemoryKV plays the server; every KVConfigStore connected to it plays a worker.
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def hset(self, name, mapping):
+        with self.lock:
+            self.hashes.setdefault(name, {}).update(mapping)
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            values = self.hashes.get(name, {})
+            for key in keys:
+                values.pop(key, None)
+
+    def keys(self, prefix):
+        with self.lock:
+            return [name for name in self.hashes if name.startswith(prefix)]
+
+    def publish(self, channel, message):
+        with self.lock:
+            callbacks = list(self.channels.get(channel, []))
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.channels.setdefault(channel, []).append(callback)
+
+class KVConfigStore:
+    """User configs in a key-value store: one hash per user, change notices on a pub/sub channel.
+
+    client needs hgetall, hset, hdel, keys, publish and subscribe, as MemoryKV provides.
+    Notices arrive on the client's thread and are only queued here; poll_changes()
+    hands them to the cache owner.
+    """
+    def __init__(self, client, prefix="user_config:", channel="user_config_changes"):
+        self.client = client
+        self.prefix = prefix
+        self.channel = channel
+        self.worker = worker_id()
+        self.changed = set()
+        self.lock = threading.Lock()
+        client.subscribe(channel, self.on_message)
+
+    def user_ids(self):
+        return [name[len(self.prefix):] for name in self.client.keys(self.prefix)]
+
+    def load(self, user_id):
+        return {key: json.loads(value) for key, value in self.client.hgetall(self.prefix + str(user_id)).items()}
+
+    def save_many(self, changes):
+        for user_id, values in changes.items():
+            name = self.prefix + str(user_id)
+            upserts = {key: json.dumps(value, ensure_ascii=False) for key, value in values.items() if value is not DELETE}
+            deletes = [key for key, value in values.items() if value is DELETE]
+            if upserts:
+                self.client.hset(name, upserts)
+            if deletes:
+                self.client.hdel(name, *deletes)
+            self.client.publish(self.channel, json.dumps({"worker": self.worker, "user_id": str(user_id)}))
+
+    def on_message(self, message):
+        entry = json.loads(message)
+        if entry.get("worker") != self.worker:
+            with self.lock:
+                self.changed.add(entry["user_id"])
+
+    def poll_changes(self):
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+class WriteBehindBuffer:
+    """Collects config changes in memory and writes them to the store in batches.
+
+    mark_many() only records the changes. flush() runs from a worker thread, either on
+    a timer, when too many users are pending, or on shutdown.
+    """
+    def __init__(self, store, max_pending=100):
+        self.store = store
+        self.max_pending = max_pending
+        self.pending = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flushing = False
+
+    def mark_many(self, user_id, values):
+        with self.lock:
+            self.pending.setdefault(str(user_id), {}).update(values)
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有事件循环（例如启动阶段），交给定时任务或退出时写入
+            return
+        if self.flushing:
+            return
+        self.flushing = True
+        loop.run_in_executor(None, self.flush)
+
+    def flush(self):
+        with self.flush_lock:
+            try:
+                with self.lock:
+                    batch, self.pending = self.pending, {}
+                    self.inflight = batch
+                if not batch:
+                    return 0
+                try:
+                    self.store.save_many(batch)
+                except Exception as e:
+                    # 写入失败时放回队列，保留期间产生的更新值
+                    print("error: failed to save user configs:", e)
+                    with self.lock:
+                        for user_id, values in batch.items():
+                            values.update(self.pending.get(user_id, {}))
+                            self.pending[user_id] = values
+                    return 0
+                return len(batch)
+            finally:
+                with self.lock:
+                    self.inflight = {}
+                self.flushing = False
+
+    def pending_for(self, user_id):
+        """Changes not yet in the store, so a reload after cache eviction does not see stale values."""
+        user_id = str(user_id)
+        with self.lock:
+            values = dict(self.inflight.get(user_id, {}))
+            values.update(self.pending.get(user_id, {}))
+        return values
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,110 @@
+import time
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    def __init__(self, stage):
+        super().__init__(f"deadline exceeded during {stage}")
+        self.stage = stage
+
+class Deadline:
+    """The time left to handle one update. Each stage gets what remains, capped per operation.
+
+    telegram is the default cap for Bot API calls made under this deadline.
+    """
+    def __init__(self, budget, clock=time.monotonic, telegram=None):
+        self.clock = clock
+        self.expires = clock() + budget
+        self.telegram = telegram
+
+    def remaining(self):
+        return max(0.0, self.expires - self.clock())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None, floor=0.0):
+        remaining = self.remaining()
+        if cap:
+            remaining = min(remaining, cap)
+        return max(remaining, floor)
+
+current = ContextVar("deadline", default=None)
+timeouts = Counter()
+
+@contextmanager
+def scope(budget, clock=time.monotonic, telegram=None):
+    """Run the block under a new deadline of budget seconds."""
+    token = current.set(Deadline(budget, clock, telegram))
+    try:
+        yield current.get()
+    finally:
+        current.reset(token)
+
+def timeout(cap=None, floor=0.0):
+    """Seconds for the next operation: what the current deadline leaves, or cap outside any deadline."""
+    deadline = current.get()
+    if deadline is None:
+        return max(cap, floor) if cap else None
+    return deadline.timeout(cap, floor)
+
+def telegram(cap=None, floor=5.0):
+    """read/write/connect/pool timeouts for one Bot API call.
+
+    cap defaults to the current deadline's Bot API cap; without either, the
+    bot's own defaults apply and nothing is returned. floor keeps a few
+    seconds for calls made after the deadline has passed, such as editing
+    the answer to show the timeout error.
+    """
+    deadline = current.get()
+    cap = cap or (deadline.telegram if deadline else None)
+    if not cap:
+        return {}
+    seconds = timeout(cap, min(floor, cap))
+    return dict(read_timeout=seconds, write_timeout=seconds, connect_timeout=seconds, pool_timeout=seconds)
+
+def exceeded(stage):
+    timeouts[stage] += 1
+    print(f"error: deadline exceeded during {stage} ({timeouts[stage]} so far)")
+    return DeadlineExceeded(stage)
+
+async def run(stage, awaitable, cap=None):
+    """await awaitable within the current deadline (and cap), cancelling it when time runs out.
+
+    Only running out of the deadline raises DeadlineExceeded and is counted;
+    hitting the stage's own cap first raises a plain asyncio.TimeoutError.
+    """
+    deadline = current.get()
+    capped = deadline is None or bool(cap) and cap < deadline.remaining()
+    try:
+        return await asyncio.wait_for(awaitable, timeout(cap))
+    except asyncio.TimeoutError as e:
+        if isinstance(e, DeadlineExceeded):
+            raise
+        if capped:
+            raise asyncio.TimeoutError(f"{stage} timed out after {cap}s") from None
+        raise exceeded(stage) from None
+
+async def stream(stage, source):
+    """Iterate source within the current deadline; the source is closed when time runs out."""
+    iterator = source.__aiter__()
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError as e:
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                raise exceeded(stage) from None
+            yield item
+    finally:
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+def stats():
+    return dict(timeouts)
@@ -0,0 +1,52 @@
+import asyncio
+
+class CallbackCoalescer:
+    """Collapses rapid callback taps on one message into batches.
+
+    The first tap is handled at once. Taps that arrive while it is handled, or
+    within `window` seconds after, are collected and handled together as one
+    batch, so a burst of taps costs at most one state change and one edit per
+    window instead of one per tap.
+    """
+    def __init__(self, window=0.5):
+        self.window = window
+        self.pending = {}
+
+    async def run(self, key, data, handler):
+        if key in self.pending:
+            self.pending[key].append(data)
+            return False
+        self.pending[key] = []
+        try:
+            await handler([data])
+            while True:
+                await asyncio.sleep(self.window)
+                batch = self.pending[key]
+                if not batch:
+                    return True
+                self.pending[key] = []
+                await handler(batch)
+        finally:
+            del self.pending[key]
+
+def collapse_callbacks(batch, toggle_suffixes=(), select_suffixes=()):
+    """Reduce a batch of callback data to its net effect.
+
+    Toggles that were tapped an even number of times cancel out, and for each
+    selection suffix only the last choice is kept. Returns the surviving
+    changes in tap order and the last tap, which decides the menu to show.
+    """
+    toggles = {}
+    selections = {}
+    for index, data in enumerate(batch):
+        toggle = next((suffix for suffix in toggle_suffixes if data.endswith(suffix)), None)
+        if toggle:
+            first, count = toggles.get(data, (index, 0))
+            toggles[data] = (first, count + 1)
+            continue
+        select = next((suffix for suffix in select_suffixes if data.endswith(suffix)), None)
+        if select:
+            selections[select] = (index, data)
+    changes = [(first, data) for data, (first, count) in toggles.items() if count % 2]
+    changes += list(selections.values())
+    return [data for _, data in sorted(changes)], batch[-1]
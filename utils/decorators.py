@@ -7,6 +7,7 @@ from md2tgmd.src.md2tgmd import escape
 
 from utils.i18n import strings
 from utils.scripts import GetMesageInfo
+from utils import deadline
 
 def ban_message(update, convo_id):
     message = (
@@ -93,6 +94,13 @@ def APICheck(func):
         return await func(*args, **kwargs)
     return wrapper
 
+# 为整个更新设置时间预算，之后的每个阶段只能使用剩余时间
+def Deadline(func):
+    async def wrapper(*args, **kwargs):
+        with deadline.scope(config.UPDATE_DEADLINE, telegram=config.TELEGRAM_TIMEOUT):
+            return await func(*args, **kwargs)
+    return wrapper
+
 def PrintMessage(func):
     async def wrapper(*args, **kwargs):
         update, context = args[:2]
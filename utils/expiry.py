@@ -0,0 +1,51 @@
+import time
+import heapq
+import asyncio
+
+class ConversationExpiry:
+    """One heap of (deadline, convo_id) for all chats, swept by a single periodic job.
+
+    Refreshing a conversation only pushes a new entry; stale entries are skipped
+    when they reach the top of the heap (lazy invalidation).
+    """
+    def __init__(self, ttl, batch_size=200):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.heap = []
+        self.deadlines = {}
+
+    def touch(self, convo_id, chat_id=None):
+        deadline = time.monotonic() + self.ttl
+        self.deadlines[convo_id] = (deadline, chat_id)
+        heapq.heappush(self.heap, (deadline, convo_id))
+        # 失效条目太多时重建堆，防止内存随消息数增长
+        if len(self.heap) > 4 * len(self.deadlines) + 64:
+            self.heap = [(deadline, convo_id) for convo_id, (deadline, _) in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, convo_id):
+        return self.deadlines.pop(convo_id, None) is not None
+
+    def pop_expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.heap and self.heap[0][0] <= now and len(expired) < self.batch_size:
+            deadline, convo_id = heapq.heappop(self.heap)
+            current = self.deadlines.get(convo_id)
+            if current is None or current[0] != deadline:
+                continue
+            del self.deadlines[convo_id]
+            expired.append((convo_id, current[1]))
+        return expired
+
+    async def sweep(self, callback):
+        while True:
+            expired = self.pop_expired()
+            for convo_id, chat_id in expired:
+                callback(convo_id, chat_id)
+            if len(expired) < self.batch_size:
+                return
+            await asyncio.sleep(0)
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -0,0 +1,120 @@
+import time
+import asyncio
+from collections import defaultdict, deque
+
+class TTFTTracker:
+    """Recent time-to-first-token samples per model, used to pick the hedge delay.
+
+    Samples are kept apart for requests that had to open a new connection
+    (cold) and ones that reused a pooled one (warm). The delay is a
+    percentile of the recent warm samples, clamped to [floor, ceiling];
+    until a model has min_samples of them the default is used.
+    """
+    def __init__(self, window=50, percentile=0.9, min_samples=5, default=8.0, floor=1.0, ceiling=30.0):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default = default
+        self.floor = floor
+        self.ceiling = ceiling
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.cold_samples = defaultdict(lambda: deque(maxlen=window))
+        self.version = 0
+
+    def record(self, model, ttft, cold=False):
+        (self.cold_samples if cold else self.samples)[model].append(ttft)
+        self.version += 1
+
+    def threshold(self, model):
+        samples = self.samples.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return self.default
+        ordered = sorted(samples)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return min(max(value, self.floor), self.ceiling)
+
+    def summary(self, model):
+        result = {}
+        for name, samples in (("warm", self.samples.get(model)), ("cold", self.cold_samples.get(model))):
+            if samples:
+                ordered = sorted(samples)
+                result[name] = {"count": len(ordered), "p50": ordered[len(ordered) // 2]}
+        if not result:
+            return None
+        result["hedge_after"] = self.threshold(model)
+        return result
+
+async def cancel_stream(task, stream):
+    if task is not None and not task.done():
+        task.cancel()
+    if task is not None:
+        try:
+            await task
+        except BaseException:
+            pass
+    try:
+        await stream.aclose()
+    except Exception:
+        pass
+
+class HedgedStream:
+    """Streams from `primary`; if its first item is later than `delay` seconds, also starts `backup`.
+
+    primary and backup are zero-argument callables returning async iterators.
+    Whichever yields its first item first is streamed to the end and the other
+    is cancelled. A primary that fails before its first item starts the backup
+    at once. After iteration, `winner` is "primary" or "backup" and `ttft` is
+    the winner's time to first item, measured from the start.
+    """
+    def __init__(self, primary, backup=None, delay=8.0):
+        self.primary = primary
+        self.backup = backup
+        self.delay = delay
+        self.winner = None
+        self.ttft = None
+        self.hedged = False
+
+    async def __aiter__(self):
+        start = time.monotonic()
+        streams = {"primary": self.primary()}
+        tasks = {"primary": asyncio.ensure_future(streams["primary"].__anext__())}
+        try:
+            if self.backup is not None:
+                done, _ = await asyncio.wait([tasks["primary"]], timeout=self.delay)
+                if not done or not succeeded(tasks["primary"]):
+                    self.hedged = True
+                    streams["backup"] = self.backup()
+                    tasks["backup"] = asyncio.ensure_future(streams["backup"].__anext__())
+            self.winner = await first_success(tasks)
+        finally:
+            for name in list(tasks):
+                if name != self.winner:
+                    await cancel_stream(tasks[name], streams[name])
+        stream = streams[self.winner]
+        try:
+            try:
+                first = tasks[self.winner].result()
+            except StopAsyncIteration:
+                return
+            self.ttft = time.monotonic() - start
+            yield first
+            async for item in stream:
+                yield item
+        finally:
+            await cancel_stream(None, stream)
+
+def succeeded(task):
+    # 空的流（StopAsyncIteration）也算正常结束
+    exception = task.exception()
+    return exception is None or isinstance(exception, StopAsyncIteration)
+
+async def first_success(tasks):
+    """Name of the first task that produced an item, preferring primary; raises if all failed."""
+    while True:
+        for name, task in tasks.items():
+            if task.done() and succeeded(task):
+                return name
+        pending = [task for task in tasks.values() if not task.done()]
+        if not pending:
+            # 全部失败时抛出主请求的异常
+            await tasks["primary"]
+        await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
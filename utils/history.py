@@ -0,0 +1,98 @@
+import re
+from collections import defaultdict
+
+IMAGE_PART_TYPES = ("image_url", "image")
+DOCUMENT_PATTERN = re.compile(r"<document>(.*?)</document>", re.S)
+STUB_PATTERN = re.compile(r'<document id="(doc\d+)" omitted="\d+">.*?</document>', re.S)
+DOC_ID_PATTERN = re.compile(r"\bdoc\d+\b")
+# 用户明确提到文档时，把最近一次被折叠的文档重新放回上下文；"file" 之类的词在普通对话里太常见，不算
+REINCLUDE_PATTERN = re.compile(r"\b(documents?|pdf|документ\w*|құжат\w*)\b|文档|文檔", re.I)
+
+def is_image_part(part):
+    if not isinstance(part, dict):
+        return False
+    return part.get("type") in IMAGE_PART_TYPES or "inlineData" in part or "inline_data" in part
+
+class HistorySlimmer:
+    """Shrinks images and large documents that were already answered, so they are not resent on every turn."""
+    def __init__(self, image_turns=1, doc_turns=1, doc_chars=2000, preview_chars=300):
+        self.image_turns = image_turns
+        self.doc_turns = doc_turns
+        self.doc_chars = doc_chars
+        self.preview_chars = preview_chars
+        self.documents = defaultdict(dict)
+        self.counter = 0
+
+    def prepare(self, robot, convo_id, message=None):
+        conversation = getattr(robot, "conversation", None)
+        if not conversation or convo_id not in conversation:
+            return
+        history = conversation[convo_id]
+        self.slim(history, convo_id)
+        if isinstance(message, str):
+            self.reinclude(history, convo_id, message)
+
+    def slim(self, history, convo_id):
+        answered = 0
+        for index in range(len(history) - 1, -1, -1):
+            item = history[index]
+            if not isinstance(item, dict):
+                continue
+            if item.get("role") == "assistant":
+                answered += 1
+                continue
+            if item.get("role") != "user":
+                continue
+            content = item.get("content")
+            if answered >= self.image_turns and (isinstance(content, list) or is_image_part(content)):
+                item["content"] = self.strip_images(content)
+                content = item["content"]
+            if answered >= self.doc_turns and isinstance(content, str) and "<document>" in content:
+                item["content"] = DOCUMENT_PATTERN.sub(lambda match: self.stub_document(convo_id, match), content)
+
+    def strip_images(self, content):
+        parts = content if isinstance(content, list) else [content]
+        if not any(is_image_part(part) for part in parts):
+            return content
+        texts = []
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif isinstance(part, str):
+                texts.append(part)
+        caption = " ".join(text.strip() for text in texts if text.strip())
+        images = sum(is_image_part(part) for part in parts)
+        placeholder = f"[{images} image(s) shared earlier and already answered: {caption[:100]}]" if caption else f"[{images} image(s) shared earlier and already answered]"
+        return "\n".join(texts + [placeholder]) if texts else placeholder
+
+    def stub_document(self, convo_id, match):
+        body = match.group(1)
+        if len(body) <= self.doc_chars:
+            return match.group(0)
+        self.counter += 1
+        doc_id = f"doc{self.counter}"
+        self.documents[convo_id][doc_id] = match.group(0)
+        preview = body[:self.preview_chars].strip()
+        return f'<document id="{doc_id}" omitted="{len(body)}">{preview}…</document>'
+
+    def reinclude(self, history, convo_id, message):
+        stored = self.documents.get(convo_id)
+        if not stored:
+            return
+        mentioned = set(DOC_ID_PATTERN.findall(message.lower()))
+        wanted = [doc_id for doc_id in stored if doc_id in mentioned]
+        if not wanted and REINCLUDE_PATTERN.search(message):
+            wanted = [list(stored.keys())[-1]]
+        if not wanted:
+            return
+        for item in history:
+            content = item.get("content") if isinstance(item, dict) else None
+            if not isinstance(content, str) or "omitted=" not in content:
+                continue
+            item["content"] = STUB_PATTERN.sub(
+                lambda match: stored.pop(match.group(1)) if match.group(1) in wanted and match.group(1) in stored else match.group(0),
+                content,
+            )
+
+    def forget(self, convo_id):
+        self.documents.pop(str(convo_id), None)
@@ -274,12 +274,30 @@ strings = {
         "zh-hk": "模型 `{model_name}` 不可用。請使用 /info 菜單中列出的模型之一。",
         "ru": "Модель `{model_name}` недоступна. Пожалуйста, используйте одну из моделей из списка в меню /info.",
     },
+    "model_suggestions": {
+        "zh": "你是不是想要: {models}",
+        "en": "Did you mean: {models}",
+        "zh-hk": "你是不是想要: {models}",
+        "ru": "Возможно, вы имели в виду: {models}",
+    },
     "model_changed": {
         "zh": "模型已成功更改为: `{model_name}`",
         "en": "The model has been successfully changed to: `{model_name}`",
         "zh-hk": "模型已成功更改為: `{model_name}`",
         "ru": "Модель успешно изменена на: `{model_name}`",
     },
+    "message_quota_exceeded": {
+        "zh": "今日用量已达上限，请明天再试。",
+        "en": "You have reached today's usage limit. Please try again tomorrow.",
+        "zh-hk": "今日用量已達上限，請明天再試。",
+        "ru": "Вы достигли дневного лимита использования. Попробуйте завтра.",
+    },
+    "message_quota_warning": {
+        "zh": "提醒：今日用量即将达到上限。",
+        "en": "Note: you are close to today's usage limit.",
+        "zh-hk": "提醒：今日用量即將達到上限。",
+        "ru": "Внимание: вы приближаетесь к дневному лимиту использования.",
+    },
     "group_title": {
         "zh": "组",
         "en": "Group",
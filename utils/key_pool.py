@@ -0,0 +1,196 @@
+import re
+import math
+import time
+import hashlib
+import itertools
+from datetime import datetime, timezone
+
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def split_keys(value):
+    """API="sk-a,sk-b" -> ["sk-a", "sk-b"]; a single key gives a one-item list."""
+    return [key.strip() for key in (value or "").split(",") if key.strip()]
+
+def parse_reset(value, now, wall_clock=time.time):
+    """Monotonic time at which a rate-limit window resets.
+
+    Accepts OpenAI/Groq durations ("1s", "6m0s", "20ms"), plain seconds
+    (Retry-After) and Anthropic RFC 3339 timestamps.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    parts = DURATION.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return now + sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return now + max(0.0, moment.timestamp() - wall_clock())
+
+def header_int(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                pass
+    return None
+
+class KeyState:
+    __slots__ = ("key", "remaining", "reset_at", "tokens", "tokens_reset_at", "cooldown_until", "strikes", "picked", "requests", "failures")
+
+    def __init__(self, key):
+        self.key = key
+        self.remaining = None
+        self.reset_at = 0.0
+        self.tokens = None
+        self.tokens_reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.picked = 0
+        self.requests = 0
+        self.failures = 0
+
+    def available_at(self):
+        times = [self.cooldown_until]
+        if self.remaining is not None and self.remaining <= 0:
+            times.append(self.reset_at)
+        if self.tokens is not None and self.tokens <= 0:
+            times.append(self.tokens_reset_at)
+        return max(times)
+
+    def capacity(self, now):
+        """Requests this key is expected to have left; inf when the limits are unknown or have reset."""
+        if now < self.available_at():
+            return 0
+        if self.remaining is None or now >= self.reset_at:
+            return math.inf
+        return self.remaining
+
+class KeyPool:
+    """Several API keys for one provider, handed out by remaining capacity.
+
+    Capacity comes from the rate-limit headers of each key's responses
+    (observe()); a 429 puts the key in cooldown for Retry-After, the window
+    reset or an exponentially growing default, a 401/403 takes it out for
+    auth_cooldown. pick() returns the key with the most capacity, spreading
+    ties round-robin, and reserves one request on it until its next response.
+    """
+    def __init__(self, keys, cooldown=30.0, max_cooldown=600.0, auth_cooldown=600.0, clock=time.monotonic):
+        self.keys = {key: KeyState(key) for key in keys}
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.auth_cooldown = auth_cooldown
+        self.clock = clock
+        self.sequence = itertools.count(1)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def pick(self, exclude=None):
+        now = self.clock()
+        states = [state for state in self.keys.values() if state.key != exclude] or list(self.keys.values())
+        state = max(states, key=lambda state: (state.capacity(now), -state.picked))
+        if state.capacity(now) == 0:
+            # 全部在冷却时选最早恢复的 key，仍然交给上游判断
+            state = min(states, key=KeyState.available_at)
+        state.picked = next(self.sequence)
+        state.requests += 1
+        if state.remaining is not None and now < state.reset_at:
+            state.remaining -= 1
+        return state.key
+
+    def observe(self, key, status, headers):
+        state = self.keys.get(key)
+        if state is None:
+            return
+        now = self.clock()
+        remaining = header_int(headers, "x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+        if remaining is not None:
+            state.remaining = remaining
+            state.reset_at = parse_reset(headers.get("x-ratelimit-reset-requests") or headers.get("anthropic-ratelimit-requests-reset"), now) or now + 60
+        tokens = header_int(headers, "x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining")
+        if tokens is not None:
+            state.tokens = tokens
+            state.tokens_reset_at = parse_reset(headers.get("x-ratelimit-reset-tokens") or headers.get("anthropic-ratelimit-tokens-reset"), now) or now + 60
+        if status == 429:
+            state.failures += 1
+            state.strikes += 1
+            retry_after = parse_reset(headers.get("retry-after"), now)
+            default = min(self.max_cooldown, self.cooldown * 2 ** (state.strikes - 1))
+            state.cooldown_until = retry_after or (state.reset_at if state.remaining == 0 and state.reset_at > now else now + default)
+        elif status in (401, 403):
+            state.failures += 1
+            state.cooldown_until = now + self.auth_cooldown
+        elif status < 400:
+            state.strikes = 0
+
+    @staticmethod
+    def label(key):
+        return hashlib.sha256(key.encode()).hexdigest()[:8]
+
+    def stats(self):
+        now = self.clock()
+        return {
+            self.label(state.key): {
+                "requests": state.requests,
+                "failures": state.failures,
+                "remaining": state.remaining if now < state.reset_at else None,
+                "cooldown": round(max(0.0, state.cooldown_until - now), 1),
+            }
+            for state in self.keys.values()
+        }
+
+class KeyPools:
+    """KeyPool per comma-separated key setting, found by the setting or by any of its keys."""
+    def __init__(self, **options):
+        self.options = options
+        self.pools = {}
+        self.owners = {}
+        self.settings = {}
+
+    def pool(self, value):
+        if not value or "," not in value:
+            return None
+        pool = self.pools.get(value)
+        if pool is None:
+            pool = self.pools[value] = KeyPool(split_keys(value), **self.options)
+            for key in pool.keys:
+                self.owners.setdefault(key, pool)
+                self.settings.setdefault(key, value)
+        return pool
+
+    def pick(self, value):
+        """Best key for a key setting; a single key is returned unchanged."""
+        pool = self.pool(value)
+        return pool.pick() if pool else value
+
+    def setting(self, key):
+        """The key setting a picked key came from, so requests on any key of one pool count as the same account."""
+        return self.settings.get(key, key)
+
+    def rotate(self, key):
+        """Another key from the pool `key` came from, after a failed request with it."""
+        pool = self.owners.get(key)
+        return pool.pick(exclude=key) if pool and len(pool) > 1 else key
+
+    def observe(self, key, status, headers):
+        pool = self.owners.get(key)
+        if pool:
+            pool.observe(key, status, headers)
+
+    def stats(self):
+        return {KeyPool.label(value): pool.stats() for value, pool in self.pools.items()}
@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+class ModelCatalog:
+    """The list of models offered to users, fetched from the provider in the background.
+
+    The last fetched list is kept in a snapshot file, so startup never waits for
+    the provider: the snapshot (or `fallback` when there is none) is used until
+    refresh() succeeds. `transform` (custom model filters and additions) runs
+    once per refresh; readers only see the finished tuple in `models`.
+
+    `sources` is called on the event loop before each background refresh and
+    its result is passed to `fetch`, so the worker thread never touches state
+    owned by the loop.
+    """
+    def __init__(self, fetch=None, transform=None, snapshot_file=None, ttl=3600, fallback=(), sources=None):
+        self.fetch = fetch
+        self.sources = sources
+        self.transform = transform or list
+        self.snapshot_file = snapshot_file
+        self.ttl = ttl
+        self.fetched_at = 0
+        self.version = 0
+        self.lock = threading.Lock()
+        raw = self.load_snapshot()
+        self.set_models(list(fallback) if raw is None else raw)
+
+    def load_snapshot(self):
+        if not self.fetch or not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return None
+        try:
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print("error: failed to load model snapshot:", e)
+            return None
+        self.fetched_at = snapshot.get("fetched_at", 0)
+        return snapshot.get("models", [])
+
+    def save_snapshot(self, raw):
+        directory = os.path.dirname(self.snapshot_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = self.snapshot_file + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump({"fetched_at": self.fetched_at, "models": raw}, f, ensure_ascii=False)
+        os.replace(tmp_filename, self.snapshot_file)
+
+    def set_models(self, raw):
+        self.models = tuple(self.transform(raw))
+        self.version += 1
+
+    def is_stale(self):
+        return bool(self.fetch) and time.time() - self.fetched_at >= self.ttl
+
+    def refresh(self, *args):
+        """Blocking fetch; run it in a worker thread. Returns True when the list changed."""
+        with self.lock:
+            raw = sorted(set(self.fetch(*args)))
+            self.fetched_at = time.time()
+            if self.snapshot_file:
+                try:
+                    self.save_snapshot(raw)
+                except OSError as e:
+                    print("error: failed to save model snapshot:", e)
+            models = tuple(self.transform(raw))
+            if models == self.models:
+                return False
+            self.models = models
+            self.version += 1
+            return True
+
+    async def refresh_if_stale(self):
+        if not self.is_stale():
+            return False
+        try:
+            args = (self.sources(),) if self.sources else ()
+            return await asyncio.to_thread(self.refresh, *args)
+        except Exception as e:
+            # 供应商不可用时继续使用旧列表，下个周期再试
+            print("error: failed to refresh models:", e)
+            return False
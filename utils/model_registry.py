@@ -0,0 +1,62 @@
+import difflib
+from bisect import bisect_left
+from types import MappingProxyType
+
+class ModelRegistry:
+    """Read-only index over the model list and model groups.
+
+    Built once per model list refresh and never mutated, so lookups can share it
+    freely: membership is a set lookup, prefix search a bisect over the sorted
+    lower-case names, and fuzzy matching only runs for suggestions.
+    """
+    def __init__(self, models=(), groups=None, aliases=None):
+        self.models = tuple(dict.fromkeys(models))
+        self.groups = MappingProxyType({name: tuple(items) for name, items in (groups or {}).items()})
+        everything = dict.fromkeys(self.models)
+        for items in self.groups.values():
+            everything.update(dict.fromkeys(items))
+        self.all_models = tuple(everything)
+        self.index = frozenset(self.all_models)
+        self.folded = {model.lower(): model for model in self.all_models}
+        self.sorted_names = sorted(self.folded)
+        self.aliases = {alias.lower(): model for alias, model in (aliases or {}).items() if model in self.index}
+
+    def __contains__(self, model):
+        return model in self.index
+
+    def __len__(self):
+        return len(self.all_models)
+
+    def with_prefix(self, prefix, limit=None):
+        prefix = prefix.lower()
+        matches = []
+        i = bisect_left(self.sorted_names, prefix)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix):
+            matches.append(self.folded[self.sorted_names[i]])
+            if limit and len(matches) >= limit:
+                break
+            i += 1
+        return matches
+
+    def resolve(self, name):
+        """Exact name, case-insensitive name or alias; anything looser is only a suggestion."""
+        if name in self.index:
+            return name
+        key = name.strip().lower()
+        if key in self.folded:
+            return self.folded[key]
+        return self.aliases.get(key)
+
+    def suggest(self, name, n=3):
+        key = name.strip().lower()
+        matches = self.with_prefix(key, limit=n)
+        if matches:
+            return matches
+        return [self.folded[item] for item in difflib.get_close_matches(key, self.sorted_names, n=n, cutoff=0.5)]
+
+    @staticmethod
+    def page(models, page, page_size):
+        """Slice of models for one keyboard page; returns (items, page, pages) with page clamped."""
+        pages = max(1, -(-len(models) // page_size))
+        page = min(max(page, 0), pages - 1)
+        return models[page * page_size:(page + 1) * page_size], page, pages
@@ -0,0 +1,35 @@
+from collections import OrderedDict
+
+class RenderCache:
+    """Small LRU cache for rendered menus and info text.
+
+    Keys must contain everything the rendering depends on (language, menu,
+    settings version, ...), so entries never need explicit invalidation.
+    """
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        value = build()
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self.data)
+
+def freeze_keyboard(buttons):
+    return tuple(tuple(row) for row in buttons)
+
+def thaw_keyboard(buttons):
+    # 调用方可能会继续追加按钮，每次返回新的列表
+    return [list(row) for row in buttons]
@@ -0,0 +1,109 @@
+import copy
+import json
+from datetime import date
+
+import httpx
+
+# 支持显式缓存断点的供应商，其余供应商（OpenAI、Gemini）按前缀自动缓存，只需保证顺序稳定
+CACHE_CONTROL_PROVIDERS = ("claude",)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+class RequestLayout:
+    """Lays out outgoing requests with the stable parts first so providers can reuse a cached prefix.
+
+    Order: system prompt, tool definitions, older history, then the new message.
+    The date stamp in the system prompt only changes at the day boundary.
+    ClientPool calls rewrite() on every chat request body before it is sent.
+    """
+    def __init__(self, date_stamp=None):
+        self.date_stamp = date_stamp
+        self.prompts = {}
+
+    def system_prompt(self, prompt, today=None):
+        if not prompt or not self.date_stamp or self.date_stamp not in prompt:
+            return prompt
+        today = (today or date.today()).isoformat()
+        key = (prompt, today)
+        if key not in self.prompts:
+            # 只保留当天的版本，同一天内返回同一个字符串
+            self.prompts = {k: v for k, v in self.prompts.items() if k[1] == today}
+            self.prompts[key] = prompt.replace(self.date_stamp, today)
+        return self.prompts[key]
+
+    @staticmethod
+    def split_template(template, placeholder="{resume_text}"):
+        """Split a prompt template into a stable instruction part and the variable user part."""
+        head, sep, tail = template.partition(placeholder)
+        if not sep:
+            return template, placeholder + tail
+        instructions, _, label = head.rpartition("\n\n")
+        if not instructions.strip():
+            return head.rstrip(), placeholder + tail
+        return instructions.rstrip(), label + sep + tail
+
+    def apply(self, provider, body, today=None):
+        """The wire payload body laid out for prefix caching; body itself is not modified.
+
+        Tools are sorted by name and the system prompt gets today's date stamp.
+        For Claude, cache breakpoints go on the system prompt, the last tool and
+        the end of the history before the new message, unless the payload
+        already carries its own.
+        """
+        body = copy.deepcopy(body)
+        if provider in CACHE_CONTROL_PROVIDERS:
+            if isinstance(body.get("system"), str):
+                body["system"] = [{"type": "text", "text": self.system_prompt(body["system"], today)}]
+            if isinstance(body.get("tools"), list):
+                body["tools"].sort(key=tool_name)
+            if "cache_control" in json.dumps(body):
+                return body
+            if body.get("system"):
+                body["system"][-1]["cache_control"] = dict(CACHE_CONTROL)
+            if body.get("tools"):
+                body["tools"][-1]["cache_control"] = dict(CACHE_CONTROL)
+            # 断点放在上一轮为止的历史末尾，新消息不进入缓存前缀
+            messages = body.get("messages") or []
+            if len(messages) > 1:
+                mark_message(messages[-2])
+            return body
+        if provider == "gemini":
+            for part in (body.get("systemInstruction") or {}).get("parts", []):
+                if isinstance(part.get("text"), str):
+                    part["text"] = self.system_prompt(part["text"], today)
+            for tool in body.get("tools") or []:
+                if isinstance(tool.get("functionDeclarations"), list):
+                    tool["functionDeclarations"].sort(key=tool_name)
+            return body
+        messages = body.get("messages") or []
+        if messages and messages[0].get("role") == "system" and isinstance(messages[0].get("content"), str):
+            messages[0]["content"] = self.system_prompt(messages[0]["content"], today)
+        if isinstance(body.get("tools"), list):
+            body["tools"].sort(key=tool_name)
+        return body
+
+    def rewrite(self, url, body):
+        """apply() for a request to url, or None when url is not a chat endpoint."""
+        provider = provider_of(url)
+        if provider is None or not isinstance(body, dict):
+            return None
+        return self.apply(provider, body)
+
+def provider_of(url):
+    path = httpx.URL(url).path
+    if path.endswith("/messages"):
+        return "claude"
+    if ":generateContent" in path or ":streamGenerateContent" in path:
+        return "gemini"
+    if path.endswith("/chat/completions"):
+        return "openai"
+    return None
+
+def tool_name(tool):
+    return tool.get("name") or tool.get("function", {}).get("name", "")
+
+def mark_message(item):
+    content = item.get("content")
+    if isinstance(content, str):
+        item["content"] = [{"type": "text", "text": content, "cache_control": dict(CACHE_CONTROL)}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        content[-1]["cache_control"] = dict(CACHE_CONTROL)
@@ -0,0 +1,243 @@
+import time
+import random
+import asyncio
+from collections import Counter, deque
+
+import httpx
+
+from utils.deadline import DeadlineExceeded
+
+# 上游过载或短暂不可用时的状态码，其余 4xx 重试也不会成功
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504, 524, 529})
+# aient 把上游错误包装成自己的异常类，按类名判断以免依赖其版本
+RETRYABLE_ERRORS = frozenset({"APITimeoutError", "RateLimitError", "HTTPError", "EmptyResponseError", "RetryFailedError"})
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is temporarily unavailable, try again in {max(1, round(retry_after))}s")
+        self.name = name
+        self.retry_after = retry_after
+
+def status_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "status_code", None)
+
+def is_retryable(error):
+    """Whether a failed call may succeed if repeated: timeouts, dropped connections, 429 and 5xx."""
+    # 用户的处理时限用完不是上游的问题，重试也没有剩余时间
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    status = status_of(error)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Full jitter: uniform over [0, min(cap, base * 2 ** attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one upstream.
+
+    closed: calls pass. After failure_threshold retryable failures in a row it
+    opens and rejects calls for recovery_time seconds, then half-opens and lets
+    half_open_max probe calls through; a probe success closes it again and a
+    probe failure reopens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=5, recovery_time=30.0, half_open_max=1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_max = half_open_max
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.recovery_time - self.clock())
+
+    def allow(self):
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self.probes = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes >= self.half_open_max:
+                return False
+            self.probes += 1
+        return True
+
+    def release(self):
+        # 探测请求被取消时不计成败，让出名额
+        if self.state == self.HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probes = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+            self.probes = 0
+
+class RetryBudget:
+    """Process-wide cap on retries: at most `ratio` of the requests seen in the last `window` seconds.
+
+    `min_retries` per window are always allowed so a quiet bot can still retry
+    a single failed request.
+    """
+    def __init__(self, ratio=0.1, min_retries=3, window=10.0, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self.clock = clock
+        self.requests = deque()
+        self.retries = deque()
+
+    def trim(self, now):
+        for events in (self.requests, self.retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = self.clock()
+        self.trim(now)
+        self.requests.append(now)
+
+    def try_spend(self):
+        now = self.clock()
+        self.trim(now)
+        if len(self.retries) >= self.min_retries + self.ratio * len(self.requests):
+            return False
+        self.retries.append(now)
+        return True
+
+class Resilience:
+    """Retries, backoff and circuit breaking shared by every upstream call.
+
+    Calls are grouped by name (provider and host); each name has its own
+    breaker, all names share one retry budget. Only retryable errors are
+    retried or count against a breaker; any other error means the upstream
+    answered, so it passes straight through.
+    """
+    def __init__(self, budget=None, max_attempts=3, base_delay=0.5, max_delay=8.0, failure_threshold=5, recovery_time=30.0):
+        self.budget = budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.breakers = {}
+        self.counters = Counter()
+
+    def breaker(self, name):
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(self.failure_threshold, self.recovery_time)
+        return breaker
+
+    def admit(self, name):
+        breaker = self.breaker(name)
+        if not breaker.allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError(name, breaker.retry_after())
+        self.counters["attempts"] += 1
+        return breaker
+
+    def transient(self, error):
+        """Errors after which the request, not the conversation, was at fault."""
+        return isinstance(error, (CircuitOpenError, DeadlineExceeded)) or is_retryable(error)
+
+    async def backoff(self, name, attempt, error, max_attempts=None):
+        if attempt + 1 >= (max_attempts or self.max_attempts):
+            return False
+        if not self.budget.try_spend():
+            self.counters["budget_exhausted"] += 1
+            return False
+        self.counters["retries"] += 1
+        print(f"retry: {name} attempt {attempt + 2} after {type(error).__name__}: {error}")
+        await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+        return True
+
+    async def call(self, name, make_call, max_attempts=None):
+        """Await make_call() (a zero-argument coroutine factory), retrying transient failures."""
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            breaker = self.admit(name)
+            try:
+                result = await make_call()
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if not await self.backoff(name, attempt, e, max_attempts):
+                    raise
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    async def stream(self, name, make_stream, on_retry=None, max_attempts=None):
+        """Iterate make_stream() (a zero-argument async iterable factory).
+
+        A stream is retried only while it has not produced anything; once items
+        have been passed on, a failure is raised as is. on_retry runs before
+        each new attempt, e.g. to roll back state the failed attempt changed.
+        """
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            breaker = self.admit(name)
+            iterator = aiter(make_stream())
+            started = False
+            try:
+                async for item in iterator:
+                    if not started:
+                        started = True
+                        breaker.record_success()
+                    yield item
+                if not started:
+                    breaker.record_success()
+                return
+            except Exception as e:
+                if started:
+                    raise
+                if not is_retryable(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if not await self.backoff(name, attempt, e, max_attempts):
+                    raise
+                if on_retry:
+                    on_retry()
+                attempt += 1
+            except BaseException:
+                if not started:
+                    breaker.release()
+                raise
+            finally:
+                aclose = getattr(iterator, "aclose", None)
+                if aclose:
+                    await aclose()
+
+    def stats(self):
+        return {
+            **self.counters,
+            "open": sorted(name for name, breaker in self.breakers.items() if breaker.state != CircuitBreaker.CLOSED),
+        }
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from utils.config_store import atomic_write_json
+
+SPACES = re.compile(r"[ \t 　]+")
+
+def normalize(text):
+    """Same text up to Unicode form, trailing spaces, runs of spaces and line endings."""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n")
+    return "\n".join(SPACES.sub(" ", line).strip() for line in text.strip().split("\n"))
+
+class ResponseCache:
+    """Two-tier cache of complete answers: an in-memory LRU in front of a directory of JSON files.
+
+    Entries expire after ttl seconds in both tiers. The memory tier holds at
+    most memory_entries answers; the disk tier is trimmed to max_bytes by
+    dropping the least recently used files (a hit refreshes the file's mtime).
+    The async get/put do their file I/O in worker threads, so the size index
+    is guarded by a lock.
+    """
+    def __init__(self, directory, ttl=7 * 86400, memory_entries=512, max_bytes=64 * 1024 * 1024, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.memory = OrderedDict()
+        self.sizes = None
+        # trim 内会调用 index 和 remove，用可重入锁
+        self.lock = threading.RLock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    @staticmethod
+    def key(model, system_prompt, text, *extra):
+        payload = json.dumps([model, system_prompt or "", normalize(text), *extra], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def remember(self, key, created, value):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def read(self, key):
+        filename = self.path(key)
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.clock() - entry["created"] > self.ttl:
+            self.remove(filename)
+            return None
+        os.utime(filename)
+        return entry["created"], entry["value"]
+
+    def write(self, key, created, value):
+        filename = self.path(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        atomic_write_json(filename, {"created": created, "value": value})
+        size = os.path.getsize(filename)
+        with self.lock:
+            self.index()[filename] = size
+            self.trim()
+
+    def index(self):
+        # 首次写入时扫描一次目录，之后增量维护
+        with self.lock:
+            if self.sizes is None:
+                sizes = {}
+                for root, _, files in os.walk(self.directory):
+                    for name in files:
+                        if name.endswith(".json"):
+                            filename = os.path.join(root, name)
+                            try:
+                                sizes[filename] = os.path.getsize(filename)
+                            except OSError:
+                                pass
+                self.sizes = sizes
+            return self.sizes
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        with self.lock:
+            if self.sizes is not None:
+                self.sizes.pop(filename, None)
+
+    def trim(self):
+        def mtime(filename):
+            try:
+                return os.path.getmtime(filename)
+            except OSError:
+                return 0
+        with self.lock:
+            sizes = self.index()
+            total = sum(sizes.values())
+            if total <= self.max_bytes:
+                return
+            for filename in sorted(sizes, key=mtime):
+                if total <= self.max_bytes * 0.9:
+                    break
+                total -= sizes.pop(filename, 0)
+                self.remove(filename)
+
+    async def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None and self.clock() - entry[0] <= self.ttl:
+            self.memory.move_to_end(key)
+            self.hits["memory"] += 1
+            return entry[1]
+        self.memory.pop(key, None)
+        entry = await asyncio.to_thread(self.read, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.remember(key, *entry)
+        self.hits["disk"] += 1
+        return entry[1]
+
+    async def put(self, key, value):
+        created = self.clock()
+        self.remember(key, created, value)
+        try:
+            await asyncio.to_thread(self.write, key, created, value)
+        except Exception as e:
+            # 缓存写入失败不影响已经发出的回答
+            print("error: response cache write failed:", e)
+
+    def stats(self):
+        return {"memory": len(self.memory), "hits": dict(self.hits), "misses": self.misses}
+
+async def replay(text, size=200):
+    """A cached answer as a stream of chunks, so it renders like a live one."""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
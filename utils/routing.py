@@ -0,0 +1,69 @@
+from fnmatch import fnmatchcase
+from typing import NamedTuple, Optional, FrozenSet
+
+class Route(NamedTuple):
+    """Where requests for one model go.
+
+    robot names the global client in config (ChatGPTbot, groqBot, ...). When
+    per_user is set the API key and URL come from the user's settings at call
+    time; otherwise api_key and endpoint are fixed.
+    """
+    provider: str
+    robot: Optional[str]
+    api_key: Optional[str]
+    endpoint: Optional[str]
+    engine_type: str
+    capabilities: FrozenSet[str] = frozenset()
+    per_user: bool = False
+
+def parse_overrides(value):
+    """MODEL_ROUTES: comma-separated `pattern=provider` pairs, e.g. "my-llama=openai,gemini-*=vertex"."""
+    overrides = []
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        pattern, provider = item.split("=", 1)
+        if pattern.strip() and provider.strip():
+            overrides.append((pattern.strip(), provider.strip().lower()))
+    return overrides
+
+class RoutingTable:
+    """Model name to Route, compiled for the whole model list and memoised for any other name.
+
+    `resolve(model, provider=None)` holds the routing rules; it is called once per
+    model per compile, so after that a routing decision is one dict lookup.
+    Overrides pick a provider by exact name or glob pattern and win over the rules.
+    """
+    def __init__(self, resolve, overrides=(), maxsize=4096):
+        self.resolve = resolve
+        self.overrides = list(overrides)
+        self.maxsize = maxsize
+        self.routes = {}
+        self.version = 0
+
+    def compute(self, model):
+        for pattern, provider in self.overrides:
+            if model == pattern or fnmatchcase(model, pattern):
+                route = self.resolve(model, provider)
+                if route:
+                    return route
+        return self.resolve(model)
+
+    def compile(self, models):
+        self.routes = {model: self.compute(model) for model in models}
+        self.version += 1
+
+    def route(self, model):
+        route = self.routes.get(model)
+        if route is None:
+            route = self.compute(model)
+            # 不在模型列表里的名称也缓存，但限制数量
+            if len(self.routes) >= self.maxsize:
+                self.routes.clear()
+            self.routes[model] = route
+        return route
+
+    def describe(self, model):
+        route = self.route(model)
+        capabilities = ", ".join(sorted(route.capabilities)) or "-"
+        return f"{route.provider} ({route.engine_type}; {capabilities})"
@@ -16,10 +16,10 @@ def CutNICK(update_text, update_message):
             else:
                 return None
 
-time_out = 600
 async def get_file_url(file, context):
+    from utils import deadline
     file_id = file.file_id
-    new_file = await context.bot.get_file(file_id, read_timeout=time_out, write_timeout=time_out, connect_timeout=time_out, pool_timeout=time_out)
+    new_file = await context.bot.get_file(file_id, **deadline.telegram())
     file_url = new_file.file_path
     return file_url
 
@@ -29,8 +29,9 @@ async def get_voice(file_id: str, context) -> str:
     filename_mp3 = f'{file_unique_id}.mp3'
 
     try:
-        file = await context.bot.get_file(file_id)
-        file_bytes = await file.download_as_bytearray()
+        from utils import deadline
+        file = await context.bot.get_file(file_id, **deadline.telegram())
+        file_bytes = await deadline.run("download", file.download_as_bytearray())
 
         # 创建一个字节流对象
         audio_stream = BytesIO(file_bytes)
@@ -54,6 +55,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 async def GetMesage(update_message, context, voice=True):
     from aient.src.aient.utils.scripts import Document_extract
+    from utils import deadline
     image_url = None
     file_url = None
     reply_to_message_text = None
@@ -88,7 +90,7 @@ async def GetMesage(update_message, context, voice=True):
 
         if reply_to_message_file:
             reply_to_message_file_url = await get_file_url(reply_to_message_file, context)
-            reply_to_message_file_content = await Document_extract(reply_to_message_file_url, reply_to_message_file_url, None)
+            reply_to_message_file_content = await deadline.run("extract", Document_extract(reply_to_message_file_url, reply_to_message_file_url, None))
 
     if update_message.photo:
         photo = update_message.photo[-1]
@@ -0,0 +1,106 @@
+import json
+import asyncio
+import hashlib
+from collections import Counter
+
+def digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+class Flight:
+    """One in-flight stream and the chunks it has produced so far, replayed to every subscriber."""
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task = None
+        self.abandoned = False
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.notify()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                changed = self.changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            # 所有订阅者都离开后不再继续消耗上游
+            if not self.subscribers and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
+
+class SingleFlight:
+    """Runs identical concurrent history-free requests once and shares the result.
+
+    Requests are identified by key(): model, system prompt, messages and any
+    extra inputs that change the answer, hashed. While a call or stream for a
+    key is in flight, later callers subscribe to it instead of calling
+    upstream; a stream subscriber first gets the chunks produced so far. The
+    upstream call runs in its own task, so a caller that gives up does not
+    cancel it for the others.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.flights = {}
+        self.counters = Counter()
+
+    @staticmethod
+    def key(model, system_prompt, messages, *extra):
+        return (model, digest(system_prompt or ""), digest(messages), digest(extra))
+
+    def forget(self, table, key, value):
+        if table.get(key) is value:
+            del table[key]
+
+    async def call(self, key, make_call):
+        """Await make_call() (a zero-argument coroutine factory) once per key at a time."""
+        task = self.calls.get(key)
+        if task is None:
+            self.counters["calls"] += 1
+            task = asyncio.ensure_future(make_call())
+            self.calls[key] = task
+            task.add_done_callback(lambda task: (self.forget(self.calls, key, task), task.cancelled() or task.exception()))
+        else:
+            self.counters["shared"] += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key, make_stream):
+        """Iterate make_stream() (a zero-argument async iterable factory) once per key at a time."""
+        flight = self.flights.get(key)
+        if flight is None or flight.abandoned:
+            self.counters["streams"] += 1
+            flight = Flight()
+            self.flights[key] = flight
+            flight.task = asyncio.ensure_future(flight.pump(make_stream()))
+            flight.task.add_done_callback(lambda task: self.forget(self.flights, key, flight))
+        else:
+            self.counters["shared"] += 1
+        async for chunk in flight.subscribe():
+            yield chunk
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self.calls) + len(self.flights)}
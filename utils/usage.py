@@ -0,0 +1,119 @@
+import os
+import json
+import threading
+from datetime import date, timedelta
+
+def estimate_tokens(value):
+    """Cheap token estimate: about 4 characters per token, one token per CJK character."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        wide = sum(1 for char in value if ord(char) > 0x2E7F)
+        return wide + (len(value) - wide + 3) // 4
+    if isinstance(value, dict):
+        return estimate_tokens(value.get("text") or value.get("content"))
+    if isinstance(value, list):
+        return sum(estimate_tokens(item) for item in value)
+    return 0
+
+class QuotaExceeded(Exception):
+    """Raised instead of calling upstream for a user over the hard daily limit."""
+    def __init__(self, user_id):
+        super().__init__("daily token quota exceeded")
+        self.user_id = user_id
+
+class UsageLedger:
+    """Per user, per model, per day usage counters.
+
+    Counters live in memory and are written to disk in batches by flush(), so
+    recording a request and checking a quota never touch the disk.
+    """
+    FIELDS = ("prompt_tokens", "completion_tokens", "requests", "latency_ms")
+
+    def __init__(self, filename, soft_limit=0, hard_limit=0, retention_days=90):
+        self.filename = filename
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.retention_days = retention_days
+        self.days = {}
+        self.totals = {}
+        self.warned = set()
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self.days = json.load(f)
+        except (OSError, ValueError) as e:
+            print("error: failed to load usage ledger:", e)
+            return
+        for day, users in self.days.items():
+            for user_id, models in users.items():
+                self.totals[(day, user_id)] = sum(item["prompt_tokens"] + item["completion_tokens"] for item in models.values())
+
+    def record(self, user_id, model, prompt_tokens, completion_tokens, latency):
+        day = date.today().isoformat()
+        user_id = str(user_id)
+        with self.lock:
+            models = self.days.setdefault(day, {}).setdefault(user_id, {})
+            item = models.setdefault(model, dict.fromkeys(self.FIELDS, 0))
+            item["prompt_tokens"] += prompt_tokens
+            item["completion_tokens"] += completion_tokens
+            item["requests"] += 1
+            item["latency_ms"] += int(latency * 1000)
+            self.totals[(day, user_id)] = self.totals.get((day, user_id), 0) + prompt_tokens + completion_tokens
+            self.dirty = True
+
+    def tokens_today(self, user_id):
+        return self.totals.get((date.today().isoformat(), str(user_id)), 0)
+
+    def check_quota(self, user_id):
+        used = self.tokens_today(user_id)
+        if self.hard_limit and used >= self.hard_limit:
+            return "hard"
+        if self.soft_limit and used >= self.soft_limit:
+            return "soft"
+        return "ok"
+
+    def should_warn(self, user_id):
+        """True once per user and day after the soft limit is crossed."""
+        key = (date.today().isoformat(), str(user_id))
+        if key in self.warned or self.check_quota(user_id) != "soft":
+            return False
+        with self.lock:
+            self.warned.add(key)
+        return True
+
+    def summary(self, user_id, day=None):
+        day = day or date.today().isoformat()
+        return self.days.get(day, {}).get(str(user_id), {})
+
+    def flush(self):
+        with self.lock:
+            # 提醒只对当天有效，过去的日期不再需要记录
+            today = date.today().isoformat()
+            self.warned = {key for key in self.warned if key[0] == today}
+            if not self.dirty:
+                return False
+            cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+            for day in [day for day in self.days if day < cutoff]:
+                del self.days[day]
+                self.totals = {key: value for key, value in self.totals.items() if key[0] != day}
+            content = json.dumps(self.days, ensure_ascii=False)
+            self.dirty = False
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = self.filename + ".tmp"
+        try:
+            with open(tmp_filename, 'w') as f:
+                f.write(content)
+            os.replace(tmp_filename, self.filename)
+        except OSError:
+            self.dirty = True
+            raise
+        return True
@@ -0,0 +1,50 @@
+import asyncio
+
+UNKNOWN = "unknown"
+
+class VersionChecker:
+    """Compares the local commit with origin HEAD in the background and caches the result.
+
+    The local commit cannot change while the process runs, so it is resolved once.
+    The remote is refreshed by refresh(), which a periodic job calls; readers only
+    look at status and never wait for git or the network.
+    """
+    def __init__(self, directory, timeout=10):
+        self.directory = directory
+        self.timeout = timeout
+        self.local = None
+        self.remote = None
+        self.status = UNKNOWN
+
+    async def git(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            'git', '-C', self.directory, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"git {args[0]} exited with {process.returncode}")
+        return stdout.decode().strip()
+
+    async def refresh(self):
+        try:
+            if self.local is None:
+                self.local = await self.git('log', '-1', '--format=%H')  # 获取本地最新提交的哈希值
+            output = await self.git('ls-remote', 'origin', 'HEAD')
+            self.remote = output.split('\t')[0]  # 获取远程最新提交的哈希值
+        except (OSError, RuntimeError, asyncio.TimeoutError) as e:
+            print("error: version check failed:", repr(e))
+            self.remote = None
+        if not self.local or not self.remote:
+            self.status = UNKNOWN
+        elif self.local == self.remote:
+            self.status = "Up to date."
+        else:
+            self.status = "A new version is available! Please redeploy."
+        return self.status
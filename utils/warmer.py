@@ -0,0 +1,53 @@
+import asyncio
+
+class ConnectionWarmer:
+    """Keeps pooled connections to upstream endpoints open so requests skip DNS, TCP and TLS setup.
+
+    Targets are (api_url, api_key) pairs of a ClientPool. warm_all() is meant for
+    startup, warm_soon() for an endpoint seen for the first time (e.g. a user's
+    own api_url), and keep_warm() runs periodically and pings every endpoint
+    that has been idle for an interval. interval must stay below the pool's
+    keepalive_expiry, otherwise the connections close between pings.
+    """
+    def __init__(self, pool, interval=45, timeout=10):
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self.pending = set()
+        self.tasks = set()
+        self.warmed = 0
+        self.failed = 0
+
+    async def warm(self, api_url, api_key):
+        try:
+            await self.pool.ping(api_url, api_key, self.timeout)
+        except Exception as e:
+            self.failed += 1
+            print("error: warm-up failed:", self.pool.label(api_url, api_key), e)
+            return False
+        self.warmed += 1
+        return True
+
+    async def warm_all(self, targets, pin=False):
+        targets = set(targets)
+        if pin:
+            self.pool.pinned.update(targets)
+        results = await asyncio.gather(*(self.warm(*target) for target in targets))
+        return sum(results)
+
+    def warm_soon(self, targets):
+        """Warm targets with no recent activity in the background, without waiting for it."""
+        for target in targets:
+            if target in self.pending or self.pool.idle_for(*target) < self.interval:
+                continue
+            self.pending.add(target)
+            task = asyncio.create_task(self.warm(*target))
+            self.tasks.add(task)
+            task.add_done_callback(lambda task, target=target: (self.tasks.discard(task), self.pending.discard(target)))
+
+    async def keep_warm(self):
+        targets = [target for target in self.pool.pinned | set(self.pool.clients) if self.pool.idle_for(*target) >= self.interval]
+        return await self.warm_all(targets)
+
+    def stats(self):
+        return {"warmed": self.warmed, "failed": self.failed, "pinned": len(self.pool.pinned)}